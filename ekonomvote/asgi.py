@@ -5,6 +5,28 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+Tryb ASGI
+---------
+Serwowanie przez ASGI włącza asynchroniczne widoki odczytu samorządu (SAMORZAD_ASYNC_VIEWS), więc jeden
+proces obsługuje wielu równoczesnych obserwujących wyniki, a strumień wyników na żywo (samorzad:stream_results)
+nie blokuje workera. Asynchroniczny jest też callback logowania (office_auth:microsoft_callback), który
+większość czasu czeka na Microsoft Entra ID i Graph. Pozostałe widoki działają bez zmian w puli wątków. Uruchomienie:
+
+    gunicorn ekonomvote.asgi:application -k uvicorn.workers.UvicornWorker -w 4 --bind 0.0.0.0:8000
+
+lub lokalnie:
+
+    uvicorn ekonomvote.asgi:application --port 8000
+
+Wszystkie workery muszą współdzielić cache (REDIS_URL), inaczej podbicie wersji wyników nie dotrze do
+pozostałych procesów. Porównanie z trybem WSGI (gunicorn ekonomvote.wsgi) wykonuje komenda:
+
+    python manage.py benchmark_results --url http://127.0.0.1:8000 --voting <id>
+
+a logowania względem lokalnej atrapy dostawcy tożsamości:
+
+    python manage.py benchmark_microsoft_login --logins 200 --latency 150
 """
 
 import os
@@ -12,5 +34,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ekonomvote.settings')
+os.environ.setdefault('SAMORZAD_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
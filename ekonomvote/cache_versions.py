@@ -0,0 +1,36 @@
+"""Liczniki wersji w cache do unieważniania zcache'owanych danych bez usuwania wpisów (wyniki głosowań
+samorzad.results, role użytkowników office_auth.auth_utils). Dane zapisuje się pod kluczem zawierającym
+bieżącą wersję, a podbicie wersji sprawia, że stare wpisy przestają być czytane.
+
+Wersja startowa jest oparta o czas, żeby po wypadnięciu klucza z cache nie wrócić do numeru wersji,
+pod którym mogą leżeć nieaktualne dane (w cache lub np. w sesji użytkownika)"""
+from django.core.cache import cache
+
+import time
+
+
+def get_version(key: str) -> int:
+    """Zwraca bieżącą wersję, przy braku klucza zapisuje wersję startową"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(key: str) -> int:
+    """Asynchroniczna wersja get_version"""
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_version(key: str):
+    """Podbija wersję, unieważniając dane zapisane pod poprzednimi wersjami"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Brak klucza w cache, nowa wersja startowa i tak jest większa od wszystkich poprzednich
+        cache.add(key, time.time_ns(), timeout=None)
@@ -0,0 +1,10 @@
+"""Zapis wierszy poleceniem COPY ... FROM STDIN (PostgreSQL z psycopg 3). Django nie udostępnia COPY,
+dlatego copy() jest wywoływane na kursorze psycopg (CursorWrapper.cursor) kursora Django. Wiersze nie
+przechodzą przez save() ani sygnały modeli, wartości muszą być już przygotowane do zapisu (np. get_db_prep_save)"""
+
+
+def copy_rows(cursor, sql: str, rows):
+    """Zapisuje wiersze rows (krotki wartości kolumn) poleceniem COPY sql przez kursor Django cursor"""
+    with cursor.cursor.copy(sql) as copy:
+        for row in rows:
+            copy.write_row(row)
@@ -0,0 +1,118 @@
+"""Backend PostgreSQL z pulą połączeń psycopg_pool (ENGINE = 'ekonomvote.db.postgresql_pool').
+
+Django 4.2 nie ma wbudowanej puli (OPTIONS['pool'] pojawia się w Django 5.1), więc backend pobiera połączenia
+z ConnectionPool zamiast otwierać nowe i oddaje je do puli tam, gdzie Django by je zamknęło (koniec żądania
+przy CONN_MAX_AGE = 0). Pula jest jedna na proces i bazę danych, współdzielona przez wszystkie wątki.
+Ustawienia puli (min_size, max_size, timeout, max_idle, max_lifetime) są w OPTIONS['pool'], a przy
+CONN_HEALTH_CHECKS pula sprawdza połączenie przed wydaniem (ConnectionPool.check_connection).
+
+Pula jest tworzona przy pierwszym połączeniu, czyli w procesie workera, a nie w procesie nadrzędnym gunicorna
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgreSQLDatabaseWrapper
+from django.db.backends.postgresql.creation import DatabaseCreation as PostgreSQLDatabaseCreation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel, is_psycopg3
+
+import logging
+import threading
+import time
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError:
+    ConnectionPool = None
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool_stats() -> dict:
+    """Statystyki pul połączeń bieżącego procesu: {alias: ConnectionPool.get_stats()}"""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {alias: pool.get_stats() for (alias, name), pool in pools}
+
+
+def close_pool(alias: str, name: str):
+    """Zamyka pulę połączeń z bazą danych name (np. przed usunięciem bazy testowej)"""
+    with _pools_lock:
+        pool = _pools.pop((alias, name), None)
+    if pool is not None:
+        pool.close()
+
+
+class DatabaseCreation(PostgreSQLDatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Bezczynne połączenia w puli blokowałyby DROP DATABASE
+        close_pool(self.connection.alias, test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(PostgreSQLDatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._connection_pool = None
+
+    @property
+    def pool_options(self) -> dict:
+        return dict(self.settings_dict['OPTIONS'].get('pool') or {})
+
+    def get_pool(self):
+        # Połączenie bez wskazania bazy (np. tworzenie bazy testowej) nie korzysta z puli
+        if self.settings_dict['NAME'] is None:
+            return None
+        if not is_psycopg3 or ConnectionPool is None:
+            raise ImproperlyConfigured(
+                "ekonomvote.db.postgresql_pool wymaga psycopg 3 i psycopg_pool. Bez puli ustaw "
+                "DB_CONNECTION_MODE=persistent"
+            )
+        if self.settings_dict['CONN_MAX_AGE'] != 0:
+            raise ImproperlyConfigured("Pula połączeń wymaga CONN_MAX_AGE = 0, połączenie wraca do puli po żądaniu")
+        key = (self.alias, self.settings_dict['NAME'])
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(
+                    kwargs=self.get_connection_params(),
+                    check=ConnectionPool.check_connection if self.settings_dict['CONN_HEALTH_CHECKS'] else None,
+                    name=f'ekonomvote-{self.alias}',
+                    open=True,
+                    **self.pool_options,
+                )
+        return pool
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool()
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = IsolationLevel(options.get('isolation_level', IsolationLevel.READ_COMMITTED))
+        started = time.perf_counter()
+        connection = pool.getconn()
+        waited = time.perf_counter() - started
+        if waited > settings.DB_POOL_WAIT_WARNING:
+            # Wszystkie połączenia były zajęte, warto zwiększyć max_size lub liczbę połączeń serwera
+            logger.warning('Oczekiwanie na połączenie z puli %s: %.0f ms, %s', self.alias, waited * 1000, pool.get_stats())
+        if 'isolation_level' in options:
+            connection.isolation_level = self.isolation_level
+        self._connection_pool = pool
+        return connection
+
+    def _close(self):
+        if self.connection is None or self._connection_pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            # Pula wycofuje niezakończoną transakcję i odrzuca zepsute połączenie
+            self._connection_pool.putconn(self.connection)
+        self._connection_pool = None
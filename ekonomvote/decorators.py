@@ -0,0 +1,34 @@
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseNotAllowed
+from asgiref.sync import sync_to_async
+
+from functools import wraps
+
+
+# Dekoratory widoków w Django 4.2 (login_required, require_http_methods) obsługują tylko widoki synchroniczne,
+# poniższe są ich odpowiednikami dla widoków asynchronicznych
+
+def async_login_required(login_url: str):
+    """login_required dla widoku asynchronicznego. Użytkownik (sesja) jest wczytywany w wątku,
+    bo leniwy request.user odpytuje bazę danych"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+            if not is_authenticated:
+                return redirect_to_login(request.get_full_path(), login_url)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def async_require_http_methods(methods: list[str]):
+    """require_http_methods dla widoku asynchronicznego"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,18 @@
+"""Percentyle czasów odpowiedzi w raportach komend obciążeniowych (benchmark_microsoft_login,
+benchmark_results, loadtest)"""
+import statistics
+
+
+def percentiles(latencies: list[float]) -> tuple[float, float, float]:
+    """Zwraca (p50, p95, p99) czasów. statistics.quantiles wymaga co najmniej dwóch próbek,
+    dla jednej wszystkie percentyle są jej wartością"""
+    if len(latencies) < 2:
+        return latencies[0], latencies[0], latencies[0]
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49], quantiles[94], quantiles[98]
+
+
+def format_percentiles(latencies_ms: list[float]) -> str:
+    """Percentyle czasów w milisekundach do raportu, np. 'p50 12.0 ms, p95 40.1 ms, p99 85.3 ms'"""
+    p50, p95, p99 = percentiles(latencies_ms)
+    return f'p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms'
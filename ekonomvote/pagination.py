@@ -0,0 +1,94 @@
+from django.core import signing
+from django.db.models import Q, QuerySet
+
+import datetime
+
+
+# Paginacja kursorem (keyset) dla list przewijanych bez końca (HTMX hx-trigger="revealed"). Zamiast
+# COUNT(*) i OFFSET (django.core.paginator.Paginator) kolejna strona to warunek WHERE na wartościach
+# sortowania ostatniego elementu poprzedniej strony, więc koszt strony nie zależy od jej głębokości
+
+
+class KeysetPage:
+    """Strona wyników KeysetPaginator, pola:
+
+    - object_list: Obiekty strony
+    - has_next: Czy istnieje następna strona (sprawdzane jednym dodatkowym wierszem, bez zapytania COUNT)
+    - next_cursor: Kursor następnej strony do parametru GET lub None
+    """
+
+    def __init__(self, object_list: list, has_next: bool, next_cursor: str | None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """Paginacja kursorem po polach ordering (np. ('-planned_end', '-id')). Pola sortowania nie mogą być null,
+    a ostatnie z nich musi być unikalne, żeby kolejność była jednoznaczna. Najlepiej, żeby istniał indeks
+    na polach sortowania w tej kolejności. Kursor jest podpisany (django.core.signing), nieprawidłowy
+    kursor zwraca pierwszą stronę"""
+
+    salt = 'ekonomvote.pagination'
+
+    def __init__(self, queryset: QuerySet, ordering: tuple[str, ...], per_page: int):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.per_page = per_page
+
+    def encode_cursor(self, obj) -> str:
+        # Daty w pełnym formacie ISO, DjangoJSONEncoder obcina mikrosekundy, a kursor musi wskazywać dokładną wartość
+        values = [getattr(obj, field) for field in self.fields]
+        return signing.dumps(
+            [value.isoformat() if isinstance(value, (datetime.date, datetime.time)) else value for value in values],
+            salt=self.salt
+        )
+
+    def decode_cursor(self, cursor: str | None) -> list | None:
+        if not cursor:
+            return None
+        try:
+            values = signing.loads(cursor, salt=self.salt)
+        except signing.BadSignature:
+            return None
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            return None
+        return values
+
+    def _after(self, values: list) -> Q:
+        """Warunek "za kursorem": (a > x) OR (a = x AND b > y) OR ..., z < dla pól sortowanych malejąco.
+        Dodatkowe a >= x (a <= x) pozwala wykorzystać indeks na pierwszym polu sortowania"""
+        condition = Q()
+        equal = Q()
+        for field, ordering, value in zip(self.fields, self.ordering, values):
+            lookup = 'lt' if ordering.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        first_lookup = 'lte' if self.ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{self.fields[0]}__{first_lookup}': values[0]}) & condition
+
+    def _page_queryset(self, cursor: str | None) -> QuerySet:
+        values = self.decode_cursor(cursor)
+        queryset = self.queryset if values is None else self.queryset.filter(self._after(values))
+        # Jeden wiersz więcej tylko do sprawdzenia czy istnieje następna strona
+        return queryset[:self.per_page + 1]
+
+    def _build_page(self, rows: list) -> KeysetPage:
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        next_cursor = self.encode_cursor(rows[-1]) if has_next else None
+        return KeysetPage(rows, has_next, next_cursor)
+
+    def get_page(self, cursor: str | None) -> KeysetPage:
+        return self._build_page(list(self._page_queryset(cursor)))
+
+    async def aget_page(self, cursor: str | None) -> KeysetPage:
+        """Asynchroniczna wersja get_page"""
+        return self._build_page([obj async for obj in self._page_queryset(cursor)])
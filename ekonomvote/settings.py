@@ -14,6 +14,7 @@ from pathlib import Path
 from django.conf.global_settings import LOGIN_REDIRECT_URL, MEDIA_ROOT
 from dotenv import load_dotenv
 from django.utils import timezone
+from django.core.exceptions import ImproperlyConfigured
 import os
 
 load_dotenv()
@@ -53,6 +54,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # Indeksy PostgreSQL (BrinIndex w samorzad.models.Vote i oscary.models.Vote)
+    'django.contrib.postgres',
     'django_jinja',
 ]
 
@@ -116,9 +119,102 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Połączenia z bazą danych (DB_CONNECTION_MODE, domyślnie direct):
+# - pool: pula połączeń psycopg_pool współdzielona przez wątki procesu (ekonomvote/db/postgresql_pool),
+#   połączenie wraca do puli po każdym żądaniu. Łączna liczba połączeń to max_size * liczba workerów
+# - persistent: bez puli, każdy wątek trzyma własne połączenie przez DB_CONN_MAX_AGE sekund
+# - direct: nowe połączenie na każde żądanie (standardowy silnik django.db.backends.postgresql)
+DB_CONNECTION_MODE = os.getenv('DB_CONNECTION_MODE', 'direct')
+if DB_CONNECTION_MODE == 'pool':
+    DATABASES['default']['ENGINE'] = 'ekonomvote.db.postgresql_pool'
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            # Czas oczekiwania na wolne połączenie, po nim żądanie kończy się błędem
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 600)),
+            'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+        },
+    }
+elif DB_CONNECTION_MODE == 'persistent':
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+elif DB_CONNECTION_MODE != 'direct':
+    raise ImproperlyConfigured(f"Nieznany DB_CONNECTION_MODE: {DB_CONNECTION_MODE}")
+# Oczekiwanie na połączenie z puli (w sekundach), powyżej którego logowane jest ostrzeżenie ze statystykami puli
+DB_POOL_WAIT_WARNING = float(os.getenv('DB_POOL_WAIT_WARNING', 0.1))
+
+# Cache
+# Bez REDIS_URL (np. w testach i lokalnie) używany jest cache w pamięci procesu. Na produkcji wszystkie
+# procesy serwera muszą współdzielić cache, inaczej podbicie wersji wyników nie dotrze do pozostałych workerów.
+# Bez wspólnego cache (SHARED_CACHE = False) role użytkowników nie są czytane z sesji (office_auth.auth_utils.get_roles)
+SHARED_CACHE = bool(os.getenv('REDIS_URL'))
+if SHARED_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+    SESSION_CACHE_ALIAS = 'default'
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ekonomvote',
+        },
+        # Cache w pamięci procesu nie widzi wylogowania w innym workerze, sesje są wtedy czytane z bazy danych
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        },
+    }
+    SESSION_CACHE_ALIAS = 'sessions'
+
+# Sesje: odczyt z cache, zapis do bazy danych i cache, najwyżej jeden zapis na żądanie (office_auth/sessions.py)
+SESSION_ENGINE = 'office_auth.sessions'
+# Sesje wyborców (tylko dane logowania i role) w podpisanym ciasteczku, bez zapisu na serwerze. Wylogowanie nie
+# unieważnia wtedy skopiowanego ciasteczka przed upływem SESSION_COOKIE_AGE
+SESSION_SIGNED_VOTER_COOKIES = os.getenv('SESSION_SIGNED_VOTER_COOKIES') == '1'
+
+# Czas życia (w sekundach) zcache'owanych wyników głosowań samorządu. Wpisy trwającego głosowania
+# unieważnia podbicie wersji wyników, TTL ogranicza tylko czas przechowywania nieaktualnych wersji.
+# Wyniki zakończonych głosowań są czytane z samorzad.models.VotingResultSnapshot, do cache trafiają
+# (z TTL_FINISHED) tylko do czasu zapisania snapshotu przez komendę finalize_votings
+SAMORZAD_RESULTS_CACHE_TTL_LIVE = int(os.getenv('SAMORZAD_RESULTS_CACHE_TTL_LIVE', 60))
+SAMORZAD_RESULTS_CACHE_TTL_FINISHED = int(os.getenv('SAMORZAD_RESULTS_CACHE_TTL_FINISHED', 60 * 60 * 24))
+
+# Odstęp (w sekundach) sprawdzania wersji wyników przez strumień wyników na żywo (samorzad.live) oraz
+# maksymalny czas bez danych w strumieniu, po którym wysyłany jest komentarz podtrzymujący połączenie
+SAMORZAD_LIVE_RESULTS_INTERVAL = float(os.getenv('SAMORZAD_LIVE_RESULTS_INTERVAL', 2))
+SAMORZAD_LIVE_RESULTS_KEEPALIVE = float(os.getenv('SAMORZAD_LIVE_RESULTS_KEEPALIVE', 15))
+
+# Tryb ASGI: publiczne widoki odczytu samorządu i callback logowania Microsoft w wersji asynchronicznej
+# (ustawiane domyślnie przez ekonomvote/asgi.py)
+SAMORZAD_ASYNC_VIEWS = os.getenv('SAMORZAD_ASYNC_VIEWS') == '1'
+
+# Zapis kart do głosowania samorządu: 'direct' - w transakcji żądania, 'buffered' - przez trwały dziennik
+# przenoszony do bazy komendą flush_vote_log (samorzad/ingest.py, wymaga REDIS_URL)
+SAMORZAD_VOTE_INGESTION = os.getenv('SAMORZAD_VOTE_INGESTION', 'direct')
+if SAMORZAD_VOTE_INGESTION not in ('direct', 'buffered'):
+    raise ImproperlyConfigured(f"Nieznany SAMORZAD_VOTE_INGESTION: {SAMORZAD_VOTE_INGESTION}")
+if SAMORZAD_VOTE_INGESTION == 'buffered' and not SHARED_CACHE:
+    # Rezerwacja karty (cache.add) chroni przed drugą kartą użytkownika tylko we wspólnym cache wszystkich workerów
+    raise ImproperlyConfigured("SAMORZAD_VOTE_INGESTION = 'buffered' wymaga wspólnego cache (REDIS_URL)")
+SAMORZAD_INGEST_DIR = os.getenv('SAMORZAD_INGEST_DIR', BASE_DIR / 'var' / 'vote_log')
+SAMORZAD_INGEST_SEGMENT_BYTES = int(os.getenv('SAMORZAD_INGEST_SEGMENT_BYTES', 4 * 1024 * 1024))
+SAMORZAD_INGEST_SEGMENT_SECONDS = float(os.getenv('SAMORZAD_INGEST_SEGMENT_SECONDS', 5))
+
+# Rozmiar danych (ekonomvote.tests.query_budgets.seed_dataset), na którym test budżetów zapytań porównuje liczbę
+# zapytań widoków z pomiarem na najmniejszych danych. Czas odpowiedzi zależy od maszyny, test porównuje go
+# z budżetem tylko z QUERY_BUDGET_CHECK_TIME=1. QUERY_BUDGET_WRITE=1 zapisuje zmierzone wartości jako nowe budżety
+QUERY_BUDGET_SCALE = int(os.getenv('QUERY_BUDGET_SCALE', 3))
+QUERY_BUDGET_CHECK_TIME = os.getenv('QUERY_BUDGET_CHECK_TIME') == '1'
+QUERY_BUDGET_WRITE = os.getenv('QUERY_BUDGET_WRITE') == '1'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -167,6 +263,15 @@ MICROSOFT_CLIENT_SECRET = os.getenv('MICROSOFT_CLIENT_SECRET')
 MICROSOFT_TENANT_ID = os.getenv('MICROSOFT_TENANT_ID')
 MICROSOFT_REDIRECT = os.getenv('MICROSOFT_REDIRECT')
 MICROSOFT_LOGOUT = os.getenv('MICROSOFT_LOGOUT')
+MICROSOFT_AUTHORITY_HOST = os.getenv('MICROSOFT_AUTHORITY_HOST', 'https://login.microsoftonline.com')
+MICROSOFT_GRAPH_URL = os.getenv('MICROSOFT_GRAPH_URL', 'https://graph.microsoft.com/v1.0')
+# Połączenia z Microsoft Entra ID i Graph (office_auth/http_client.py), timeouty w sekundach
+MICROSOFT_HTTP_CONNECT_TIMEOUT = float(os.getenv('MICROSOFT_HTTP_CONNECT_TIMEOUT', 3.05))
+MICROSOFT_HTTP_READ_TIMEOUT = float(os.getenv('MICROSOFT_HTTP_READ_TIMEOUT', 10))
+MICROSOFT_HTTP_RETRIES = int(os.getenv('MICROSOFT_HTTP_RETRIES', 2))
+MICROSOFT_HTTP_POOL_SIZE = int(os.getenv('MICROSOFT_HTTP_POOL_SIZE', 20))
+# Limit równoczesnych połączeń asynchronicznego callbacku logowania (office_auth/async_auth.py) na proces
+MICROSOFT_ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv('MICROSOFT_ASYNC_HTTP_MAX_CONNECTIONS', 100))
 LOGIN_URL = '/microsoft-authentication/login'
 
 # Wskazanie domyślnego modelu użytkownika
@@ -0,0 +1,416 @@
+"""Budżety liczby zapytań SQL widoków (samorzad.urls, panel.urls, office_auth.urls).
+
+Każdy widok jest wywoływany na danych utworzonych przez seed_dataset w dwóch rozmiarach. Liczba zapytań widoku
+nie może zależeć od ilości danych (zapytanie w pętli po obiektach, tzw. N+1), a w obu rozmiarach nie może
+przekraczać budżetu z pliku query_budgets.json. Budżety sprawdza test ekonomvote.tests.test_query_budgets,
+ten sam test z QUERY_BUDGET_WRITE=1 zapisuje zmierzone wartości jako nowe budżety i wypisuje pomiary:
+QUERY_BUDGET_WRITE=1 python manage.py test ekonomvote.tests.test_query_budgets
+
+Pomiar działa tylko w testach: na bazie testowej, z cache w pamięci procesu i bez buforowanego zapisu kart,
+więc nie czyści cache ani nie dopisuje kart do dziennika działającej aplikacji. Czas odpowiedzi zależy
+od maszyny, więc jest tylko raportowany. Z budżetem czasu z pliku jest porównywany po włączeniu
+QUERY_BUDGET_CHECK_TIME.
+
+Widok jest wywoływany dwa razy, mierzone jest drugie wywołanie (z wypełnionym cache, tak jak w działającym
+procesie). Zmiany wprowadzone przez żądanie są wycofywane (savepoint), więc oba wywołania zastają te same dane"""
+from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from django.utils.timezone import timedelta
+
+import itertools
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from importlib import import_module
+from pathlib import Path
+from unittest import mock
+
+from office_auth import auth_utils
+from office_auth.auth_utils import OPIEKUN_ROLE
+from office_auth.fake_idp import FakeIdentityProvider, FakeIdentityProviderAdapter
+from office_auth.http_client import build_session
+from office_auth.models import AzureUser, ActionLog
+from oscary.models import Oscar, Teacher, VotingEvent, VotingRound, Vote as OscarVote
+from samorzad import results
+from samorzad.ballot import BallotSnapshot, cast_ballot
+from samorzad.models import Voting, Candidate, CandidateRegistration, ElectoralProgram
+from samorzad.views import _old_votings_paginator
+
+BUDGETS_PATH = Path(__file__).with_name('query_budgets.json')
+URLCONFS = ('samorzad.urls', 'panel.urls', 'office_auth.urls')
+# Kandydatur w głosowaniu może być najwyżej 15 (CandidateRegistration.clean)
+MAX_REGISTRATIONS = 15
+
+MEASURE_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'query_budgets',
+    },
+}
+
+_sequence = itertools.count()
+
+
+class Dataset:
+    """Obiekty utworzone przez seed_dataset, do których odwołują się adresy mierzonych widoków"""
+
+    def __init__(self, **objects):
+        self.__dict__.update(objects)
+
+
+def _create_voting(candidates: list[Candidate], votes_per_user: int = 2) -> tuple[Voting, list[CandidateRegistration]]:
+    """Głosowanie z kandydaturami. Kandydatury można dodać tylko przed startem, daty ustawia potem _move_voting"""
+    now = timezone.now()
+    voting = Voting.objects.create(
+        planned_start=now + timedelta(days=1),
+        planned_end=now + timedelta(days=2),
+        votes_per_user=votes_per_user
+    )
+    registrations = []
+    for candidate in candidates[:MAX_REGISTRATIONS]:
+        registration = CandidateRegistration.objects.create(candidate=candidate, voting=voting, is_eligible=True)
+        ElectoralProgram.objects.create(candidature=registration, info=f'Program wyborczy {candidate.last_name}')
+        registrations.append(registration)
+    return voting, registrations
+
+
+def _move_voting(voting: Voting, start: timedelta, end: timedelta):
+    """Przesuwa głosowanie względem obecnej chwili z pominięciem walidacji Voting.clean"""
+    now = timezone.now()
+    Voting.objects.filter(pk=voting.pk).update(planned_start=now + start, planned_end=now + end)
+    voting.refresh_from_db()
+
+
+def _cast_ballots(voting: Voting, registrations: list[CandidateRegistration], voters: list[AzureUser]):
+    for number, voter in enumerate(voters):
+        chosen = [registrations[(number + offset) % len(registrations)].id for offset in range(voting.votes_per_user)]
+        cast_ballot(BallotSnapshot(voting, voter), chosen)
+
+
+def seed_dataset(scale: int) -> Dataset:
+    """Tworzy dane do pomiaru widoków, ich ilość rośnie liniowo ze scale (np. liczba głosowań, kandydatów,
+    wyborców, oscarów i wpisów ActionLog). Obiekty, do których odwołują się adresy widoków, mają tym więcej
+    powiązań im większe scale (np. kandydatur trwającego głosowania jest 3 * scale, najwyżej 15)"""
+    if scale < 1:
+        raise ValueError(f"Rozmiar danych musi być dodatni: {scale}")
+    number = next(_sequence)
+    opiekunowie, _ = Group.objects.get_or_create(name=OPIEKUN_ROLE)
+    wyborcy, _ = Group.objects.get_or_create(name='wyborcy')
+    opiekun = AzureUser.objects.create(username=f'budget-opiekun-{number}', microsoft_user_id=f'budget-opiekun-{number}')
+    opiekun.groups.add(opiekunowie)
+    voters = []
+    for index in range(4 * scale):
+        voter = AzureUser.objects.create(username=f'budget-{number}-{index}', microsoft_user_id=f'budget-{number}-{index}')
+        voter.groups.add(wyborcy)
+        voters.append(voter)
+    voter = voters[0]
+
+    # Samorząd
+    candidates = [
+        Candidate.objects.create(first_name='Jan', last_name=f'Kandydat{number}x{index}', school_class='3A')
+        for index in range(max(3, 3 * scale))
+    ]
+    live_voting, live_registrations = _create_voting(candidates)
+    planned_voting, _ = _create_voting(candidates[:3])
+    finished_votings = []
+    for index in range(scale):
+        voting, registrations = _create_voting(candidates[index * 3:index * 3 + 3])
+        _move_voting(voting, timedelta(days=-3), timedelta(days=1))
+        _cast_ballots(voting, registrations, voters)
+        _move_voting(voting, timedelta(days=-3), timedelta(hours=-index - 1))
+        results.finalize_voting(voting)
+        finished_votings.append(voting)
+    # Najstarsze z zakończonych głosowań
+    finished_voting = finished_votings[-1]
+    _move_voting(live_voting, timedelta(days=-1), timedelta(days=1))
+    # Wyborca z voters[0] jeszcze nie głosował, więc widzi w trwającym głosowaniu kartę do głosowania
+    _cast_ballots(live_voting, live_registrations, voters[1:])
+    # Usuwane są obiekty bez powiązań. Kaskadowe usunięcie zapisuje wpis auditlog dla każdego powiązanego obiektu,
+    # co celowo zależy od ilości danych
+    disposable_voting, _ = _create_voting([])
+    disposable_candidate = Candidate.objects.create(first_name='Jan', last_name=f'Usuwany{number}', school_class='3A')
+    disposable_registration = CandidateRegistration.objects.create(candidate=disposable_candidate, voting=planned_voting)
+
+    # Oscary
+    oscars = [Oscar.objects.create(name=f'Oscar {number}-{index}', info='Opis') for index in range(2 * scale)]
+    teachers = [Teacher.objects.create(first_name='Anna', last_name=f'Nauczyciel{number}x{index}', info='Opis') for index in range(2 * scale)]
+    # Co najmniej dwa wydarzenia, formularz kandydatury pokazuje wydarzenia inne niż wybrane (prefetch_related
+    # pustej listy nie wykonuje zapytania)
+    for index in range(scale + 1):
+        voting_event = VotingEvent.objects.create(with_nominations=False)
+        final_round = VotingRound.objects.create(
+            voting_event=voting_event,
+            planned_start=timezone.now() + timedelta(days=index + 1),
+            planned_end=timezone.now() + timedelta(days=index + 2),
+            round_type=VotingRound.VotingRoundType.FINAL
+        )
+        voting_event.populate_first_round(first_round=final_round)
+    candidatures = list(final_round.candidatures.all())
+    for oscar_voter, candidature in zip(voters, itertools.cycle(candidatures)):
+        OscarVote.objects.create(candidature=candidature, microsoft_user=oscar_voter)
+    disposable_oscar = Oscar.objects.create(name=f'Oscar usuwany {number}', info='Opis')
+    disposable_teacher = Teacher.objects.create(first_name='Anna', last_name=f'Usuwany{number}', info='Opis')
+    disposable_voting_event = VotingEvent.objects.create(with_nominations=False)
+    VotingRound.objects.create(
+        voting_event=disposable_voting_event,
+        planned_start=timezone.now() + timedelta(days=1),
+        planned_end=timezone.now() + timedelta(days=2),
+        round_type=VotingRound.VotingRoundType.FINAL
+    )
+
+    # Dziennik akcji panelu
+    voting_content_type = ContentType.objects.get_for_model(Voting)
+    ActionLog.objects.bulk_create(
+        ActionLog(
+            user=opiekun,
+            action_type=ActionLog.ActionType.UPDATE,
+            altered_fields={'votes_per_user': {'old': 1, 'new': 2}},
+            content_type=voting_content_type,
+            object_id=live_voting.id
+        ) for _ in range(10 * scale)
+    )
+    return Dataset(
+        opiekun=opiekun,
+        voter=voter,
+        candidate=candidates[0],
+        live_voting=live_voting,
+        live_registrations=live_registrations,
+        finished_voting=finished_voting,
+        registration=live_registrations[0],
+        electoral_program=live_registrations[0].electoral_program,
+        voting_event=voting_event,
+        oscar=oscars[0],
+        teacher=teachers[0],
+        candidature=candidatures[0],
+        disposable_voting=disposable_voting,
+        disposable_candidate=disposable_candidate,
+        disposable_registration=disposable_registration,
+        disposable_candidature=candidatures[-1],
+        disposable_oscar=disposable_oscar,
+        disposable_teacher=disposable_teacher,
+        disposable_voting_event=disposable_voting_event,
+    )
+
+
+class Case:
+    """Pojedyncze wywołanie widoku: nazwa w pliku budżetów, adres, metoda, dane POST i zalogowany użytkownik
+    ('opiekun', 'voter' albo None)"""
+
+    def __init__(self, name: str, url: str, user: str | None, method: str = 'get', data: dict | None = None):
+        self.name = name
+        self.url = url
+        self.user = user
+        self.method = method
+        self.data = data or {}
+
+
+class Measurement:
+    def __init__(self, queries: int, ms: float, status: int):
+        self.queries = queries
+        self.ms = ms
+        self.status = status
+
+
+# Argumenty adresów według nazwy parametru i wyjątki dla widoków, w których ten sam parametr oznacza inny obiekt
+URL_ARGUMENTS = {
+    'voting_id': lambda dataset: dataset.live_voting.id,
+    'candidate_id': lambda dataset: dataset.candidate.id,
+    'candidature_id': lambda dataset: dataset.candidature.id,
+    'electoral_program_id': lambda dataset: dataset.electoral_program.id,
+    'voting_event_id': lambda dataset: dataset.voting_event.id,
+    'oscar_id': lambda dataset: dataset.oscar.id,
+    'teacher_id': lambda dataset: dataset.teacher.id,
+}
+URL_ARGUMENT_OVERRIDES = {
+    'panel:update_registration': {'candidature_id': lambda dataset: dataset.registration.id},
+    # Strumień SSE trwającego głosowania nie kończy się, zakończone głosowanie zwraca od razu 204
+    'samorzad:stream_results': {'voting_id': lambda dataset: dataset.finished_voting.id},
+}
+# Widoki przyjmujące tylko POST i ich dane
+POST_DATA = {
+    'panel:delete_voting': lambda dataset: {'voting_id': dataset.disposable_voting.id},
+    'panel:delete_candidate': lambda dataset: {'candidate_id': dataset.disposable_candidate.id},
+    'panel:delete_registration': lambda dataset: {'candidature_id': dataset.disposable_registration.id},
+    'panel:delete_voting_event': lambda dataset: {'voting_event_id': dataset.disposable_voting_event.id},
+    'panel:delete_oscar': lambda dataset: {'oscar_id': dataset.disposable_oscar.id},
+    'panel:delete_teacher': lambda dataset: {'teacher_id': dataset.disposable_teacher.id},
+    'panel:delete_candidature': lambda dataset: {'candidature_id': dataset.disposable_candidature.id},
+}
+USERS = {'samorzad': 'voter', 'panel': 'opiekun', 'office_auth': None}
+
+
+def url_names() -> list[str]:
+    """Nazwy wszystkich widoków z mierzonych plików urls"""
+    names = []
+    for urlconf in URLCONFS:
+        module = import_module(urlconf)
+        names.extend(
+            f'{module.app_name}:{pattern.name}' for pattern in module.urlpatterns if isinstance(pattern, URLPattern)
+        )
+    return names
+
+
+def _url_kwargs(name: str, dataset: Dataset) -> dict:
+    namespace, url_name = name.split(':')
+    pattern = next(
+        pattern for pattern in import_module(f'{namespace}.urls').urlpatterns if pattern.name == url_name
+    )
+    arguments = URL_ARGUMENTS | URL_ARGUMENT_OVERRIDES.get(name, {})
+    return {parameter: arguments[parameter](dataset) for parameter in pattern.pattern.converters}
+
+
+def build_cases(dataset: Dataset) -> list[Case]:
+    cases = []
+    for name in url_names():
+        url = reverse(name, kwargs=_url_kwargs(name, dataset))
+        user = USERS[name.split(':')[0]]
+        if name in POST_DATA:
+            cases.append(Case(name, url, user, method='post', data=POST_DATA[name](dataset)))
+        else:
+            cases.append(Case(name, url, user))
+    cases.extend([
+        Case('office_auth:microsoft_callback [logowanie]', reverse('office_auth:microsoft_callback'), None,
+             data={'code': 'valid-budget'}),
+        Case('office_auth:logout [zalogowany]', reverse('office_auth:logout'), 'voter'),
+        Case('samorzad:get_voting_details [zakończone]',
+             reverse('samorzad:get_voting_details', kwargs={'voting_id': dataset.finished_voting.id}), 'voter'),
+        Case('samorzad:get_voting_details [głos]',
+             reverse('samorzad:get_voting_details', kwargs={'voting_id': dataset.live_voting.id}), 'voter',
+             method='post', data=_ballot_data(dataset)),
+        Case('samorzad:partial_list_old_votings [kursor]', reverse('samorzad:partial_list_old_votings'), 'voter',
+             data={'cursor': _old_votings_cursor(dataset)}),
+    ])
+    return cases
+
+
+def _ballot_data(dataset: Dataset) -> dict:
+    votes_per_user = dataset.live_voting.votes_per_user
+    data = {'form-TOTAL_FORMS': votes_per_user, 'form-INITIAL_FORMS': 0}
+    for index, registration in enumerate(dataset.live_registrations[:votes_per_user]):
+        data[f'form-{index}-candidate_registration_id'] = registration.id
+    return data
+
+
+def _old_votings_cursor(dataset: Dataset) -> str:
+    return _old_votings_paginator().encode_cursor(dataset.finished_voting)
+
+
+@contextmanager
+def identity_provider():
+    """Logowanie Microsoft przez lokalną atrapę dostawcy tożsamości (office_auth/fake_idp.py)"""
+    with override_settings(
+        MICROSOFT_CLIENT_ID='budget',
+        MICROSOFT_CLIENT_SECRET='budget',
+        MICROSOFT_TENANT_ID='budget',
+    ), FakeIdentityProvider() as idp:
+        session = build_session()
+        session.mount('https://', FakeIdentityProviderAdapter(idp.url))
+        authentication = auth_utils.Office365Authentication(http_client=session)
+        # Widok asynchroniczny (SAMORZAD_ASYNC_VIEWS) łączy się z atrapą bezpośrednio
+        with mock.patch.object(auth_utils, '_authentication', authentication), override_settings(
+            MICROSOFT_AUTHORITY_HOST=idp.url,
+            MICROSOFT_GRAPH_URL=f'{idp.url}/v1.0'
+        ):
+            yield
+
+
+def _call(case: Case, dataset: Dataset, queries: CaptureQueriesContext | None = None):
+    client = Client()
+    # Logowanie użytkownika przed żądaniem nie jest częścią pomiaru
+    if case.user is not None:
+        client.force_login(getattr(dataset, case.user))
+    # Zmiany wprowadzone przez żądanie są wycofywane, kolejne wywołanie zastaje te same dane
+    with transaction.atomic():
+        with nullcontext() if queries is None else queries:
+            started = time.perf_counter()
+            response = getattr(client, case.method)(case.url, case.data)
+            ms = (time.perf_counter() - started) * 1000
+        transaction.set_rollback(True)
+    return response, ms
+
+
+def measure_case(case: Case, dataset: Dataset) -> Measurement:
+    _call(case, dataset)
+    queries = CaptureQueriesContext(connection)
+    response, ms = _call(case, dataset, queries)
+    return Measurement(len(queries), ms, response.status_code)
+
+
+def measure(scale: int) -> dict[str, Measurement]:
+    """Tworzy dane w rozmiarze scale i mierzy wszystkie widoki. Dane są wycofywane po pomiarze"""
+    # Własny cache w pamięci procesu, czyszczenie nie dotyka cache skonfigurowanego w ustawieniach (np. Redis
+    # z sesjami i rezerwacjami kart). Wszystkie żądania obsługuje jeden proces, więc cache jest dla nich
+    # wspólny jak na produkcji (SHARED_CACHE)
+    with override_settings(
+        CACHES=MEASURE_CACHES,
+        SESSION_CACHE_ALIAS='default',
+        SHARED_CACHE=True,
+        SAMORZAD_VOTE_INGESTION='direct',
+        ALLOWED_HOSTS=['testserver'],
+    ):
+        cache.clear()
+        with transaction.atomic(), identity_provider():
+            dataset = seed_dataset(scale)
+            measurements = {case.name: measure_case(case, dataset) for case in build_cases(dataset)}
+            transaction.set_rollback(True)
+        cache.clear()
+    return measurements
+
+
+def load_budgets() -> dict[str, dict]:
+    with open(BUDGETS_PATH, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def write_budgets(measurements: dict[str, Measurement], time_factor: float = 10, min_ms: int = 250):
+    """Zapisuje zmierzone liczby zapytań jako budżety. Czas zależy od maszyny, więc budżet czasu to
+    time_factor razy zmierzony czas, nie mniej niż min_ms"""
+    budgets = {
+        name: {'queries': measurement.queries, 'ms': int(max(min_ms, round(measurement.ms * time_factor, -1)))}
+        for name, measurement in sorted(measurements.items())
+    }
+    with open(BUDGETS_PATH, 'w', encoding='utf-8') as file:
+        json.dump(budgets, file, indent=2, ensure_ascii=False)
+        file.write('\n')
+
+
+def format_report(small: dict[str, Measurement], large: dict[str, Measurement], budgets: dict[str, dict]) -> list[str]:
+    """Pomiary widoków: liczba zapytań w obu rozmiarach danych, czas i budżety"""
+    lines = []
+    for name, measurement in sorted(large.items()):
+        budget = budgets.get(name, {})
+        lines.append(
+            f'{name}: {small[name].queries} / {measurement.queries} zapytań (budżet {budget.get("queries", "-")}), '
+            f'{measurement.ms:.1f} ms (budżet {budget.get("ms", "-")}), status {measurement.status}'
+        )
+    return lines
+
+
+def check_budgets(small: dict[str, Measurement], large: dict[str, Measurement], budgets: dict[str, dict],
+                  check_time: bool = False) -> list[str]:
+    """Zwraca listę przekroczeń budżetów. small i large to pomiary measure dla dwóch rozmiarów danych.
+    Budżet czasu jest sprawdzany tylko z check_time"""
+    errors = []
+    for name in sorted(set(large) - set(budgets)):
+        errors.append(f'{name}: brak budżetu w {BUDGETS_PATH.name}')
+    for name in sorted(set(budgets) - set(large)):
+        errors.append(f'{name}: budżet widoku, którego nie ma w urls')
+    for name, measurement in sorted(large.items()):
+        if measurement.status >= 500:
+            errors.append(f'{name}: odpowiedź {measurement.status}')
+        if small[name].queries != measurement.queries:
+            errors.append(f'{name}: liczba zapytań rośnie z ilością danych ({small[name].queries} -> {measurement.queries})')
+        budget = budgets.get(name)
+        if budget is None:
+            continue
+        if measurement.queries > budget['queries']:
+            errors.append(f'{name}: {measurement.queries} zapytań, budżet {budget["queries"]}')
+        if check_time and measurement.ms > budget['ms']:
+            errors.append(f'{name}: {measurement.ms:.0f} ms, budżet {budget["ms"]} ms')
+    return errors
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.db import connection, connections
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipUnless
+
+from ekonomvote.db.postgresql_pool.base import get_pool_stats
+from office_auth.models import AzureUser
+
+
+@skipUnless(settings.DB_CONNECTION_MODE == 'pool', "Wymaga DB_CONNECTION_MODE=pool")
+class ConnectionPoolTest(TransactionTestCase):
+
+    def _query(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def _connections_made(self, pool):
+        return pool.get_stats().get('connections_num', 0)
+
+    def test_connection_returned_to_pool(self):
+        self._query()
+        pool = connection.get_pool()
+        pool.wait()
+        before = self._connections_made(pool)
+        for _ in range(5):
+            self._query()
+            # Tak jak na koniec żądania, połączenie wraca do puli zamiast być zamknięte
+            connection.close()
+        self.assertEqual(self._connections_made(pool), before)
+        self.assertGreaterEqual(pool.get_stats()['pool_available'], 1)
+
+    def test_pool_shared_between_threads(self):
+        def query(_):
+            try:
+                with connections['default'].cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    return cursor.fetchone()[0]
+            finally:
+                connections['default'].close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertEqual(list(executor.map(query, range(50))), [1] * 50)
+        stats = get_pool_stats()['default']
+        self.assertLessEqual(stats['pool_size'], settings.DATABASES['default']['OPTIONS']['pool']['max_size'])
+
+    def test_pool_stats_view(self):
+        self._query()
+        user = AzureUser.objects.create(username='admin', is_staff=True)
+        self.client.force_login(user)
+        response = self.client.get(reverse('db_pool_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('default', response.json()['pools'])
@@ -0,0 +1,51 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.timezone import timedelta
+
+from asgiref.sync import async_to_sync
+
+from ekonomvote.pagination import KeysetPaginator
+from samorzad.models import Voting
+
+
+class KeysetPaginatorTest(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        for i in range(7):
+            Voting.objects.create(planned_start=now + timedelta(days=1), planned_end=now + timedelta(days=2 + i))
+        # Głosowania z tym samym planned_end, kolejność rozstrzyga id
+        Voting.objects.filter(pk__in=Voting.objects.order_by('id').values('pk')[:3]).update(planned_end=now + timedelta(days=10))
+        self.expected = list(Voting.objects.order_by('-planned_end', '-id').values_list('id', flat=True))
+
+    def _paginator(self):
+        return KeysetPaginator(Voting.objects.all(), ordering=('-planned_end', '-id'), per_page=3)
+
+    def test_pages_follow_ordering(self):
+        ids = []
+        cursor = None
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                page = self._paginator().get_page(cursor)
+            # Jedno zapytanie na stronę, bez COUNT i OFFSET
+            self.assertEqual(len(queries), 1)
+            self.assertNotIn('COUNT(', queries[0]['sql'])
+            self.assertNotIn('OFFSET', queries[0]['sql'])
+            ids.extend(voting.id for voting in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(ids, self.expected)
+        self.assertIsNone(page.next_cursor)
+
+    def test_invalid_cursor_returns_first_page(self):
+        page = self._paginator().get_page('nieprawidlowy-kursor')
+        self.assertEqual([voting.id for voting in page], self.expected[:3])
+        self.assertTrue(page.has_next)
+
+    def test_async_page(self):
+        first_page = self._paginator().get_page(None)
+        page = async_to_sync(self._paginator().aget_page)(first_page.next_cursor)
+        self.assertEqual([voting.id for voting in page], self.expected[3:6])
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.test import TestCase
+
+import sys
+
+from ekonomvote.tests import query_budgets
+
+
+class QueryBudgetTest(TestCase):
+    """Budżety zapytań wszystkich widoków (ekonomvote/tests/query_budgets.py), budżety czasu tylko z
+    QUERY_BUDGET_CHECK_TIME. Po zamierzonej zmianie liczby zapytań budżety zapisuje ten sam test:
+    QUERY_BUDGET_WRITE=1 python manage.py test ekonomvote.tests.test_query_budgets"""
+
+    def test_budgets_cover_all_views(self):
+        budgets = query_budgets.load_budgets()
+        for name in query_budgets.url_names():
+            self.assertIn(name, budgets)
+
+    def test_views_within_budgets(self):
+        small = query_budgets.measure(1)
+        large = query_budgets.measure(settings.QUERY_BUDGET_SCALE)
+        if settings.QUERY_BUDGET_WRITE:
+            grown = sorted(name for name, measurement in large.items() if measurement.queries != small[name].queries)
+            self.assertEqual(grown, [], 'Liczba zapytań rośnie z ilością danych, budżety nie zostały zapisane')
+            query_budgets.write_budgets(large)
+            sys.stderr.write('\n'.join(query_budgets.format_report(small, large, query_budgets.load_budgets())) + '\n')
+        errors = query_budgets.check_budgets(
+            small, large, query_budgets.load_budgets(), check_time=settings.QUERY_BUDGET_CHECK_TIME
+        )
+        self.assertEqual(errors, [], '\n'.join(errors))
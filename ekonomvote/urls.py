@@ -21,7 +21,10 @@ from django.conf import settings
 from django.conf.urls.static import static
 from debug_toolbar.toolbar import debug_toolbar_urls
 
+from . import views
+
 urlpatterns = [
+    path(f'{settings.ADMIN_URL}db-pool/', views.db_pool_stats, name='db_pool_stats'),
     path(settings.ADMIN_URL, admin.site.urls),
     path('samorzad/', include('samorzad.urls')),
     path('panel/', include('panel.urls')),
@@ -0,0 +1,19 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.http import HttpRequest, JsonResponse
+from django.views.decorators.http import require_http_methods
+
+import os
+
+from ekonomvote.db.postgresql_pool.base import get_pool_stats
+
+
+@require_http_methods(['GET'])
+@staff_member_required
+def db_pool_stats(request: HttpRequest):
+    """Statystyki puli połączeń z bazą danych procesu, który obsłużył żądanie (każdy worker ma własną pulę)"""
+    return JsonResponse({
+        'pid': os.getpid(),
+        'engines': {alias: connections[alias].settings_dict['ENGINE'] for alias in connections},
+        'pools': get_pool_stats(),
+    })
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class OfficeAuthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'office_auth'
+
+    def ready(self):
+        # Rejestracja sygnałów unieważniających role użytkowników (office_auth.auth_utils.get_roles)
+        from . import signals
@@ -0,0 +1,100 @@
+from django.conf import settings
+
+import asyncio
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+
+from office_auth.auth_utils import parse_user_info
+from office_auth.http_client import record_external_call
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_BACKOFF = 0.2
+
+
+class AsyncOffice365Authentication:
+    """Asynchroniczny odpowiednik Office365Authentication dla callbacku logowania w trybie ASGI. Wymiana kodu
+    na token i pobranie profilu nie blokują workera, więc jeden proces obsługuje wiele logowań naraz.
+
+    Kod autoryzacyjny jest wymieniany bezpośrednio na endpoincie tokenów Microsoft Entra ID (MSAL nie ma
+    klienta asynchronicznego). Token służy tylko do jednorazowego pobrania profilu, więc nie jest zapisywany"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport | None = None):
+        self.client_id = settings.MICROSOFT_CLIENT_ID
+        self.client_secret = settings.MICROSOFT_CLIENT_SECRET
+        self.token_endpoint = f'{settings.MICROSOFT_AUTHORITY_HOST}/{settings.MICROSOFT_TENANT_ID}/oauth2/v2.0/token'
+        self.graph_url = settings.MICROSOFT_GRAPH_URL
+        limits = httpx.Limits(
+            max_connections=settings.MICROSOFT_ASYNC_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.MICROSOFT_HTTP_POOL_SIZE
+        )
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.MICROSOFT_HTTP_READ_TIMEOUT, connect=settings.MICROSOFT_HTTP_CONNECT_TIMEOUT),
+            # Transport ponawia tylko nieudane nawiązanie połączenia, odpowiedzi 429/5xx ponawia _request
+            transport=transport or httpx.AsyncHTTPTransport(retries=settings.MICROSOFT_HTTP_RETRIES, limits=limits),
+        )
+
+    async def _request(self, method: str, url: str, retry_on_status: bool = False, **kwargs) -> httpx.Response:
+        parts = urlsplit(url)
+        name = f'{method} {parts.netloc}{parts.path}'
+        attempts = settings.MICROSOFT_HTTP_RETRIES + 1 if retry_on_status else 1
+        for attempt in range(attempts):
+            started = time.perf_counter()
+            failed = True
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                failed = response.status_code >= 400
+            finally:
+                record_external_call(name, time.perf_counter() - started, failed)
+            if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                return response
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    async def get_token(self, authorization_code, redirect_uri):
+        """Wymiana kodu autoryzacyjnego na token. Tak jak MSAL zwraca odpowiedź endpointu tokenów,
+        przy odrzuconym kodzie słownik z kluczem 'error'. Kod jest jednorazowy, więc żądanie nie jest ponawiane"""
+        response = await self._request('POST', self.token_endpoint, data={
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'grant_type': 'authorization_code',
+            'code': authorization_code,
+            'redirect_uri': redirect_uri,
+            'scope': 'User.Read',
+        })
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response.json()
+
+    async def get_user_info(self, access_token):
+        """Pobiera informacje o użytkowniku"""
+        response = await self._request('GET', f'{self.graph_url}/me', retry_on_status=True, headers={
+            'Authorization': f'Bearer {access_token}'
+        })
+        response.raise_for_status()
+        return parse_user_info(response.json())
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# Klient httpx jest związany z pętlą zdarzeń, w której go utworzono. Pod uvicorn pętla żyje tyle co worker,
+# więc w praktyce jest jeden klient (jedna pula połączeń) na proces
+_authentications = weakref.WeakKeyDictionary()
+
+
+def get_async_office365_authentication() -> AsyncOffice365Authentication:
+    """Zwraca instancję AsyncOffice365Authentication współdzieloną w bieżącej pętli zdarzeń"""
+    loop = asyncio.get_running_loop()
+    authentication = _authentications.get(loop)
+    if authentication is None:
+        authentication = _authentications[loop] = AsyncOffice365Authentication()
+    return authentication
+
+
+async def close_async_office365_authentication():
+    """Zamyka klienta bieżącej pętli zdarzeń (np. przed zakończeniem asyncio.run w komendzie)"""
+    authentication = _authentications.pop(asyncio.get_running_loop(), None)
+    if authentication is not None:
+        await authentication.aclose()
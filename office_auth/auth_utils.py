@@ -1,24 +1,51 @@
-from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.models import Group
+from django.contrib.auth.views import redirect_to_login
 from django.conf import settings
 from django.urls import reverse, reverse_lazy
 
 import msal
 import requests
+import threading
+from functools import wraps
 
+from ekonomvote.cache_versions import get_version, bump_version
 from office_auth.models import AzureUser
+from office_auth.http_client import build_session
+
+
+DEFAULT_AUTHORITY_HOST = 'https://login.microsoftonline.com'
+
+
+def parse_user_info(user_info: dict) -> dict:
+    """Wybiera z profilu Microsoft Graph (/me) pola używane przy tworzeniu AzureUser"""
+    return {
+        'id': user_info.get('id'),
+        'first_name':user_info.get('givenName'),
+        'last_name': user_info.get('surname'),
+        'email': user_info.get('mail'),
+    }
 
 
 class Office365Authentication:
-    def __init__(self):
+    """Klient logowania przez Microsoft Entra ID. Tworzenie ConfidentialClientApplication pobiera metadane
+    autoryzacji (OpenID configuration), dlatego w procesie działa jedna współdzielona instancja
+    (get_office365_authentication) z pulą połączeń HTTP i wspólnym cache tokenów"""
+
+    def __init__(self, http_client: requests.Session | None = None):
         self.client_id = settings.MICROSOFT_CLIENT_ID
         self.client_secret = settings.MICROSOFT_CLIENT_SECRET
         self.tenant_id = settings.MICROSOFT_TENANT_ID
-        self.authority = f'https://login.microsoftonline.com/{self.tenant_id}'
+        self.authority = f'{settings.MICROSOFT_AUTHORITY_HOST}/{self.tenant_id}'
+        self.http_client = http_client or build_session()
+        self.token_cache = msal.SerializableTokenCache()
         self.app = msal.ConfidentialClientApplication(
             self.client_id,
             authority=self.authority,
-            client_credential=self.client_secret
+            client_credential=self.client_secret,
+            token_cache=self.token_cache,
+            http_client=self.http_client,
+            # Walidacja instancji przez login.microsoftonline.com tylko dla domyślnego hosta autoryzacji
+            instance_discovery=None if settings.MICROSOFT_AUTHORITY_HOST == DEFAULT_AUTHORITY_HOST else False,
         )
 
     def generate_auth_url(self, redirect_uri, error_uri=None, state=None):
@@ -49,23 +76,89 @@ class Office365Authentication:
         headers = {
             'Authorization': f'Bearer {access_token}'
         }
-        response = requests.get('https://graph.microsoft.com/v1.0/me', headers=headers)
-        user_info = response.json()
-        return {
-            'id': user_info.get('id'),
-            'first_name':user_info.get('givenName'),
-            'last_name': user_info.get('surname'),
-            'email': user_info.get('mail'),
-        }
+        response = self.http_client.get(f'{settings.MICROSOFT_GRAPH_URL}/me', headers=headers)
+        response.raise_for_status()
+        return parse_user_info(response.json())
+
+    def forget_tokens(self):
+        """Usuwa konta i tokeny z cache tokenów. Token jest potrzebny tylko do jednorazowego pobrania profilu,
+        więc bez czyszczenia współdzielony cache rósłby z każdym logowaniem"""
+        for account in self.app.get_accounts():
+            self.app.remove_account(account)
+
+
+_authentication = None
+_authentication_lock = threading.Lock()
+
+
+def get_office365_authentication() -> Office365Authentication:
+    """Zwraca współdzieloną w procesie instancję Office365Authentication, tworzoną przy pierwszym logowaniu"""
+    global _authentication
+    with _authentication_lock:
+        if _authentication is None:
+            _authentication = Office365Authentication()
+        return _authentication
+
+
+OPIEKUN_ROLE = 'opiekunowie'
+ROLES_SESSION_KEY = '_office_auth_roles'
+ROLES_VERSION_KEY = 'office_auth:roles_version'
+USER_ROLES_VERSION_KEY = 'office_auth:roles_version:{user_id}'
+
+
+def get_roles_version(user_id: int) -> tuple[int, int]:
+    """Wersja ról użytkownika: (wersja wszystkich grup, wersja grup użytkownika)"""
+    return get_version(ROLES_VERSION_KEY), get_version(USER_ROLES_VERSION_KEY.format(user_id=user_id))
+
+
+def invalidate_user_roles(user_id: int):
+    """Unieważnia role użytkownika zapisane w sesjach (zmiana grup użytkownika)"""
+    bump_version(USER_ROLES_VERSION_KEY.format(user_id=user_id))
+
+
+def invalidate_all_roles():
+    """Unieważnia role wszystkich użytkowników (zmiana lub usunięcie grupy)"""
+    bump_version(ROLES_VERSION_KEY)
+
+
+def store_roles(user: AzureUser, session) -> frozenset[str]:
+    """Wylicza role użytkownika z bazy danych i zapisuje je w sesji oraz na obiekcie użytkownika"""
+    version = get_roles_version(user.pk)
+    roles = frozenset(user.groups.values_list('name', flat=True))
+    if session is not None:
+        session[ROLES_SESSION_KEY] = {'user_id': user.pk, 'version': list(version), 'roles': sorted(roles)}
+    user._roles_cache = roles
+    return roles
+
+
+def get_roles(user: AzureUser, session=None) -> frozenset[str]:
+    """Zwraca role (nazwy grup) użytkownika. Wynik jest zapamiętywany na obiekcie użytkownika (request.user
+    żyje przez jedno żądanie) i w sesji. Role z sesji są aktualne, dopóki sygnały zmian grup
+    (office_auth.signals) nie podbiją wersji ról w cache, więc zwykle kosztują jeden odczyt z cache zamiast
+    zapytania do auth_user_groups. Cache w pamięci procesu (SHARED_CACHE = False) nie widzi podbicia wersji
+    w innym workerze, role są wtedy zawsze czytane z bazy danych"""
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles_cache', None)
+    if roles is not None:
+        return roles
+    if session is not None and settings.SHARED_CACHE:
+        stored = session.get(ROLES_SESSION_KEY)
+        if stored and stored['user_id'] == user.pk and tuple(stored['version']) == get_roles_version(user.pk):
+            user._roles_cache = frozenset(stored['roles'])
+            return user._roles_cache
+    return store_roles(user, session)
 
 
 def opiekun_required():
-    def in_group(user:AzureUser):
-        return user.is_authenticated and user.groups.filter(name='opiekunowie').exists()
-    return user_passes_test(
-        in_group,
-        login_url=reverse_lazy('panel:login')
-    )
-
-def is_opiekun(user:AzureUser):
-    return user.groups.filter(name='opiekunowie').exists()
\ No newline at end of file
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.user.is_authenticated and is_opiekun(request.user, request.session):
+                return view(request, *args, **kwargs)
+            return redirect_to_login(request.get_full_path(), reverse_lazy('panel:login'))
+        return wrapper
+    return decorator
+
+def is_opiekun(user:AzureUser, session=None):
+    return OPIEKUN_ROLE in get_roles(user, session)
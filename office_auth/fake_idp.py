@@ -0,0 +1,144 @@
+"""Lokalna atrapa Microsoft Entra ID i Microsoft Graph do testów obciążeniowych logowania
+(komenda benchmark_microsoft_login, office_auth/tests.py). Każda odpowiedź jest opóźniana o zadany czas,
+tak jak przy połączeniu z prawdziwym dostawcą tożsamości.
+
+Kod autoryzacyjny 'valid-<n>' jest wymieniany na token 'token-<n>', dla którego /v1.0/me zwraca profil
+użytkownika 'fake-idp-<n>'. Pozostałe kody są odrzucane (invalid_grant)."""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+import base64
+import json
+import re
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+
+from office_auth.auth_utils import DEFAULT_AUTHORITY_HOST
+
+USER_ID_PREFIX = 'fake-idp-'
+
+_DISCOVERY_RE = re.compile(r'^/(?P<tenant>[^/]+)/v2\.0/\.well-known/openid-configuration$')
+_TOKEN_RE = re.compile(r'^/(?P<tenant>[^/]+)/oauth2/v2\.0/token$')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.peak_in_flight = max(self.server.peak_in_flight, self.server.in_flight)
+        try:
+            time.sleep(self.server.latency)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        match = _DISCOVERY_RE.match(path)
+        if match:
+            # MSAL wymaga adresów https, klient synchroniczny trafia do atrapy przez FakeIdentityProviderAdapter
+            base = f"{DEFAULT_AUTHORITY_HOST}/{match['tenant']}"
+            return self._send_json({
+                'authorization_endpoint': f'{base}/oauth2/v2.0/authorize',
+                'token_endpoint': f'{base}/oauth2/v2.0/token',
+                'issuer': f'{base}/v2.0',
+            })
+        if path == '/v1.0/me':
+            token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+            if not token.startswith('token-'):
+                return self._send_json({'error': {'code': 'InvalidAuthenticationToken'}}, status=401)
+            number = token.removeprefix('token-')
+            return self._send_json({
+                'id': f'{USER_ID_PREFIX}{number}',
+                'givenName': 'Jan',
+                'surname': f'Testowy{number}',
+                'mail': f'{USER_ID_PREFIX}{number}@example.com',
+            })
+        self._send_json({'error': 'not_found'}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = parse_qs(self.rfile.read(length).decode())
+        match = _TOKEN_RE.match(urlsplit(self.path).path)
+        if not match:
+            return self._send_json({'error': 'not_found'}, status=404)
+        code = data.get('code', [''])[0]
+        if not code.startswith('valid-'):
+            return self._send_json({'error': 'invalid_grant'}, status=400)
+        number = code.removeprefix('valid-')
+        client_info = base64.urlsafe_b64encode(json.dumps(
+            {'uid': f'{USER_ID_PREFIX}{number}', 'utid': match['tenant']}
+        ).encode()).decode().rstrip('=')
+        self._send_json({
+            'token_type': 'Bearer',
+            'scope': 'User.Read',
+            'expires_in': 3600,
+            'access_token': f'token-{number}',
+            'client_info': client_info,
+        })
+
+
+class FakeIdentityProvider:
+    """Serwer atrapy uruchamiany w wątku, np. ``with FakeIdentityProvider(latency=0.15) as idp: idp.url``"""
+
+    def __init__(self, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 256
+        self.server.latency = latency
+        # Liczba zapytań obsługiwanych jednocześnie, np. do sprawdzenia współbieżności klienta w testach
+        self.server.lock = threading.Lock()
+        self.server.in_flight = 0
+        self.server.peak_in_flight = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def peak_in_flight(self) -> int:
+        """Największa liczba zapytań obsługiwanych jednocześnie od uruchomienia atrapy"""
+        return self.server.peak_in_flight
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FakeIdentityProviderAdapter(HTTPAdapter):
+    """Adapter requests kierujący zapytania na adresy https Microsoft do atrapy (http). Pozwala użyć
+    synchronicznego Office365Authentication (MSAL przyjmuje tylko authority https) z FakeIdentityProvider"""
+
+    def __init__(self, url: str, **kwargs):
+        self.netloc = urlsplit(url).netloc
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = urlunsplit(('http', self.netloc, parts.path, parts.query, ''))
+        return super().send(request, **kwargs)
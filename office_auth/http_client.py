@@ -0,0 +1,82 @@
+from django.conf import settings
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+_call_stats = defaultdict(lambda: {'count': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+_call_stats_lock = threading.Lock()
+
+
+def record_external_call(name: str, seconds: float, failed: bool = False):
+    """Zapisuje czas wywołania zewnętrznej usługi (Microsoft Entra ID, Graph) w statystykach procesu"""
+    with _call_stats_lock:
+        stats = _call_stats[name]
+        stats['count'] += 1
+        stats['errors'] += int(failed)
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+    logger.info('%s %.1f ms%s', name, seconds * 1000, ' (błąd)' if failed else '')
+
+
+def get_external_call_stats() -> dict:
+    """Zwraca kopię statystyk wywołań zewnętrznych usług: {nazwa: {count, errors, total_seconds, max_seconds}}"""
+    with _call_stats_lock:
+        return {name: dict(stats) for name, stats in _call_stats.items()}
+
+
+def reset_external_call_stats():
+    with _call_stats_lock:
+        _call_stats.clear()
+
+
+class InstrumentedSession(requests.Session):
+    """Sesja HTTP współdzielona przez logowania w procesie: pula połączeń (bez ponownego TLS handshake przy
+    każdym logowaniu), domyślny timeout, ponawianie przy błędach połączenia oraz odpowiedziach 429/5xx
+    i pomiar czasu każdego wywołania (record_external_call).
+
+    Ponawiane są tylko metody idempotentne, POST z kodem autoryzacyjnym (jednorazowym) jest ponawiany
+    wyłącznie przy błędzie nawiązania połączenia"""
+
+    def __init__(self, timeout: tuple[float, float], retries: int, pool_size: int):
+        super().__init__()
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.2,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        parts = urlsplit(url)
+        name = f'{method.upper()} {parts.netloc}{parts.path}'
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            record_external_call(name, time.perf_counter() - started, failed)
+
+
+def build_session() -> InstrumentedSession:
+    return InstrumentedSession(
+        timeout=(settings.MICROSOFT_HTTP_CONNECT_TIMEOUT, settings.MICROSOFT_HTTP_READ_TIMEOUT),
+        retries=settings.MICROSOFT_HTTP_RETRIES,
+        pool_size=settings.MICROSOFT_HTTP_POOL_SIZE,
+    )
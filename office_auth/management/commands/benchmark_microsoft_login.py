@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, AsyncRequestFactory, override_settings
+from django.urls import reverse
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from unittest import mock
+
+from ekonomvote.latency import format_percentiles
+from office_auth import auth_utils, views
+from office_auth.async_auth import get_async_office365_authentication, close_async_office365_authentication
+from office_auth.fake_idp import FakeIdentityProvider, FakeIdentityProviderAdapter, USER_ID_PREFIX
+from office_auth.http_client import build_session
+from office_auth.models import AzureUser
+
+
+class Command(BaseCommand):
+    help = ("Test obciążeniowy callbacku logowania Microsoft względem lokalnej atrapy dostawcy tożsamości "
+            "(office_auth/fake_idp.py). Porównuje widok synchroniczny obsługiwany przez --workers workerów "
+            "z widokiem asynchronicznym w jednej pętli zdarzeń (jeden worker ASGI)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help='Liczba logowań w każdym trybie')
+        parser.add_argument('--latency', type=float, default=150, help='Opóźnienie każdej odpowiedzi atrapy w ms')
+        parser.add_argument('--workers', type=int, default=4, help='Liczba synchronicznych workerów (wątków)')
+        parser.add_argument('--concurrency', type=int, default=100, help='Liczba równoczesnych logowań w trybie asynchronicznym')
+        parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        # Sesje podpisane w ciasteczku, żeby test nie zostawiał wierszy w bazie danych
+        test_settings = override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies',
+            MICROSOFT_CLIENT_ID='benchmark',
+            MICROSOFT_CLIENT_SECRET='benchmark',
+            MICROSOFT_TENANT_ID='benchmark',
+        )
+        try:
+            with test_settings, FakeIdentityProvider(latency=options['latency'] / 1000) as idp:
+                if options['mode'] in ('sync', 'both'):
+                    self._report('sync', *self._run_sync(idp, options['logins'], options['workers']))
+                if options['mode'] in ('async', 'both'):
+                    with override_settings(MICROSOFT_AUTHORITY_HOST=idp.url, MICROSOFT_GRAPH_URL=f'{idp.url}/v1.0'):
+                        self._report('async', *asyncio.run(
+                            self._run_async(options['logins'], options['concurrency'])
+                        ))
+        finally:
+            AzureUser.objects.filter(microsoft_user_id__startswith=USER_ID_PREFIX).delete()
+
+    def _build_request(self, factory, number):
+        request = factory.get(reverse('office_auth:microsoft_callback'), {'code': f'valid-{number}'})
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        request.user = AnonymousUser()
+        return request
+
+    def _is_logged_in(self, response):
+        return response.status_code == 302 and response['Location'] == reverse('samorzad:index')
+
+    def _run_sync(self, idp, logins, workers):
+        session = build_session()
+        session.mount('https://', FakeIdentityProviderAdapter(idp.url, pool_maxsize=workers))
+        authentication = auth_utils.Office365Authentication(http_client=session)
+        factory = RequestFactory()
+
+        def login(number):
+            request = self._build_request(factory, number)
+            started = time.perf_counter()
+            response = views.microsoft_callback(request)
+            return time.perf_counter() - started, self._is_logged_in(response)
+
+        with mock.patch.object(auth_utils, '_authentication', authentication):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                samples = list(executor.map(login, range(logins)))
+            return samples, time.perf_counter() - started
+
+    async def _run_async(self, logins, concurrency):
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(concurrency)
+        # Klient i pula połączeń powstają przed pomiarem, tak jak w rozgrzanym workerze
+        get_async_office365_authentication()
+
+        async def login(number):
+            async with semaphore:
+                request = self._build_request(factory, logins + number)
+                started = time.perf_counter()
+                response = await views.microsoft_callback_async(request)
+                return time.perf_counter() - started, self._is_logged_in(response)
+
+        try:
+            started = time.perf_counter()
+            samples = await asyncio.gather(*(login(number) for number in range(logins)))
+            return samples, time.perf_counter() - started
+        finally:
+            await close_async_office365_authentication()
+
+    def _report(self, name, samples, elapsed):
+        latencies = [latency * 1000 for latency, logged_in in samples]
+        errors = sum(1 for latency, logged_in in samples if not logged_in)
+        self.stdout.write(
+            f'{name}: {len(samples) / elapsed:.1f} logowań/s, {format_percentiles(latencies)}, błędy {errors}/{len(samples)}'
+        )
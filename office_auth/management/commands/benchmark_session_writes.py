@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from collections import Counter
+from unittest import mock
+
+from office_auth import auth_utils
+from office_auth.fake_idp import FakeIdentityProvider, FakeIdentityProviderAdapter, USER_ID_PREFIX
+from office_auth.http_client import build_session
+from office_auth.models import AzureUser
+from office_auth.sessions import is_signed_key
+
+ENGINES = {
+    'db': {'SESSION_ENGINE': 'django.contrib.sessions.backends.db'},
+    'office_auth': {'SESSION_ENGINE': 'office_auth.sessions', 'SESSION_SIGNED_VOTER_COOKIES': False},
+    'office_auth_signed': {'SESSION_ENGINE': 'office_auth.sessions', 'SESSION_SIGNED_VOTER_COOKIES': True},
+}
+
+
+class Command(BaseCommand):
+    help = ("Liczy zapytania do tabeli sesji przy logowaniu przez Microsoft (callback z lokalną atrapą dostawcy "
+            "tożsamości) i przy kolejnym żądaniu zalogowanego wyborcy, dla domyślnego silnika sesji Django "
+            "i office_auth.sessions")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=50, help='Liczba logowań dla każdego silnika sesji')
+        parser.add_argument('--engine', choices=list(ENGINES), action='append', help='Silniki do porównania (domyślnie wszystkie)')
+
+    def handle(self, *args, **options):
+        session_keys = []
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=['testserver'],
+                MICROSOFT_CLIENT_ID='benchmark',
+                MICROSOFT_CLIENT_SECRET='benchmark',
+                MICROSOFT_TENANT_ID='benchmark',
+            ), FakeIdentityProvider() as idp:
+                session = build_session()
+                session.mount('https://', FakeIdentityProviderAdapter(idp.url))
+                authentication = auth_utils.Office365Authentication(http_client=session)
+                with mock.patch.object(auth_utils, '_authentication', authentication):
+                    offset = 0
+                    for name in options['engine'] or list(ENGINES):
+                        with override_settings(**ENGINES[name]):
+                            self._run(name, offset, options['logins'], session_keys)
+                        offset += options['logins']
+        finally:
+            AzureUser.objects.filter(microsoft_user_id__startswith=USER_ID_PREFIX).delete()
+            Session.objects.filter(session_key__in=session_keys).delete()
+
+    def _run(self, name, offset, logins, session_keys):
+        counts = {'login': Counter(), 'next': Counter()}
+        phase = 'login'
+
+        def count_session_queries(execute, sql, params, many, context):
+            if Session._meta.db_table in sql:
+                counts[phase][sql.split(None, 1)[0].upper()] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_session_queries):
+            for number in range(offset, offset + logins):
+                client = Client()
+                phase = 'login'
+                response = client.get(reverse('office_auth:microsoft_callback'), {'code': f'valid-{number}'})
+                if response.status_code != 302 or response['Location'] != reverse('samorzad:index'):
+                    self.stderr.write(f'{name}: logowanie {number} nie powiodło się')
+                phase = 'next'
+                client.get(reverse('samorzad:index'))
+                session_key = client.cookies.get(settings.SESSION_COOKIE_NAME)
+                if session_key is not None and not is_signed_key(session_key.value):
+                    session_keys.append(session_key.value)
+
+        for phase_name, label in (('login', 'logowanie'), ('next', 'kolejne żądanie')):
+            phase_counts = counts[phase_name]
+            writes = phase_counts['INSERT'] + phase_counts['UPDATE'] + phase_counts['DELETE']
+            self.stdout.write(
+                f'{name} ({label}): zapisy sesji {writes / logins:.2f}/logowanie '
+                f'(INSERT {phase_counts["INSERT"]}, UPDATE {phase_counts["UPDATE"]}, DELETE {phase_counts["DELETE"]}), '
+                f'odczyty z bazy {phase_counts["SELECT"] / logins:.2f}/logowanie'
+            )
@@ -0,0 +1,123 @@
+"""Silnik sesji dla szczytów logowań i głosowań (SESSION_ENGINE = 'office_auth.sessions').
+
+- Odczyt najpierw z cache, przy braku z bazy danych (tak jak cached_db), zapis trafia do bazy i do cache.
+- Zapisy są łączone: cycle_key() przy login() nie zapisuje sesji od razu, nowy klucz powstaje przy zapisie
+  w SessionMiddleware, razem z danymi ustawionymi później w tym samym żądaniu (np. microsoft_user_id).
+  Sesja oznaczona jako zmieniona, ale z danymi takimi jak po odczycie, nie jest zapisywana.
+  Żądanie powoduje więc najwyżej jeden zapis sesji.
+- Opcjonalnie (SESSION_SIGNED_VOTER_COOKIES) sesje wyborców, zawierające tylko dane logowania i role,
+  są przechowywane w podpisanym ciasteczku tak jak w signed_cookies i nie trafiają do bazy ani cache.
+  Takiej sesji nie da się unieważnić po stronie serwera przy wylogowaniu (ciasteczko jest ważne do
+  SESSION_COOKIE_AGE), dlatego sesje opiekunów zawsze są przechowywane na serwerze. Zmiany grup
+  nadal działają od razu, role w sesji są sprawdzane z wersją w cache (auth_utils.get_roles)
+"""
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core import signing
+from django.db import router, transaction
+
+from office_auth.auth_utils import OPIEKUN_ROLE, ROLES_SESSION_KEY
+
+KEY_PREFIX = 'office_auth.sessions'
+SIGNED_SALT = 'office_auth.sessions.signed'
+
+# Klucze sesji wyborcy, które mieszczą się w podpisanym ciasteczku
+VOTER_SESSION_KEYS = frozenset({
+    SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY, ROLES_SESSION_KEY, 'microsoft_user_id'
+})
+
+
+def is_signed_key(session_key: str | None) -> bool:
+    """Klucze sesji w bazie danych są alfanumeryczne, podpisane dane zawierają separator ':'"""
+    return bool(session_key) and ':' in session_key
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._stored_state = None
+        self._stale_key = None
+        super().__init__(session_key)
+
+    def _state(self, data: dict) -> bytes:
+        return self.serializer().dumps(data)
+
+    def _can_sign(self, data: dict) -> bool:
+        if not settings.SESSION_SIGNED_VOTER_COOKIES or not data or not set(data) <= VOTER_SESSION_KEYS:
+            return False
+        # Bez ról w sesji nie wiadomo, czy to wyborca
+        roles = data.get(ROLES_SESSION_KEY)
+        return roles is not None and OPIEKUN_ROLE not in roles['roles']
+
+    def load(self):
+        if is_signed_key(self.session_key):
+            try:
+                data = signing.loads(
+                    self.session_key,
+                    salt=SIGNED_SALT,
+                    serializer=self.serializer,
+                    max_age=self.get_session_cookie_age(),
+                )
+            except Exception:
+                # Zły podpis lub wygasłe ciasteczko, sesja zaczyna się od nowa
+                self._session_key = None
+                data = {}
+        else:
+            data = super().load()
+        self._stored_state = self._state(data)
+        return data
+
+    def exists(self, session_key):
+        if is_signed_key(session_key):
+            return False
+        return super().exists(session_key)
+
+    def cycle_key(self):
+        """Nowy klucz zostanie utworzony przy zapisie sesji na koniec żądania, stary jest wtedy usuwany"""
+        data = self._session
+        if self.session_key and not is_signed_key(self.session_key):
+            self._stale_key = self.session_key
+        self._session_key = None
+        self._session_cache = data
+        self._stored_state = None
+        self.modified = True
+
+    def save(self, must_create=False):
+        data = self._get_session(no_load=must_create)
+        if self._can_sign(data):
+            self._session_key = signing.dumps(data, compress=True, salt=SIGNED_SALT, serializer=self.serializer)
+            self._stored_state = self._state(data)
+            self.modified = True
+            self._delete_stale_key()
+            return
+        if is_signed_key(self.session_key):
+            # Sesja przestała mieścić się w ciasteczku (np. użytkownik został opiekunem)
+            self._session_key = None
+        if self.session_key is None:
+            # create() wywołuje save(must_create=True) z nowym kluczem
+            return self.create()
+        state = self._state(data)
+        if not must_create and state == self._stored_state and not settings.SESSION_SAVE_EVERY_REQUEST:
+            return
+        if self._stale_key is None:
+            super().save(must_create)
+        else:
+            with transaction.atomic(using=router.db_for_write(self.model)):
+                super().save(must_create)
+                self._delete_stale_key()
+        self._stored_state = state
+
+    def _delete_stale_key(self):
+        if self._stale_key is not None:
+            super().delete(self._stale_key)
+            self._stale_key = None
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        if is_signed_key(session_key):
+            # Dane są tylko w ciasteczku, SessionMiddleware usunie je przy pustej sesji
+            return
+        super().delete(session_key)
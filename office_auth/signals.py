@@ -0,0 +1,39 @@
+from django.contrib.auth.models import Group
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from .auth_utils import store_roles, invalidate_user_roles, invalidate_all_roles
+from .models import AzureUser
+from .users import clear_group_ids
+
+
+@receiver(user_logged_in)
+def store_roles_on_login(sender, request, user, **kwargs):
+    """Role są wyliczane raz przy logowaniu i trzymane w sesji"""
+    if request is not None and hasattr(request, 'session'):
+        store_roles(user, request.session)
+
+
+@receiver(m2m_changed, sender=AzureUser.groups.through)
+def invalidate_roles_on_groups_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # user.groups.add/remove/clear
+        invalidate_user_roles(instance.pk)
+        instance._roles_cache = None
+    elif pk_set:
+        # group.user_set.add/remove
+        for user_id in pk_set:
+            invalidate_user_roles(user_id)
+    else:
+        # group.user_set.clear, nie wiadomo których użytkowników dotyczyła zmiana
+        invalidate_all_roles()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_roles_on_group_change(sender, **kwargs):
+    invalidate_all_roles()
+    clear_group_ids()
@@ -1,3 +1,445 @@
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, AsyncRequestFactory, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+import asyncio
+import base64
+import json
+from unittest import mock
+from urllib.parse import urlsplit, parse_qs
+
+import httpx
+import requests
+from requests.adapters import BaseAdapter
+
+from office_auth import auth_utils, views
+from office_auth.async_auth import AsyncOffice365Authentication
+from office_auth.fake_idp import FakeIdentityProvider, USER_ID_PREFIX
+from office_auth.auth_utils import get_roles, is_opiekun, ROLES_SESSION_KEY, Office365Authentication
+from office_auth.http_client import build_session, get_external_call_stats, reset_external_call_stats
+from office_auth.models import AzureUser
+from office_auth.users import upsert_azure_user, clear_group_ids
+from office_auth import sessions
+
+
+@override_settings(SHARED_CACHE=True)
+class RolesTest(TestCase):
+    fixtures = ['auth_groups.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = AzureUser.objects.create(
+            username='user',
+            password="ZAQ!2wsx",
+        )
+        self.opiekun_group = Group.objects.get(name='opiekunowie')
+        self.wyborcy_group = Group.objects.get(name='wyborcy')
+        self.user.groups.add(self.wyborcy_group)
+
+    def _fresh_user(self):
+        """Nowy obiekt użytkownika, tak jak request.user w kolejnym żądaniu"""
+        return AzureUser.objects.get(pk=self.user.pk)
+
+    def test_roles_memoized_on_user(self):
+        user = self._fresh_user()
+        self.assertEqual(get_roles(user), frozenset({'wyborcy'}))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_opiekun(user))
+            self.assertFalse(is_opiekun(user))
+
+    def test_roles_read_from_session(self):
+        session = {}
+        get_roles(self._fresh_user(), session)
+        self.assertEqual(session[ROLES_SESSION_KEY]['roles'], ['wyborcy'])
+        user = self._fresh_user()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_roles(user, session), frozenset({'wyborcy'}))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_roles_not_read_from_session_without_shared_cache(self):
+        # Podbicie wersji ról w innym workerze nie dotarłoby do cache tego procesu
+        session = {}
+        get_roles(self._fresh_user(), session)
+        user = self._fresh_user()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_roles(user, session), frozenset({'wyborcy'}))
+
+    def test_user_groups_change_invalidates_session(self):
+        session = {}
+        get_roles(self._fresh_user(), session)
+        self.user.groups.add(self.opiekun_group)
+        self.assertTrue(is_opiekun(self._fresh_user(), session))
+        self.user.groups.remove(self.opiekun_group)
+        self.assertFalse(is_opiekun(self._fresh_user(), session))
+
+    def test_group_members_change_invalidates_session(self):
+        session = {}
+        get_roles(self._fresh_user(), session)
+        self.opiekun_group.user_set.add(self.user)
+        self.assertTrue(is_opiekun(self._fresh_user(), session))
+        self.opiekun_group.user_set.clear()
+        self.assertFalse(is_opiekun(self._fresh_user(), session))
+
+    def test_group_rename_invalidates_session(self):
+        session = {}
+        get_roles(self._fresh_user(), session)
+        self.wyborcy_group.name = 'uczniowie'
+        self.wyborcy_group.save()
+        self.assertEqual(get_roles(self._fresh_user(), session), frozenset({'uczniowie'}))
+
+    def test_opiekun_required(self):
+        self.user.groups.add(self.opiekun_group)
+        session = self.client.session
+        session['microsoft_user_id'] = '11223344'
+        session.save()
+        self.client.force_login(self.user)
+        # Role zapisane w sesji przy logowaniu
+        self.assertIn('opiekunowie', self.client.session[ROLES_SESSION_KEY]['roles'])
+        self.assertEqual(self.client.get(reverse('panel:index')).status_code, 200)
+        self.user.groups.remove(self.opiekun_group)
+        response = self.client.get(reverse('panel:index'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse('panel:login')))
+
+
+class StubIdentityProviderAdapter(BaseAdapter):
+    """Lokalna atrapa Microsoft Entra ID i Graph podpinana pod sesję HTTP, bez połączeń sieciowych"""
+    tenant = 'test-tenant'
+
+    def __init__(self, profile):
+        super().__init__()
+        self.profile = profile
+        self.requests = []
+
+    def _json_response(self, request, payload, status=200):
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(payload).encode()
+        response.headers['Content-Type'] = 'application/json'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def send(self, request, **kwargs):
+        self.requests.append((request, kwargs))
+        url = urlsplit(request.url)
+        base = f'https://{url.netloc}/{self.tenant}'
+        if url.path == f'/{self.tenant}/v2.0/.well-known/openid-configuration':
+            return self._json_response(request, {
+                'authorization_endpoint': f'{base}/oauth2/v2.0/authorize',
+                'token_endpoint': f'{base}/oauth2/v2.0/token',
+                'issuer': f'{base}/v2.0',
+            })
+        if url.path == f'/{self.tenant}/oauth2/v2.0/token' and request.method == 'POST':
+            if parse_qs(request.body).get('code') != ['valid-code']:
+                return self._json_response(request, {'error': 'invalid_grant'}, status=400)
+            client_info = base64.urlsafe_b64encode(json.dumps(
+                {'uid': self.profile['id'], 'utid': self.tenant}
+            ).encode()).decode().rstrip('=')
+            return self._json_response(request, {
+                'token_type': 'Bearer',
+                'scope': 'User.Read',
+                'expires_in': 3600,
+                'access_token': 'access-token',
+                'client_info': client_info,
+            })
+        if url.path == '/common/discovery/instance':
+            # Aliasy hosta autoryzacji, pobierane przez get_accounts przy pustym cache tokenów
+            return self._json_response(request, {
+                'tenant_discovery_endpoint': f'{base}/v2.0/.well-known/openid-configuration',
+                'metadata': [{'preferred_network': url.netloc, 'preferred_cache': url.netloc, 'aliases': [url.netloc]}],
+            })
+        if url.path == '/v1.0/me':
+            if request.headers.get('Authorization') != 'Bearer access-token':
+                return self._json_response(request, {'error': 'InvalidAuthenticationToken'}, status=401)
+            return self._json_response(request, self.profile)
+        return self._json_response(request, {'error': 'not_found'}, status=404)
+
+    def close(self):
+        pass
+
+
+class StubIdentityProviderMixin:
+    """Office365Authentication z sesją HTTP podpiętą pod StubIdentityProviderAdapter, używane przez widoki logowania"""
+    fixtures = ['auth_groups.json']
+
+    def setUp(self):
+        reset_external_call_stats()
+        self.adapter = StubIdentityProviderAdapter({
+            'id': 'f2a1c6d0-0000-4000-8000-000000000001',
+            'givenName': 'Jan',
+            'surname': 'Kowalski',
+            'mail': 'jan.kowalski@example.com',
+        })
+        self.session = build_session()
+        self.session.mount('https://', self.adapter)
+        self.auth = Office365Authentication(http_client=self.session)
+        patcher = mock.patch.object(auth_utils, '_authentication', self.auth)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@override_settings(MICROSOFT_CLIENT_ID='client-id', MICROSOFT_CLIENT_SECRET='secret',
+                   MICROSOFT_TENANT_ID=StubIdentityProviderAdapter.tenant)
+class Office365AuthenticationTest(StubIdentityProviderMixin, TestCase):
+
+    def test_requests_use_default_timeout(self):
+        self.auth.get_user_info('access-token')
+        for request, kwargs in self.adapter.requests:
+            self.assertEqual(kwargs['timeout'], self.session.timeout)
+
+    def test_callback_reuses_client(self):
+        callback = reverse('office_auth:microsoft_callback')
+        response = self.client.get(callback, {'code': 'valid-code'})
+        self.assertRedirects(response, reverse('samorzad:index'), fetch_redirect_response=False)
+        user = AzureUser.objects.get(microsoft_user_id=self.adapter.profile['id'])
+        self.assertEqual(user.email, 'jan.kowalski@example.com')
+        self.assertTrue(user.groups.filter(name='wyborcy').exists())
+        self.client.logout()
+        self.client.get(callback, {'code': 'valid-code'})
+        paths = [urlsplit(request.url).path for request, kwargs in self.adapter.requests]
+        # Metadane autoryzacji są pobierane raz, przy tworzeniu klienta, a nie przy każdym logowaniu
+        self.assertEqual(paths.count(f'/{self.adapter.tenant}/v2.0/.well-known/openid-configuration'), 1)
+        self.assertEqual(paths.count(f'/{self.adapter.tenant}/oauth2/v2.0/token'), 2)
+        self.assertEqual(paths.count('/v1.0/me'), 2)
+        # Tokeny nie zostają we współdzielonym cache po pobraniu profilu
+        self.assertEqual(self.auth.app.get_accounts(), [])
+
+    def test_invalid_code_redirects_to_login(self):
+        response = self.client.get(reverse('office_auth:microsoft_callback'), {'code': 'invalid-code'})
+        self.assertRedirects(response, reverse('office_auth:microsoft_login'), fetch_redirect_response=False)
+        self.assertFalse(AzureUser.objects.filter(microsoft_user_id=self.adapter.profile['id']).exists())
+
+    def test_external_calls_are_measured(self):
+        self.auth.get_user_info('access-token')
+        with self.assertRaises(requests.HTTPError):
+            self.auth.get_user_info('expired-token')
+        stats = get_external_call_stats()['GET graph.microsoft.com/v1.0/me']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['errors'], 1)
+
+
+@override_settings(MICROSOFT_CLIENT_ID='client-id', MICROSOFT_CLIENT_SECRET='secret', MICROSOFT_TENANT_ID='test-tenant')
+class AsyncMicrosoftCallbackTest(TestCase):
+    fixtures = ['auth_groups.json']
+
+    def setUp(self):
+        reset_external_call_stats()
+        self.factory = AsyncRequestFactory()
+
+    def _request(self, code, state=None):
+        params = {'code': code}
+        if state:
+            params['state'] = state
+        request = self.factory.get(reverse('office_auth:microsoft_callback'), params)
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+        return request
+
+    async def _callback(self, auth, request):
+        with mock.patch.object(views, 'get_async_office365_authentication', return_value=auth):
+            return await views.microsoft_callback_async(request)
+
+    async def test_callback_logs_in(self):
+        graph_attempts = []
+
+        def handler(request):
+            if request.url.path == '/test-tenant/oauth2/v2.0/token':
+                self.assertEqual(parse_qs(request.content.decode())['code'], ['valid-code'])
+                return httpx.Response(200, json={'access_token': 'access-token', 'token_type': 'Bearer'})
+            graph_attempts.append(request)
+            if len(graph_attempts) == 1:
+                return httpx.Response(503)
+            return httpx.Response(200, json={
+                'id': 'f2a1c6d0-0000-4000-8000-000000000002',
+                'givenName': 'Anna',
+                'surname': 'Nowak',
+                'mail': 'anna.nowak@example.com',
+            })
+
+        auth = AsyncOffice365Authentication(transport=httpx.MockTransport(handler))
+        with mock.patch('office_auth.async_auth.RETRY_BACKOFF', 0):
+            request = self._request('valid-code', state='next=/panel/')
+            response = await self._callback(auth, request)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], '/panel/')
+        # Odpowiedź 503 z Graph jest ponawiana
+        self.assertEqual(len(graph_attempts), 2)
+        user = await AzureUser.objects.aget(microsoft_user_id='f2a1c6d0-0000-4000-8000-000000000002')
+        self.assertEqual(request.session[SESSION_KEY], str(user.pk))
+        self.assertTrue(await user.groups.filter(name='wyborcy').aexists())
+        await auth.aclose()
+
+    async def test_rejected_code_redirects_to_login(self):
+        auth = AsyncOffice365Authentication(
+            transport=httpx.MockTransport(lambda request: httpx.Response(400, json={'error': 'invalid_grant'}))
+        )
+        response = await self._callback(auth, self._request('invalid-code'))
+        self.assertEqual(response['Location'], reverse('office_auth:microsoft_login'))
+        self.assertFalse(await AzureUser.objects.aexists())
+        await auth.aclose()
+
+    async def test_concurrent_logins_against_fake_idp(self):
+        logins = 10
+        with FakeIdentityProvider(latency=0.2) as idp:
+            with override_settings(MICROSOFT_AUTHORITY_HOST=idp.url, MICROSOFT_GRAPH_URL=f'{idp.url}/v1.0'):
+                auth = AsyncOffice365Authentication()
+            responses = await asyncio.gather(*(
+                self._callback(auth, self._request(f'valid-{number}')) for number in range(logins)
+            ))
+            await auth.aclose()
+        self.assertTrue(all(response['Location'] == reverse('samorzad:index') for response in responses))
+        self.assertEqual(await AzureUser.objects.filter(microsoft_user_id__startswith=USER_ID_PREFIX).acount(), logins)
+        # Logowania czekają na dostawcę tożsamości jednocześnie, a nie po kolei
+        self.assertGreater(idp.peak_in_flight, logins // 2)
+
+
+class UpsertAzureUserTest(TestCase):
+    fixtures = ['auth_groups.json']
+
+    def setUp(self):
+        clear_group_ids()
+        self.user_info = {
+            'id': 'f2a1c6d0-0000-4000-8000-000000000003',
+            'first_name': 'Ewa',
+            'last_name': 'Zielińska',
+            'email': 'ewa.zielinska@example.com',
+        }
+
+    def test_creates_voter(self):
+        user, created = upsert_azure_user(self.user_info)
+        self.assertTrue(created)
+        self.assertEqual(user, AzureUser.objects.get(microsoft_user_id=self.user_info['id']))
+        self.assertEqual(user.username, 'ewa.zielinska@example.com')
+        self.assertEqual(list(user.groups.values_list('name', flat=True)), ['wyborcy'])
+
+    def test_login_is_single_query(self):
+        upsert_azure_user(self.user_info)
+        # ID grupy wyborców jest już zapamiętane, tak samo dla nowego i istniejącego użytkownika
+        with self.assertNumQueries(1):
+            user, created = upsert_azure_user({**self.user_info, 'id': 'f2a1c6d0-0000-4000-8000-000000000004',
+                                               'email': 'inna@example.com'})
+        self.assertTrue(created)
+        with self.assertNumQueries(1):
+            user, created = upsert_azure_user(self.user_info)
+        self.assertFalse(created)
+
+    def test_profile_change_updates_user(self):
+        first, _ = upsert_azure_user(self.user_info)
+        user, created = upsert_azure_user({**self.user_info, 'last_name': 'Nowak', 'email': 'ewa.nowak@example.com'})
+        self.assertFalse(created)
+        self.assertEqual(user.pk, first.pk)
+        user.refresh_from_db()
+        self.assertEqual(user.last_name, 'Nowak')
+        self.assertEqual(user.username, 'ewa.nowak@example.com')
+        self.assertEqual(user.groups.count(), 1)
+
+    def test_missing_id_rejected(self):
+        with self.assertRaises(ValueError):
+            upsert_azure_user({**self.user_info, 'id': None})
+        self.assertFalse(AzureUser.objects.exists())
+
+
+@override_settings(MICROSOFT_CLIENT_ID='client-id', MICROSOFT_CLIENT_SECRET='secret',
+                   MICROSOFT_TENANT_ID=StubIdentityProviderAdapter.tenant,
+                   SESSION_ENGINE='office_auth.sessions', SESSION_CACHE_ALIAS='default',
+                   SESSION_SIGNED_VOTER_COOKIES=False)
+class SessionStoreTest(StubIdentityProviderMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def _session_writes(self, queries):
+        table = Session._meta.db_table
+        return [
+            query['sql'].split(None, 1)[0] for query in queries
+            if table in query['sql'] and not query['sql'].startswith('SELECT')
+        ]
+
+    def _login(self):
+        return self.client.get(reverse('office_auth:microsoft_callback'), {'code': 'valid-code'})
+
+    def test_login_writes_session_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self._login()
+        self.assertEqual(self._session_writes(queries.captured_queries), ['INSERT'])
+        session = self.client.session
+        self.assertEqual(session['microsoft_user_id'], self.adapter.profile['id'])
+        self.assertIn(ROLES_SESSION_KEY, session)
+
+    def test_login_replaces_anonymous_session(self):
+        session = sessions.SessionStore()
+        session['anonymous'] = True
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        with CaptureQueriesContext(connection) as queries:
+            self._login()
+        self.assertEqual(self._session_writes(queries.captured_queries), ['INSERT', 'DELETE'])
+        self.assertFalse(Session.objects.filter(session_key=session.session_key).exists())
+        self.assertNotEqual(self.client.cookies[settings.SESSION_COOKIE_NAME].value, session.session_key)
+
+    def test_unchanged_session_not_saved(self):
+        session = sessions.SessionStore()
+        session['microsoft_user_id'] = 'abc'
+        session.save()
+        session = sessions.SessionStore(session.session_key)
+        session['microsoft_user_id'] = 'abc'
+        with self.assertNumQueries(0):
+            session.save()
+        session['microsoft_user_id'] = 'def'
+        with CaptureQueriesContext(connection) as queries:
+            session.save()
+        self.assertEqual(self._session_writes(queries.captured_queries), ['UPDATE'])
+        self.assertEqual(sessions.SessionStore(session.session_key)['microsoft_user_id'], 'def')
+
+    def test_session_read_from_cache(self):
+        session = sessions.SessionStore()
+        session['microsoft_user_id'] = 'abc'
+        session.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(sessions.SessionStore(session.session_key)['microsoft_user_id'], 'abc')
+        # Po wypadnięciu z cache sesja jest czytana z bazy danych
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(sessions.SessionStore(session.session_key)['microsoft_user_id'], 'abc')
+
+    @override_settings(SESSION_SIGNED_VOTER_COOKIES=True)
+    def test_voter_session_in_signed_cookie(self):
+        with CaptureQueriesContext(connection) as queries:
+            self._login()
+        self.assertEqual(self._session_writes(queries.captured_queries), [])
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertTrue(sessions.is_signed_key(session_key))
+        self.assertFalse(Session.objects.exists())
+        session = sessions.SessionStore(session_key)
+        self.assertEqual(session['microsoft_user_id'], self.adapter.profile['id'])
+        response = self.client.get(reverse('samorzad:index'))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(SESSION_SIGNED_VOTER_COOKIES=True)
+    def test_opiekun_session_stored_on_server(self):
+        session = sessions.SessionStore()
+        session['microsoft_user_id'] = 'abc'
+        session[ROLES_SESSION_KEY] = {'user_id': 1, 'version': [1, 1], 'roles': ['opiekunowie']}
+        session.save()
+        self.assertFalse(sessions.is_signed_key(session.session_key))
+        self.assertTrue(Session.objects.filter(session_key=session.session_key).exists())
+
+    @override_settings(SESSION_SIGNED_VOTER_COOKIES=True)
+    def test_tampered_signed_session_is_empty(self):
+        session = sessions.SessionStore()
+        session['microsoft_user_id'] = 'abc'
+        session[ROLES_SESSION_KEY] = {'user_id': 1, 'version': [1, 1], 'roles': ['wyborcy']}
+        session.save()
+        self.assertTrue(sessions.is_signed_key(session.session_key))
+        tampered = sessions.SessionStore(session.session_key[:-2] + 'xx')
+        self.assertNotIn('microsoft_user_id', tampered)
@@ -1,10 +1,14 @@
 from django.urls import path
+from django.conf import settings
 from . import views
 
 app_name = 'office_auth'
 
+# W trybie ASGI (ekonomvote/asgi.py) callback logowania nie blokuje workera na czas zapytań do Microsoft
+microsoft_callback = views.microsoft_callback_async if settings.SAMORZAD_ASYNC_VIEWS else views.microsoft_callback
+
 urlpatterns = [
     path('', views.microsoft_login, name='microsoft_login'),
-    path('microsoft-callback/', views.microsoft_callback, name='microsoft_callback'),
+    path('microsoft-callback/', microsoft_callback, name='microsoft_callback'),
     path('logout/', views.logout_view, name='logout'),
 ]
\ No newline at end of file
@@ -0,0 +1,85 @@
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.utils import timezone
+
+from office_auth.models import AzureUser
+
+VOTER_GROUP = 'wyborcy'
+
+# Pola profilu aktualizowane przy każdym logowaniu, jeśli zmieniły się w Microsoft Entra ID
+PROFILE_FIELDS = ['first_name', 'last_name', 'email', 'username']
+
+# ID grup nie zmieniają się w trakcie działania procesu, są czyszczone sygnałami przy zmianie grup (office_auth/signals.py)
+_group_ids = {}
+
+
+def get_group_id(name: str) -> int:
+    """Zwraca ID grupy o podanej nazwie, zapamiętane w procesie"""
+    group_id = _group_ids.get(name)
+    if group_id is None:
+        group_id = _group_ids[name] = Group.objects.values_list('id', flat=True).get(name=name)
+    return group_id
+
+
+def clear_group_ids():
+    _group_ids.clear()
+
+
+def _upsert_sql():
+    meta = AzureUser._meta
+    table = connection.ops.quote_name(meta.db_table)
+    through = AzureUser.groups.through._meta
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in meta.concrete_fields)
+    insert_columns = ', '.join(connection.ops.quote_name(meta.get_field(name).column) for name in [
+        'microsoft_user_id', *PROFILE_FIELDS, 'password', 'is_superuser', 'is_staff', 'is_active', 'date_joined'
+    ])
+    profile_columns = [connection.ops.quote_name(meta.get_field(name).column) for name in PROFILE_FIELDS]
+    return f'''
+        WITH upserted AS (
+            INSERT INTO {table} ({insert_columns})
+            VALUES (%(microsoft_user_id)s, %(first_name)s, %(last_name)s, %(email)s, %(username)s, '', false, false, true, %(now)s)
+            ON CONFLICT (microsoft_user_id) DO UPDATE SET
+                {', '.join(f'{column} = EXCLUDED.{column}' for column in profile_columns)}
+            WHERE ({', '.join(f'{table}.{column}' for column in profile_columns)})
+                IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in profile_columns)})
+            RETURNING {columns}, xmax = 0 AS created
+        ), grouped AS (
+            INSERT INTO {connection.ops.quote_name(through.db_table)} (
+                {connection.ops.quote_name(through.get_field('azureuser').column)},
+                {connection.ops.quote_name(through.get_field('group').column)}
+            )
+            SELECT id, %(group_id)s FROM upserted WHERE created
+            ON CONFLICT DO NOTHING
+        )
+        SELECT {columns}, created FROM upserted
+        UNION ALL
+        SELECT {columns}, false FROM {table}
+        WHERE microsoft_user_id = %(microsoft_user_id)s AND NOT EXISTS (SELECT 1 FROM upserted)
+    '''
+
+
+def upsert_azure_user(user_info: dict) -> tuple[AzureUser, bool]:
+    """Tworzy lub aktualizuje użytkownika na podstawie profilu z Microsoft Graph (auth_utils.parse_user_info)
+    jednym zapytaniem, kluczem jest wyłącznie microsoft_user_id. Nowy użytkownik trafia do grupy wyborców
+    w tym samym zapytaniu, niezmieniony profil nie powoduje zapisu wiersza. Zwraca (użytkownik, czy_utworzony)
+    tak jak get_or_create"""
+    if not user_info.get('id'):
+        # NULL w microsoft_user_id nie koliduje z żadnym wierszem, każde logowanie tworzyłoby nowego użytkownika
+        raise ValueError("Profil Microsoft Graph nie zawiera id użytkownika")
+    params = {
+        'microsoft_user_id': user_info['id'],
+        'first_name': user_info['first_name'],
+        'last_name': user_info['last_name'],
+        'email': user_info['email'],
+        'username': user_info['email'],
+        'now': timezone.now(),
+        'group_id': get_group_id(VOTER_GROUP),
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(_upsert_sql(), params)
+        row = cursor.fetchone()
+    if row is None:
+        # Wiersz wstawiony równolegle przez inne logowanie nie jest widoczny w migawce zapytania
+        return AzureUser.objects.get(microsoft_user_id=user_info['id']), False
+    field_names = [field.attname for field in AzureUser._meta.concrete_fields]
+    return AzureUser.from_db(connection.alias, field_names, row[:-1]), row[-1]
@@ -5,12 +5,14 @@ from django.urls import reverse
 from django.conf import settings
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.models import Group
+
+from asgiref.sync import sync_to_async
 
 from urllib.parse import urlencode, parse_qs
 
-from .auth_utils import Office365Authentication
-from .models import AzureUser
+from .auth_utils import get_office365_authentication
+from .async_auth import get_async_office365_authentication
+from .users import upsert_azure_user
 
 # TODO: Dodać możliwość logowania się do django admin opiekunom bez superusera ale tylko dla wyznaczonych uprawnień
 
@@ -21,46 +23,62 @@ def microsoft_login(request: HttpRequest):
         state=urlencode({'next': next_url})
     if request.session.get('microsoft_user_id') is not None:
         return redirect('samorzad:index')
-    auth = Office365Authentication()
+    auth = get_office365_authentication()
     redirect_uri = request.build_absolute_uri(reverse('office_auth:microsoft_callback'))
     error_uri = request.build_absolute_uri(reverse('office_auth:microsoft_callback'))
     auth_url = auth.generate_auth_url(redirect_uri=redirect_uri, error_uri=error_uri, state=state)
     return redirect(auth_url)
 
 
+def _complete_login(request: HttpRequest, user_info: dict):
+    """Tworzy (przy pierwszym logowaniu) i loguje użytkownika na podstawie profilu z Microsoft Graph"""
+    user, _ = upsert_azure_user(user_info)
+    login(request, user)
+    request.session['microsoft_user_id'] = user_info['id']
+
+
+def _get_redirect_target(request: HttpRequest):
+    state = request.GET.get('state')
+    redirect_to = 'samorzad:index'
+    if state:
+        parsed_state = parse_qs(state)
+        next_list = parsed_state.get('next')
+        if next_list:
+            redirect_to = next_list[0]
+    return redirect_to
+
+
 def microsoft_callback(request:HttpRequest):
-    auth = Office365Authentication()
+    auth = get_office365_authentication()
     redirect_uri = request.build_absolute_uri(reverse('office_auth:microsoft_callback'))
     try:
         code = request.GET.get('code')
         token_result = auth.get_token(code, redirect_uri=redirect_uri)
         user_info = auth.get_user_info(token_result['access_token'])
-        user, created = AzureUser.objects.get_or_create(
-            # TODO: Zamiast chamsko pobierać wartość klucza należy użyć metody .get oraz zabezpieczyć przed możliością wsytąpienia user_info['id'] is None
-            microsoft_user_id=user_info['id'],
-            first_name=user_info['first_name'],
-            last_name=user_info['last_name'],
-            email=user_info['email'],
-            username=user_info['email']
-        )
-        if created:
-            Group.objects.get(name='wyborcy').user_set.add(user)
-        login(request, user)
-        request.session['microsoft_user_id'] = user_info['id']
-        state = request.GET.get('state')
-        redirect_to = 'samorzad:index'
-        if state:
-            parsed_state = parse_qs(state)
-            next_list = parsed_state.get('next')
-            if next_list:
-                redirect_to = next_list[0]
-        return redirect(redirect_to)
+        auth.forget_tokens()
+        _complete_login(request, user_info)
+        return redirect(_get_redirect_target(request))
     except Exception as e:
         return redirect('office_auth:microsoft_login')
 
+
+async def microsoft_callback_async(request: HttpRequest):
+    """microsoft_callback dla trybu ASGI (office_auth/urls.py). Oczekiwanie na Microsoft Entra ID i Graph
+    nie blokuje workera, w wątku wykonuje się tylko zapis użytkownika i sesji"""
+    auth = get_async_office365_authentication()
+    redirect_uri = request.build_absolute_uri(reverse('office_auth:microsoft_callback'))
+    try:
+        code = request.GET.get('code')
+        token_result = await auth.get_token(code, redirect_uri=redirect_uri)
+        user_info = await auth.get_user_info(token_result['access_token'])
+        await sync_to_async(_complete_login)(request, user_info)
+        return redirect(_get_redirect_target(request))
+    except Exception:
+        return redirect('office_auth:microsoft_login')
+
 def logout_view(request:HttpRequest):
     request.session.flush()
     redirect_uri = request.build_absolute_uri(reverse("samorzad:index"))
-    logout_url = f"https://login.microsoftonline.com/{settings.MICROSOFT_TENANT_ID}/oauth2/v2.0/logout?post_logout_redirect_uri={redirect_uri}"
+    logout_url = f"{settings.MICROSOFT_AUTHORITY_HOST}/{settings.MICROSOFT_TENANT_ID}/oauth2/v2.0/logout?post_logout_redirect_uri={redirect_uri}"
     return redirect(logout_url)
 
@@ -1,18 +1,49 @@
 from django.utils.timezone import datetime
 
 from django.db import models
+from django.contrib.postgres.indexes import BrinIndex
 from django.core.validators import MinValueValidator
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import pre_save
 
 from auditlog.registry import auditlog
+from auditlog.models import LogEntry
+from auditlog.diff import model_instance_diff
+from auditlog.cid import get_cid
+from auditlog.context import auditlog_disabled
 import pytz
 
 from office_auth.models import AzureUser
 
 WARSAW_TZ = pytz.timezone('Europe/Warsaw')
 
+
+def log_bulk_created(instances):
+    """Wpisy auditlog CREATE dla obiektów zapisanych przez bulk_create (pomija post_save, na którym działa
+    auditlog), tak jak LogEntry.objects.log_create, ale jednym INSERT. pre_save LogEntry jest wysyłany ręcznie,
+    żeby AuditlogMiddleware (set_actor) uzupełnił aktora i adres IP"""
+    if not instances or auditlog_disabled.get():
+        return
+    content_type = ContentType.objects.get_for_model(instances[0])
+    cid = get_cid()
+    entries = []
+    for instance in instances:
+        entry = LogEntry(
+            content_type=content_type,
+            object_pk=str(instance.pk),
+            object_id=instance.pk,
+            object_repr=str(instance),
+            action=LogEntry.Action.CREATE,
+            changes=model_instance_diff(None, instance),
+            cid=cid,
+        )
+        pre_save.send(sender=LogEntry, instance=entry, raw=False, using=None, update_fields=None)
+        entries.append(entry)
+    LogEntry.objects.bulk_create(entries)
+
 class Oscar(models.Model):
     name = models.CharField(max_length=2048, null=False,unique=True,  error_messages={
         'max_length':"Nazwa oscara nie może przekraczać 2048 znaków",
@@ -147,16 +178,17 @@ class VotingEvent(models.Model):
         return "Zakończone"
 
     def populate_first_round(self, first_round):
-        if first_round.candidatures.count() > 0:
+        if first_round.candidatures.exists():
             raise Exception(f"Nie można wypełnić pierwszej rundy danymi (id: {first_round.id}), ponieważ już zawiera kandydatury")
-        for o in Oscar.objects.all():
-            for t in Teacher.objects.all():
-                Candidature.objects.create(
-                    teacher=t,
-                    oscar=o,
-                    voting_round=first_round
-                )
-
+        # Iloczyn oscarów i nauczycieli jednym INSERT, zamiast zapytania o nauczycieli i zapisu na każdą parę.
+        # bulk_create pomija sygnały auditlog, wpisy CREATE są zapisywane jawnie (log_bulk_created)
+        teachers = list(Teacher.objects.all())
+        candidatures = Candidature.objects.bulk_create(
+            Candidature(teacher=teacher, oscar=oscar, voting_round=first_round)
+            for oscar in Oscar.objects.all()
+            for teacher in teachers
+        )
+        log_bulk_created(candidatures)
 
     def __str__(self):
         return f'VotingEvent(created_at={self.localize_dt(self.created_at).strftime('%Y.%m.%d %H:%M:%S')}, with_nominations={self.with_nominations})'
@@ -229,7 +261,8 @@ auditlog.register(VotingRound)
 
 class Vote(models.Model):
     candidature = models.ForeignKey(Candidature, on_delete=models.CASCADE, related_name='votes', null=True, verbose_name="Kandydatura")
-    microsoft_user = models.ForeignKey(AzureUser, on_delete=models.CASCADE, related_name='oscar_votes', verbose_name="Użytkownik")
+    # Bez osobnego indeksu, głosy użytkownika obsługuje indeks ograniczenia unique_vote_per_candidature
+    microsoft_user = models.ForeignKey(AzureUser, on_delete=models.CASCADE, related_name='oscar_votes', db_index=False, verbose_name="Użytkownik")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -242,6 +275,10 @@ class Vote(models.Model):
                 violation_error_code='constraint_violation'
             )
         ]
+        # Wyszukiwanie głosów użytkownika obsługuje indeks ograniczenia unique_vote_per_candidature
+        indexes = [
+            BrinIndex(fields=['created_at'], name='oscary_vote_created_brin'),
+        ]
         verbose_name = "Głos"
         verbose_name_plural = "Głosy"
 
@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.utils import timezone
+
+from auditlog.context import set_actor
+from auditlog.models import LogEntry
+
+from oscary.models import Candidature, Oscar, Teacher, VotingEvent, VotingRound
+from office_auth.models import AzureUser
+
+
+class PopulateFirstRoundTest(TestCase):
+    """Kandydatury pierwszej rundy są tworzone przez bulk_create, wpisy auditlog muszą powstać mimo to"""
+
+    def setUp(self):
+        for number in range(2):
+            Oscar.objects.create(name=f'Oscar {number}', info='Opis')
+        for number in range(3):
+            Teacher.objects.create(first_name='Jan', last_name=f'Kowalski{number}', info='Opis')
+        self.voting_event = VotingEvent.objects.create(with_nominations=False)
+        self.first_round = VotingRound.objects.create(
+            voting_event=self.voting_event,
+            planned_start=timezone.now() + timedelta(days=1),
+            planned_end=timezone.now() + timedelta(days=2),
+            round_type=VotingRound.VotingRoundType.FINAL
+        )
+        self.actor = AzureUser.objects.create(username='admin', password='ZAQ!2wsx')
+
+    def test_log_entry_for_each_candidature(self):
+        with set_actor(self.actor, remote_addr='127.0.0.1'):
+            self.voting_event.populate_first_round(first_round=self.first_round)
+        candidatures = Candidature.objects.filter(voting_round=self.first_round)
+        self.assertEqual(candidatures.count(), 6)
+        entries = LogEntry.objects.filter(content_type=ContentType.objects.get_for_model(Candidature))
+        self.assertEqual(
+            sorted(entries.values_list('object_id', flat=True)),
+            sorted(candidatures.values_list('id', flat=True))
+        )
+        entry = entries.get(object_id=candidatures.first().id)
+        self.assertEqual(entry.action, LogEntry.Action.CREATE)
+        self.assertEqual(entry.actor, self.actor)
+        self.assertEqual(entry.remote_addr, '127.0.0.1')
+        self.assertEqual(entry.object_repr, str(candidatures.first()))
+        self.assertEqual(entry.changes['voting_round'], ['None', str(self.first_round.id)])
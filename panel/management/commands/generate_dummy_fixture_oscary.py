@@ -7,21 +7,37 @@ import json
 import uuid
 from faker import Faker
 import hashlib
+from collections import Counter
+
+from panel.management.fixture_writer import FixtureWriter, FORMATS
+from panel.management.parallel import map_in_order
 
 fake = Faker('pl_PL')
+# Klucz główny pierwszego generowanego użytkownika
+FIRST_USER_PK = 10
+# Maksymalna liczba użytkowników w jednej części generowania głosów
+SHARD_USERS = 10_000
+
+
+def _random_uuid():
+    """UUID4 z modułu random, powtarzalny przy ustawionym ziarnie (--seed)"""
+    return uuid.UUID(int=random.getrandbits(128), version=4)
 
 
 def _simple_password_hash(password):
-    return f"pbkdf2_sha256$600000${uuid.uuid4().hex[:22]}${hashlib.sha256(password.encode()).hexdigest()}"
+    return f"pbkdf2_sha256$600000${_random_uuid().hex[:22]}${hashlib.sha256(password.encode()).hexdigest()}"
 
 
 def generate_azure_users(count=500):
     """Generuje użytkowników Azure AD"""
-    now = timezone.now()
-    c = 10
-    users = []
+    return list(iter_azure_users(count))
+
+
+def iter_azure_users(count=500):
+    """Generator użytkowników o kluczach FIRST_USER_PK..FIRST_USER_PK + count - 1"""
+    c = FIRST_USER_PK
     for i in range(count):
-        microsoft_user_id = str(uuid.uuid4())
+        microsoft_user_id = str(_random_uuid())
         first_name = fake.first_name()
         last_name = fake.last_name()
         username = f"{first_name.lower()}.{last_name.lower()}{i + 1}"
@@ -42,9 +58,8 @@ def generate_azure_users(count=500):
                 "password": _simple_password_hash("ZAQ!2wsx"),
             }
         }
-        users.append(user_data)
+        yield user_data
         c = c + 1
-    return users
 
 
 def generate_oscars():
@@ -385,10 +400,28 @@ def generate_candidatures(voting_rounds, oscars, teachers):
     return candidatures
 
 
-def generate_votes(candidatures, voting_rounds, users):
+def generate_votes(candidatures, voting_rounds, users, jobs=1):
     """Generuje głosy użytkowników"""
-    votes = []
-    pk_counter = 1
+    return list(iter_votes(candidatures, voting_rounds, [user['pk'] for user in users], jobs=jobs))
+
+
+def iter_votes(candidatures, voting_rounds, user_ids, jobs=1):
+    """Generator głosów. Użytkownicy są podawani tylko jako klucze główne (np. range), więc nie muszą być w pamięci.
+    Części (_votes_shards) są generowane w jobs procesach i łączone w kolejności, wynik nie zależy od jobs"""
+    shards = list(_votes_shards(candidatures, voting_rounds, user_ids))
+    pk_offset = 0
+    for votes in map_in_order(_generate_votes_shard, shards, jobs):
+        # Części numerują głosy od 1, kolejny zakres kluczy zaczyna się za poprzednią częścią
+        for vote in votes:
+            vote['pk'] += pk_offset
+            yield vote
+        pk_offset += len(votes)
+
+
+def _votes_shards(candidatures, voting_rounds, user_ids):
+    """Dzieli generowanie głosów na niezależne części (runda, do SHARD_USERS użytkowników).
+    Ziarno części pochodzi z modułu random i jej położenia, więc części można generować w dowolnej kolejności"""
+    base_seed = random.getrandbits(64)
     now = timezone.now()
 
     # Grupujemy kandydatury po rundach
@@ -428,107 +461,138 @@ def generate_votes(candidatures, voting_rounds, users):
             oscar_id = candidature['fields']['oscar']
             if oscar_id not in candidatures_by_oscar:
                 candidatures_by_oscar[oscar_id] = []
-            candidatures_by_oscar[oscar_id].append(candidature)
+            candidatures_by_oscar[oscar_id].append(candidature['pk'])
 
-        # Symulujemy głosowanie użytkowników
-        # Im nowsza runda, tym większy udział (od 60% do 85%)
+        # Im nowsza runda, tym większy udział (od 60% do 85%), wspólny dla wszystkich części rundy
         participation_rate = random.uniform(0.6, 0.85)
-        voting_users = random.sample(users, int(len(users) * participation_rate))
-
-        for user in voting_users:
-            user_id = user['pk']
-
-            # Użytkownik głosuje na każdy oskar (może nie na wszystkie)
-            for oscar_id, oscar_candidatures in candidatures_by_oscar.items():
-                # 90% szans na oddanie głosu na konkretny oskar
-                if random.random() < 0.9:
-                    # Wybieramy jedną kandydaturę z tego oskara
-                    selected_candidature = random.choice(oscar_candidatures)
-
-                    # Losowy moment głosowania w trakcie rundy
-                    random_seconds = random.randint(0, total_seconds)
-                    vote_time = planned_start + timedelta(seconds=random_seconds)
-
-                    vote_data = {
-                        'model': 'oscary.Vote',
-                        'pk': pk_counter,
-                        'fields': {
-                            'candidature': selected_candidature['pk'],
-                            'microsoft_user': user_id,
-                            'created_at': vote_time.isoformat(),
-                        }
-                    }
-                    votes.append(vote_data)
-                    pk_counter += 1
 
+        for start in range(0, len(user_ids), SHARD_USERS):
+            yield {
+                'seed': f'{base_seed}-{round_id}-{start}',
+                'planned_start': planned_start,
+                'total_seconds': total_seconds,
+                'candidatures_by_oscar': candidatures_by_oscar,
+                'participation_rate': participation_rate,
+                'user_ids': user_ids[start:start + SHARD_USERS],
+            }
+
+
+def _generate_votes_shard(shard):
+    """Głosy jednej części z kluczami od 1, uruchamiane także w procesach potomnych"""
+    rng = random.Random(shard['seed'])
+    votes = []
+    pk_counter = 1
+
+    # Symulujemy głosowanie użytkowników
+    user_ids = shard['user_ids']
+    voting_users = rng.sample(user_ids, int(len(user_ids) * shard['participation_rate']))
+
+    for user_id in voting_users:
+        # Użytkownik głosuje na każdy oskar (może nie na wszystkie)
+        for oscar_id, oscar_candidatures in shard['candidatures_by_oscar'].items():
+            # 90% szans na oddanie głosu na konkretny oskar
+            if rng.random() < 0.9:
+                # Wybieramy jedną kandydaturę z tego oskara
+                selected_candidature = rng.choice(oscar_candidatures)
+
+                # Losowy moment głosowania w trakcie rundy
+                random_seconds = rng.randint(0, shard['total_seconds'])
+                vote_time = shard['planned_start'] + timedelta(seconds=random_seconds)
+
+                votes.append({
+                    'model': 'oscary.Vote',
+                    'pk': pk_counter,
+                    'fields': {
+                        'candidature': selected_candidature,
+                        'microsoft_user': user_id,
+                        'created_at': vote_time.isoformat(),
+                    }
+                })
+                pk_counter += 1
     return votes
 
 
 class Command(BaseCommand):
-    help = "Tworzy fixturę z fałszywymi danymi dla systemu Oskarów. Po wygenerowaniu fixtury należy ją załadować do bazy danych za pomocą python manage.py loaddata"
+    help = ("Tworzy fixturę z fałszywymi danymi dla systemu Oskarów. Po wygenerowaniu fixtury należy ją załadować do "
+            "bazy danych za pomocą python manage.py loaddata. Formaty jsonl i csv (panel/management/fixture_writer.py) "
+            "zapisują rekordy przyrostowo, bez trzymania całej fixtury w pamięci")
 
     def add_arguments(self, parser):
-        parser.add_argument('--output', type=str, default='oscar_dummy_fixture.json', help='Nazwa pliku wyjściowego')
+        parser.add_argument('--output', type=str, default=None,
+                            help='Plik wyjściowy, dla formatu csv katalog (domyślnie oscar_dummy_fixture.<format>)')
+        parser.add_argument('--format', choices=('json', *FORMATS), default='json',
+                            help='json - jedna lista z wcięciami, jsonl/csv - zapis strumieniowy')
         parser.add_argument('--users', type=int, default=500, help='Liczba użytkowników do wygenerowania')
         parser.add_argument('--teachers', type=int, default=80, help='Liczba nauczycieli do wygenerowania')
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='Liczba procesów generujących głosy, wynik nie zależy od tej wartości')
+        parser.add_argument('--seed', type=int, default=None, help='Ziarno losowania, ta sama wartość z --now daje tę samą fixturę')
+        parser.add_argument('--now', type=str, default=None,
+                            help='Chwila (ISO 8601), względem której generowane są daty (domyślnie obecna)')
 
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS('Generowanie fixtury dla systemu Oskarów...'))
-
-        # Generujemy wszystkie dane
-        fixture_data = []
+        if options['jobs'] < 1:
+            raise CommandError("--jobs musi być dodatnie")
+        random.seed(options['seed'])
+        fake.seed_instance(options['seed'])
+        output_file = options['output'] or f'oscar_dummy_fixture.{options["format"]}'
+        # Wszystkie daty względem jednej chwili
+        with freeze_time(options['now'] or timezone.now()):
+            if options['format'] == 'json':
+                counts = self._write_json(output_file, options)
+            else:
+                counts = self._write_stream(output_file, options)
 
-        # Użytkownicy Azure AD
-        self.stdout.write('Generowanie użytkowników Azure AD...')
-        users = generate_azure_users(options['users'])
-        fixture_data.extend(users)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Fixtura dla systemu Oskarów została wygenerowana pomyślnie!\n'
+                f'Plik: {output_file}\n'
+                f'Użytkownicy: {options["users"]}\n'
+                f'Nauczyciele: {options["teachers"]}\n'
+                f'Kategorie Oskarów: {counts["oscary.Oscar"]}\n'
+                f'Wydarzenia głosowania: {counts["oscary.VotingEvent"]}\n'
+                f'Rundy głosowania: {counts["oscary.VotingRound"]}\n'
+                f'Kandydatury: {counts["oscary.Candidature"]}\n'
+                f'Głosy: {counts["oscary.Vote"]}\n'
+                f'Łączna liczba obiektów: {sum(counts.values())}'
+            )
+        )
 
-        # Kategorie Oskarów
+    def _generate_events(self, options):
+        """Kategorie, nauczyciele, wydarzenia, rundy i kandydatury, zwraca (rundy, kandydatury, wszystkie rekordy)"""
         self.stdout.write('Generowanie kategorii Oskarów...')
         oscars = generate_oscars()
-        fixture_data.extend(oscars)
-
-        # Nauczyciele
         self.stdout.write('Generowanie nauczycieli...')
         teachers = generate_teachers(options['teachers'])
-        fixture_data.extend(teachers)
-
-        # Wydarzenia głosowania
         self.stdout.write('Generowanie wydarzeń głosowania...')
         voting_events = generate_voting_events()
-        fixture_data.extend(voting_events)
-
-        # Rundy głosowania
         self.stdout.write('Generowanie rund głosowania...')
         voting_rounds = generate_voting_rounds(voting_events)
-        fixture_data.extend(voting_rounds)
-
-        # Kandydatury
         self.stdout.write('Generowanie kandydatur...')
         candidatures = generate_candidatures(voting_rounds, oscars, teachers)
-        fixture_data.extend(candidatures)
+        return voting_rounds, candidatures, [*oscars, *teachers, *voting_events, *voting_rounds, *candidatures]
 
-        # Głosy
+    def _write_json(self, output_file, options):
+        self.stdout.write(self.style.SUCCESS('Generowanie fixtury dla systemu Oskarów...'))
+        self.stdout.write('Generowanie użytkowników Azure AD...')
+        users = generate_azure_users(options['users'])
+        voting_rounds, candidatures, events = self._generate_events(options)
         self.stdout.write('Generowanie głosów...')
-        votes = generate_votes(candidatures, voting_rounds, users)
-        fixture_data.extend(votes)
-
-        # Zapisujemy do pliku
-        output_file = options['output']
+        votes = generate_votes(candidatures, voting_rounds, users, jobs=options['jobs'])
+        fixture_data = [*users, *events, *votes]
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(fixture_data, f, ensure_ascii=False, indent=2)
-
-        self.stdout.write(
-            self.style.SUCCESS(
-                f'Fixtura dla systemu Oskarów została wygenerowana pomyślnie!\n'
-                f'Plik: {output_file}\n'
-                f'Użytkownicy: {options["users"]}\n'
-                f'Nauczyciele: {options["teachers"]}\n'
-                f'Kategorie Oskarów: {len(oscars)}\n'
-                f'Wydarzenia głosowania: {len(voting_events)}\n'
-                f'Rundy głosowania: {len(voting_rounds)}\n'
-                f'Kandydatury: {len(candidatures)}\n'
-                f'Głosy: {len(votes)}\n'
-                f'Łączna liczba obiektów: {len(fixture_data)}'
-            )
-        )
\ No newline at end of file
+        return Counter(record['model'] for record in fixture_data)
+
+    def _write_stream(self, output_file, options):
+        self.stdout.write(self.style.SUCCESS(f'Generowanie fixtury dla systemu Oskarów ({options["format"]})...'))
+        progress = lambda model, count: self.stdout.write(f'{model}: {count}')
+        with FixtureWriter(output_file, options['format'], progress=progress) as writer:
+            self.stdout.write('Generowanie użytkowników Azure AD...')
+            writer.write(iter_azure_users(options['users']))
+            voting_rounds, candidatures, events = self._generate_events(options)
+            writer.write(events)
+            self.stdout.write('Generowanie głosów...')
+            user_ids = range(FIRST_USER_PK, FIRST_USER_PK + options['users'])
+            writer.write(iter_votes(candidatures, voting_rounds, user_ids, jobs=options['jobs']))
+        return writer.counts
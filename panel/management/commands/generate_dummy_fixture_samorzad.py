@@ -7,21 +7,37 @@ import json
 import uuid
 from faker import Faker
 import hashlib
+from collections import Counter
+
+from panel.management.fixture_writer import FixtureWriter, FORMATS
+from panel.management.parallel import map_in_order
 
 fake = Faker('pl_PL')
+# Klucz główny pierwszego generowanego użytkownika
+FIRST_USER_PK = 10
+# Maksymalna liczba użytkowników w jednej części generowania głosów
+SHARD_USERS = 10_000
+
+
+def _random_uuid():
+    """UUID4 z modułu random, powtarzalny przy ustawionym ziarnie (--seed)"""
+    return uuid.UUID(int=random.getrandbits(128), version=4)
 
 
 def _simple_password_hash(password):
-    return f"pbkdf2_sha256$600000${uuid.uuid4().hex[:22]}${hashlib.sha256(password.encode()).hexdigest()}"
+    return f"pbkdf2_sha256$600000${_random_uuid().hex[:22]}${hashlib.sha256(password.encode()).hexdigest()}"
 
 
 def generate_azure_users(count=800):
-    now = timezone.now()
-    c = 10
-    users = []
+    return list(iter_azure_users(count))
+
+
+def iter_azure_users(count=800):
+    """Generator użytkowników o kluczach FIRST_USER_PK..FIRST_USER_PK + count - 1"""
+    c = FIRST_USER_PK
     for i in range(count):
         # Generowanie unikalnego Microsoft User ID (podobnego do rzeczywistego Azure AD)
-        microsoft_user_id = str(uuid.uuid4())
+        microsoft_user_id = str(_random_uuid())
         first_name = fake.first_name()
         last_name = fake.last_name()
         username = f"{first_name.lower()}.{last_name.lower()}{i + 1}"
@@ -41,9 +57,8 @@ def generate_azure_users(count=800):
                 "password": _simple_password_hash("ZAQ!2wsx"),
             }
         }
-        users.append(user_data)
+        yield user_data
         c = c + 1
-    return users
 
 
 def generate_votings():
@@ -269,121 +284,201 @@ def generate_electoral_programs(registrations:list):
     return programs
 
 
-def generate_votes(registrations, users, votings):
+def generate_votes(registrations, users, votings, jobs=1):
+    """Generuje karty do głosowania (samorzad.Ballot) i należące do nich głosy. Zwraca krotkę (karty, głosy)"""
+    ballots = []
     votes = []
-    pk_counter = 1
-
+    for record in iter_votes(registrations, [user['pk'] for user in users], votings, jobs=jobs):
+        if record['model'] == 'samorzad.Ballot':
+            ballots.append(record)
+        else:
+            votes.append(record)
+    return ballots, votes
+
+
+def iter_votes(registrations, user_ids, votings, jobs=1):
+    """Generator kart do głosowania (samorzad.Ballot), po każdej karcie następują jej głosy (samorzad.Vote).
+    Użytkownicy są podawani tylko jako klucze główne (np. range), więc nie muszą być w pamięci.
+    Części (_votes_shards) są generowane w jobs procesach i łączone w kolejności, wynik nie zależy od jobs"""
+    shards = list(_votes_shards(registrations, user_ids, votings))
+    ballot_offset = 0
+    vote_offset = 0
+    for records in map_in_order(_generate_votes_shard, shards, jobs):
+        # Części numerują rekordy od 1, kolejne zakresy kluczy zaczynają się za poprzednią częścią
+        ballots = 0
+        votes = 0
+        for record in records:
+            if record['model'] == 'samorzad.Ballot':
+                record['pk'] += ballot_offset
+                ballots += 1
+            else:
+                record['pk'] += vote_offset
+                record['fields']['ballot'] += ballot_offset
+                votes += 1
+            yield record
+        ballot_offset += ballots
+        vote_offset += votes
+
+
+def _votes_shards(registrations, user_ids, votings):
+    """Dzieli generowanie głosów na niezależne części (głosowanie, do SHARD_USERS użytkowników).
+    Ziarno części pochodzi z modułu random i jej położenia, więc części można generować w dowolnej kolejności"""
+    base_seed = random.getrandbits(64)
+    now = timezone.now()
     for voting in votings:
         voting_id = voting['pk']
-        votes_per_user = voting['fields']['votes_per_user']
-
         planned_start = timezone.datetime.fromisoformat(voting['fields']['planned_start'])
-        planned_end = timezone.datetime.fromisoformat(voting['fields']['planned_end'])
 
-        total_seconds = int((timezone.now() - planned_start).total_seconds())
+        total_seconds = int((now - planned_start).total_seconds())
         if total_seconds < 0:
             continue
 
         # Pobierz kandydatury dopuszczone do tego głosowania
         eligible_registrations = [
-            reg for reg in registrations
+            reg['pk'] for reg in registrations
             if reg['fields']['voting'] == voting_id and reg['fields']['is_eligible']
         ]
 
         if not eligible_registrations:
             continue
 
-        # Symulujemy głosy użytkowników
-        voting_users = users
-
-        for user in voting_users:
-            user_id = user['pk']
-
-            # Losowo ustalamy ile głosów odda ten użytkownik (nie więcej niż votes_per_user)
-            votes_to_cast = random.randint(1, votes_per_user)
-            if votes_to_cast > len(eligible_registrations):
-                votes_to_cast = len(eligible_registrations)
+        for start in range(0, len(user_ids), SHARD_USERS):
+            yield {
+                'seed': f'{base_seed}-{voting_id}-{start}',
+                'voting': voting_id,
+                'votes_per_user': voting['fields']['votes_per_user'],
+                'planned_start': planned_start,
+                'total_seconds': total_seconds,
+                'registrations': eligible_registrations,
+                'user_ids': user_ids[start:start + SHARD_USERS],
+            }
 
-            selected_candidates = random.sample(eligible_registrations, votes_to_cast)
 
-            for reg in selected_candidates:
-                random_seconds = random.randint(0, total_seconds)
-                created_date = planned_start + timedelta(seconds=random_seconds)
+def _generate_votes_shard(shard):
+    """Karty i głosy jednej części z kluczami od 1, uruchamiane także w procesach potomnych"""
+    rng = random.Random(shard['seed'])
+    eligible_registrations = shard['registrations']
+    records = []
+    pk_counter = 1
+    ballot_pk_counter = 1
+
+    # Symulujemy głosy użytkowników
+    for user_id in shard['user_ids']:
+        # Losowo ustalamy ile głosów odda ten użytkownik (nie więcej niż votes_per_user)
+        votes_to_cast = min(rng.randint(1, shard['votes_per_user']), len(eligible_registrations))
+        selected_candidates = rng.sample(eligible_registrations, votes_to_cast)
+
+        # Wszystkie głosy z jednej karty są oddawane w tym samym momencie
+        random_seconds = rng.randint(0, shard['total_seconds'])
+        created_date = (shard['planned_start'] + timedelta(seconds=random_seconds)).isoformat()
+        records.append({
+            'model': 'samorzad.Ballot',
+            'pk': ballot_pk_counter,
+            'fields': {
+                'voting': shard['voting'],
+                'microsoft_user': user_id,
+                'created_at': created_date,
+            }
+        })
 
-                vote_data = {
-                    'model': 'samorzad.Vote',
-                    'pk': pk_counter,
-                    'fields': {
-                        'candidate_registration': reg['pk'],
-                        'microsoft_user': user_id,
-                        'created_at': created_date.isoformat(),
-                    }
+        for registration_id in selected_candidates:
+            records.append({
+                'model': 'samorzad.Vote',
+                'pk': pk_counter,
+                'fields': {
+                    'candidate_registration': registration_id,
+                    'microsoft_user': user_id,
+                    'ballot': ballot_pk_counter,
+                    'created_at': created_date,
                 }
-                votes.append(vote_data)
-                pk_counter += 1
-
-    return votes
+            })
+            pk_counter += 1
+        ballot_pk_counter += 1
+    return records
 
 
 class Command(BaseCommand):
-    help = "Tworzy fixturę z fałszywymi danymi dla celów testowych. Po wygenerowaniu fixtury należy ją załadować do bazy danych za pomocą python manage.py loaddata"
+    help = ("Tworzy fixturę z fałszywymi danymi dla celów testowych. Po wygenerowaniu fixtury należy ją załadować do "
+            "bazy danych za pomocą python manage.py loaddata. Formaty jsonl i csv (panel/management/fixture_writer.py) "
+            "zapisują rekordy przyrostowo, bez trzymania całej fixtury w pamięci")
 
     def add_arguments(self, parser):
-        parser.add_argument('--output', type=str, default='samorzad_dummy_fixture.json', help='Nazwa pliku wyjściowego')
+        parser.add_argument('--output', type=str, default=None,
+                            help='Plik wyjściowy, dla formatu csv katalog (domyślnie samorzad_dummy_fixture.<format>)')
+        parser.add_argument('--format', choices=('json', *FORMATS), default='json',
+                            help='json - jedna lista z wcięciami, jsonl/csv - zapis strumieniowy')
         parser.add_argument('--users', type=int, default=800, help='Liczba użytkowników do wygenerowania')
         parser.add_argument('--candidates', type=int, default=50, help='Liczba kandydatów do wygenerowania')
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='Liczba procesów generujących głosy, wynik nie zależy od tej wartości')
+        parser.add_argument('--seed', type=int, default=None, help='Ziarno losowania, ta sama wartość z --now daje tę samą fixturę')
+        parser.add_argument('--now', type=str, default=None,
+                            help='Chwila (ISO 8601), względem której generowane są daty (domyślnie obecna)')
 
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS('Generowanie fixtury...'))
-
-        # Generujemy wszystkie dane
-        fixture_data = []
+        if options['jobs'] < 1:
+            raise CommandError("--jobs musi być dodatnie")
+        random.seed(options['seed'])
+        fake.seed_instance(options['seed'])
+        output_file = options['output'] or f'samorzad_dummy_fixture.{options["format"]}'
+        # Wszystkie daty względem jednej chwili
+        with freeze_time(options['now'] or timezone.now()):
+            if options['format'] == 'json':
+                counts = self._write_json(output_file, options)
+            else:
+                counts = self._write_stream(output_file, options)
 
-        # Użytkownicy
-        self.stdout.write('Generowanie użytkowników...')
-        users = generate_azure_users(options['users'])
-        fixture_data.extend(users)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Fixtura została wygenerowana pomyślnie!\n'
+                f'Plik: {output_file}\n'
+                f'Użytkownicy: {options["users"]}\n'
+                f'Kandydaci: {options["candidates"]}\n'
+                f'Głosowania: 20 (w tym 1 obecne)\n'
+                f'Kandydatury: {counts["samorzad.CandidateRegistration"]}\n'
+                f'Karty do głosowania: {counts["samorzad.Ballot"]}\n'
+                f'Głosy: {counts["samorzad.Vote"]}\n'
+                f'Łączna liczba obiektów: {sum(counts.values())}'
+            )
+        )
 
-        # Głosowania
+    def _generate_election(self, options):
+        """Głosowania, kandydaci, kandydatury i programy wyborcze, zwraca (głosowania, kandydatury, wszystkie rekordy)"""
         self.stdout.write('Generowanie głosowań...')
         votings = generate_votings()
-        fixture_data.extend(votings)
-
-        # Kandydaci
         self.stdout.write('Generowanie kandydatów...')
         candidates = generate_candidates(options['candidates'])
-        fixture_data.extend(candidates)
-
-        # Kandydatury
         self.stdout.write('Generowanie kandydatur...')
         registrations = generate_candidate_registrations()
-        fixture_data.extend(registrations)
-
-        # Programy wyborcze
         self.stdout.write('Generowanie programów wyborczych...')
-        fixture_data.extend(generate_electoral_programs(registrations=registrations))
+        programs = generate_electoral_programs(registrations=registrations)
+        return votings, registrations, [*votings, *candidates, *registrations, *programs]
 
-        # Głosy
+    def _write_json(self, output_file, options):
+        self.stdout.write(self.style.SUCCESS('Generowanie fixtury...'))
+        self.stdout.write('Generowanie użytkowników...')
+        users = generate_azure_users(options['users'])
+        votings, registrations, election = self._generate_election(options)
         self.stdout.write('Generowanie głosów...')
-        fixture_data.extend(generate_votes(
-            registrations=registrations,
-            users=users,
-            votings=votings
-        ))
-
-        # Zapisujemy do pliku
-        output_file = options['output']
+        ballots, votes = generate_votes(
+            registrations=registrations, users=users, votings=votings, jobs=options['jobs']
+        )
+        fixture_data = [*users, *election, *ballots, *votes]
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(fixture_data, f, ensure_ascii=False, indent=2)
-
-        self.stdout.write(
-            self.style.SUCCESS(
-                f'Fixtura została wygenerowana pomyślnie!\n'
-                f'Plik: {output_file}\n'
-                f'Użytkownicy: {options["users"]}\n'
-                f'Kandydaci: {options["candidates"]}\n'
-                f'Głosowania: 20 (w tym 1 obecne)\n'
-                f'Kandydatury: {len(registrations)}\n'
-                f'Łączna liczba obiektów: {len(fixture_data)}'
-            )
-        )
+        return Counter(record['model'] for record in fixture_data)
+
+    def _write_stream(self, output_file, options):
+        self.stdout.write(self.style.SUCCESS(f'Generowanie fixtury ({options["format"]})...'))
+        progress = lambda model, count: self.stdout.write(f'{model}: {count}')
+        with FixtureWriter(output_file, options['format'], progress=progress) as writer:
+            self.stdout.write('Generowanie użytkowników...')
+            writer.write(iter_azure_users(options['users']))
+            votings, registrations, election = self._generate_election(options)
+            writer.write(election)
+            self.stdout.write('Generowanie głosów...')
+            user_ids = range(FIRST_USER_PK, FIRST_USER_PK + options['users'])
+            writer.write(iter_votes(
+                registrations=registrations, user_ids=user_ids, votings=votings, jobs=options['jobs']
+            ))
+        return writer.counts
@@ -0,0 +1,183 @@
+from django.core import serializers
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+
+from ekonomvote.latency import format_percentiles
+from office_auth.fake_idp import FakeIdentityProvider, USER_ID_PREFIX
+from office_auth.models import AzureUser
+from panel.management.commands.generate_dummy_fixture_samorzad import (
+    fake,
+    generate_votings,
+    generate_candidates,
+    generate_candidate_registrations,
+    generate_electoral_programs,
+)
+from samorzad.models import Voting, Candidate, CandidateRegistration, ElectoralProgram
+
+
+class Command(BaseCommand):
+    help = ("Test obciążeniowy dnia wyborów względem uruchomionej instancji (--url). Każdy wirtualny wyborca loguje się "
+            "przez lokalną atrapę dostawcy tożsamości (office_auth/fake_idp.py), otwiera stronę główną i listę "
+            "głosowań, oddaje kartę w trwającym głosowaniu i odpytuje wykres i oś czasu wyników. Instancja musi "
+            "korzystać z tej samej bazy danych i działać w trybie ASGI (SAMORZAD_ASYNC_VIEWS, MSAL wymaga https) "
+            "z MICROSOFT_AUTHORITY_HOST=http://127.0.0.1:<--idp-port> i MICROSOFT_GRAPH_URL=<ten sam adres>/v1.0. "
+            "Dane głosowania można utworzyć generatorami generate_dummy_fixture_samorzad (--prepare)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='Adres testowanej instancji')
+        parser.add_argument('--users', type=int, default=200, help='Liczba wirtualnych wyborców')
+        parser.add_argument('--concurrency', type=int, default=50, help='Liczba wyborców działających równocześnie')
+        parser.add_argument('--ramp-up', type=float, default=30, help='Czas w sekundach, w którym startują kolejni wyborcy')
+        parser.add_argument('--polls', type=int, default=5, help='Liczba odpytań wykresu i osi czasu po oddaniu głosu')
+        parser.add_argument('--poll-interval', type=float, default=2, help='Odstęp odpytań wyników w sekundach')
+        parser.add_argument('--voting', type=int, default=None, help='ID głosowania (domyślnie trwające głosowanie)')
+        parser.add_argument('--idp-port', type=int, default=8765, help='Port atrapy dostawcy tożsamości')
+        parser.add_argument('--idp-latency', type=float, default=150, help='Opóźnienie każdej odpowiedzi atrapy w ms')
+        parser.add_argument('--user-offset', type=int, default=None,
+                            help='Numer pierwszego wyborcy (domyślnie kolejny po wyborcach z poprzednich uruchomień)')
+        parser.add_argument('--seed', type=int, default=None, help='Ziarno losowania kart do głosowania')
+        parser.add_argument('--prepare', action='store_true',
+                            help='Tworzy głosowania, kandydatów i kandydatury generatorami fixtury samorządu (pusta baza)')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError("--users musi być dodatnie")
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency musi być dodatnie")
+        rng = random.Random(options['seed'])
+        if options['prepare']:
+            self._prepare(options['seed'])
+        voting = self._get_voting(options['voting'])
+        registration_ids = list(CandidateRegistration.objects.filter(
+            voting=voting, is_eligible=True
+        ).values_list('id', flat=True))
+        if len(registration_ids) < voting.votes_per_user:
+            raise CommandError(f"Głosowanie o ID {voting.id} ma za mało dopuszczonych kandydatur")
+        offset = options['user_offset']
+        if offset is None:
+            # Wyborca głosuje tylko raz, kolejne uruchomienie loguje nowych użytkowników atrapy
+            offset = AzureUser.objects.filter(microsoft_user_id__startswith=USER_ID_PREFIX).count()
+        users = options['users']
+        ballots = [rng.sample(registration_ids, voting.votes_per_user) for _ in range(users)]
+
+        with FakeIdentityProvider(latency=options['idp_latency'] / 1000, port=options['idp_port']) as idp:
+            self.stdout.write(f'Atrapa dostawcy tożsamości: {idp.url}, głosowanie {voting.id}, wyborcy: {users}')
+            ramp_step = options['ramp_up'] / users
+            started = time.perf_counter()
+
+            def run(number):
+                # Wyborcy startują równomiernie w czasie --ramp-up
+                time.sleep(max(0.0, started + number * ramp_step - time.perf_counter()))
+                return self._virtual_user(options, voting, offset + number, ballots[number])
+
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                samples = [sample for user_samples in executor.map(run, range(users)) for sample in user_samples]
+            elapsed = time.perf_counter() - started
+        self._report(samples, elapsed)
+
+    def _get_voting(self, voting_id):
+        if voting_id is not None:
+            voting = Voting.objects.filter(id=voting_id).first()
+            if voting is None:
+                raise CommandError(f"Głosowanie o ID {voting_id} nie istnieje")
+            return voting
+        now = timezone.now()
+        voting = Voting.objects.filter(planned_start__lte=now, planned_end__gt=now).order_by('planned_start').first()
+        if voting is None:
+            raise CommandError("Brak trwającego głosowania, podaj --voting albo użyj --prepare")
+        return voting
+
+    def _prepare(self, seed):
+        """Zapisuje głosowania, kandydatów, kandydatury i programy wyborcze z generatorów fixtury samorządu,
+        tak jak loaddata (bez walidacji modeli). Głosy oddają dopiero wirtualni wyborcy"""
+        if Voting.objects.exists():
+            raise CommandError("--prepare wymaga pustej bazy, generatory nadają obiektom stałe klucze główne")
+        random.seed(seed)
+        fake.seed_instance(seed)
+        registrations = generate_candidate_registrations()
+        records = [
+            *generate_votings(),
+            *generate_candidates(),
+            *registrations,
+            *generate_electoral_programs(registrations=registrations),
+        ]
+        with transaction.atomic():
+            for obj in serializers.deserialize('python', records):
+                obj.save()
+            models = [Voting, Candidate, CandidateRegistration, ElectoralProgram]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+            Voting.refresh_counters(Voting.objects.values_list('id', flat=True))
+        self.stdout.write(f'Utworzono {len(records)} obiektów')
+
+    def _virtual_user(self, options, voting, number, ballot):
+        """Scenariusz jednego wyborcy, zwraca listę (endpoint, czas w s, czy poprawna odpowiedź)"""
+        samples = []
+        base_url = options['url']
+        details_url = urljoin(base_url, reverse('samorzad:get_voting_details', kwargs={'voting_id': voting.id}))
+
+        def call(endpoint, method, url, check, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, allow_redirects=False, timeout=30, **kwargs)
+                ok = check(response)
+            except requests.RequestException:
+                ok = False
+            samples.append((endpoint, time.perf_counter() - started, ok))
+            return ok
+
+        with requests.Session() as session:
+            index_path = reverse('samorzad:index')
+            logged_in = call(
+                'office_auth:microsoft_callback', 'GET', urljoin(base_url, reverse('office_auth:microsoft_callback')),
+                lambda response: response.status_code == 302 and response.headers.get('Location') == index_path,
+                params={'code': f'valid-{number}'}
+            )
+            if not logged_in:
+                return samples
+            call('samorzad:index', 'GET', urljoin(base_url, index_path), lambda response: response.status_code == 200)
+            call('samorzad:partial_list_old_votings', 'GET', urljoin(base_url, reverse('samorzad:partial_list_old_votings')),
+                 lambda response: response.status_code == 200)
+            call('samorzad:get_voting_details', 'GET', details_url, lambda response: response.status_code == 200)
+            data = {
+                'csrfmiddlewaretoken': session.cookies.get('csrftoken', ''),
+                'form-TOTAL_FORMS': len(ballot),
+                'form-INITIAL_FORMS': 0,
+            }
+            for index, registration_id in enumerate(ballot):
+                data[f'form-{index}-candidate_registration_id'] = registration_id
+            # Odrzucona karta też przekierowuje na stronę głosowania, ale z komunikatem błędu w ciasteczku messages
+            call('samorzad:get_voting_details [głos]', 'POST', details_url,
+                 lambda response: response.status_code == 302 and 'messages' not in response.cookies,
+                 data=data, headers={'Referer': details_url})
+            for poll in range(options['polls']):
+                time.sleep(options['poll_interval'])
+                for name in ('samorzad:get_chart_data', 'samorzad:get_timeline_data'):
+                    call(name, 'GET', urljoin(base_url, reverse(name, kwargs={'voting_id': voting.id})),
+                         lambda response: response.status_code == 200)
+        return samples
+
+    def _report(self, samples, elapsed):
+        endpoints = defaultdict(list)
+        for endpoint, latency, ok in samples:
+            endpoints[endpoint].append((latency * 1000, ok))
+        self.stdout.write(f'Czas testu {elapsed:.1f} s, żądania: {len(samples)} ({len(samples) / elapsed:.1f}/s)')
+        for endpoint, endpoint_samples in endpoints.items():
+            latencies = [latency for latency, ok in endpoint_samples]
+            errors = sum(1 for latency, ok in endpoint_samples if not ok)
+            self.stdout.write(
+                f'{endpoint}: {len(latencies) / elapsed:.1f} żądań/s, {format_percentiles(latencies)}, '
+                f'błędy {errors}/{len(latencies)} ({errors / len(latencies):.1%})'
+            )
@@ -0,0 +1,159 @@
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+import random
+import time
+from freezegun import freeze_time
+
+from ekonomvote.db.copy import copy_rows
+from office_auth.models import AzureUser
+from samorzad.models import Voting
+from panel.management.commands import generate_dummy_fixture_oscary as oscary_fixture
+from panel.management.commands import generate_dummy_fixture_samorzad as samorzad_fixture
+
+
+class TableCopy:
+    """Bufor wierszy jednej tabeli zapisywanych przez COPY (psycopg 3) partiami po batch_size rekordów fixtury.
+    Pola spoza rekordu dostają wartość domyślną pola, a pola auto_now/auto_now_add wartość created_at rekordu.
+    Zapis pomija save(), full_clean() i sygnały, tak jak loaddata pomija save() modeli"""
+
+    def __init__(self, model, batch_size: int):
+        self.model = model
+        self.batch_size = batch_size
+        self.fields = model._meta.local_concrete_fields
+        self.rows = []
+        self.count = 0
+        quote_name = connection.ops.quote_name
+        self.sql = (
+            f'COPY {quote_name(model._meta.db_table)} '
+            f'({", ".join(quote_name(field.column) for field in self.fields)}) FROM STDIN'
+        )
+
+    def add(self, record):
+        self.rows.append(tuple(self._value(field, record) for field in self.fields))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    @staticmethod
+    def _value(field, record):
+        values = record['fields']
+        if field.primary_key:
+            value = record['pk']
+        elif field.name in values:
+            value = values[field.name]
+        elif getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            value = values.get('created_at') or timezone.now()
+        else:
+            value = field.get_default()
+        return field.get_db_prep_save(field.to_python(value), connection)
+
+    def flush(self):
+        if not self.rows:
+            return
+        with connection.cursor() as cursor:
+            copy_rows(cursor, self.sql, self.rows)
+        self.count += len(self.rows)
+        self.rows = []
+
+
+class Command(BaseCommand):
+    help = ("Wypełnia pustą bazę danych fałszywymi danymi z generatorów generate_dummy_fixture_* bez pliku fixtury. "
+            "Rekordy trafiają do tabel przez COPY, z pominięciem save() i full_clean(), więc duże zbiory danych "
+            "ładują się wielokrotnie szybciej niż przez loaddata. Ta sama wartość --seed i --now daje te same dane "
+            "co generate_dummy_fixture_* --format jsonl")
+
+    def add_arguments(self, parser):
+        parser.add_argument('app', choices=('samorzad', 'oscary'), help='Aplikacja, dla której generowane są dane')
+        parser.add_argument('--users', type=int, default=800, help='Liczba użytkowników do wygenerowania')
+        parser.add_argument('--candidates', type=int, default=50, help='Liczba kandydatów do wygenerowania (samorzad)')
+        parser.add_argument('--teachers', type=int, default=80, help='Liczba nauczycieli do wygenerowania (oscary)')
+        parser.add_argument('--jobs', type=int, default=1, help='Liczba procesów generujących głosy')
+        parser.add_argument('--seed', type=int, default=None, help='Ziarno losowania')
+        parser.add_argument('--now', type=str, default=None,
+                            help='Chwila (ISO 8601), względem której generowane są daty (domyślnie obecna)')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Liczba wierszy w jednym poleceniu COPY')
+        parser.add_argument('--results', action='store_true',
+                            help='Buduje liczniki głosów (także Voting.votes_count), kubełki osi czasu i wyniki '
+                                 'zakończonych głosowań (samorzad)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("seed_database zapisuje dane przez COPY i wymaga bazy PostgreSQL")
+        if options['jobs'] < 1:
+            raise CommandError("--jobs musi być dodatnie")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size musi być dodatnie")
+        if options['results'] and options['app'] != 'samorzad':
+            raise CommandError("--results jest dostępne tylko dla danych samorządu")
+        fixture = samorzad_fixture if options['app'] == 'samorzad' else oscary_fixture
+        if AzureUser.objects.filter(pk__gte=fixture.FIRST_USER_PK).exists():
+            raise CommandError(f"Użytkownicy o ID od {fixture.FIRST_USER_PK} już istnieją, generatory nadają im stałe klucze główne")
+        random.seed(options['seed'])
+        fixture.fake.seed_instance(options['seed'])
+        started = time.perf_counter()
+        # Wszystkie daty względem jednej chwili, wyniki są liczone względem tej samej chwili
+        with freeze_time(options['now'] or timezone.now()):
+            with transaction.atomic():
+                tables = self._copy(self._records(fixture, options), options['batch_size'])
+                models = [table.model for table in tables]
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                        cursor.execute(sql)
+                if fixture is samorzad_fixture:
+                    # COPY pomija Vote.save i CandidateRegistration.save, które aktualizują liczniki głosowań.
+                    # Liczba głosów pochodzi z liczników kandydatur, więc przelicza ją dopiero --results
+                    Voting.refresh_counters(
+                        Voting.objects.values_list('pk', flat=True),
+                        fields=('voters_count', 'eligible_registrations_count')
+                    )
+            for table in tables:
+                self.stdout.write(f'{table.model._meta.label}: {table.count}')
+            # Bez czasu, freezegun zamraża też time.perf_counter
+            self.stdout.write(f'Zapisano {sum(table.count for table in tables)} obiektów')
+            if options['results']:
+                call_command('rebuild_vote_tallies', stdout=self.stdout)
+                call_command('rebuild_vote_time_buckets', stdout=self.stdout)
+                call_command('finalize_votings', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Baza danych wypełniona w {time.perf_counter() - started:.1f} s'))
+
+    def _records(self, fixture, options):
+        """Rekordy fixtury w kolejności generate_dummy_fixture_* --format jsonl (najpierw obiekty nadrzędne)"""
+        user_ids = range(fixture.FIRST_USER_PK, fixture.FIRST_USER_PK + options['users'])
+        yield from fixture.iter_azure_users(options['users'])
+        if fixture is samorzad_fixture:
+            votings = fixture.generate_votings()
+            candidates = fixture.generate_candidates(options['candidates'])
+            registrations = fixture.generate_candidate_registrations()
+            programs = fixture.generate_electoral_programs(registrations=registrations)
+            yield from [*votings, *candidates, *registrations, *programs]
+            yield from fixture.iter_votes(registrations, user_ids, votings, jobs=options['jobs'])
+        else:
+            oscars = fixture.generate_oscars()
+            teachers = fixture.generate_teachers(options['teachers'])
+            voting_events = fixture.generate_voting_events()
+            voting_rounds = fixture.generate_voting_rounds(voting_events)
+            candidatures = fixture.generate_candidatures(voting_rounds, oscars, teachers)
+            yield from [*oscars, *teachers, *voting_events, *voting_rounds, *candidatures]
+            yield from fixture.iter_votes(candidatures, voting_rounds, user_ids, jobs=options['jobs'])
+
+    def _copy(self, records, batch_size: int) -> list[TableCopy]:
+        """Zapisuje rekordy do tabel, zwraca tabele w kolejności pierwszego rekordu (zależności przed zależnymi).
+        Partie różnych tabel przeplatają się (np. karty i głosy), klucze obce Django w PostgreSQL są sprawdzane
+        dopiero przy zatwierdzeniu transakcji (DEFERRABLE INITIALLY DEFERRED)"""
+        tables = {}
+        for record in records:
+            table = tables.get(record['model'])
+            if table is None:
+                model = apps.get_model(record['model'])
+                # Zajętość zakresu kluczy użytkowników sprawdza handle, tabela może zawierać np. administratorów
+                if model is not AzureUser and model.objects.exists():
+                    raise CommandError(f"Tabela modelu {model._meta.label} nie jest pusta, generatory nadają obiektom stałe klucze główne")
+                table = tables[record['model']] = TableCopy(model, batch_size)
+            table.add(record)
+        for table in tables.values():
+            table.flush()
+        return list(tables.values())
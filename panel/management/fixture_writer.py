@@ -0,0 +1,92 @@
+"""Przyrostowy zapis rekordów fixtur ({'model', 'pk', 'fields'}) z generatorów komend generate_dummy_fixture_*.
+Rekordy są zapisywane od razu po wygenerowaniu, więc zużycie pamięci nie zależy od liczby głosów.
+
+Formaty:
+
+- jsonl: jeden rekord w zwartym JSON na linię (serializer jsonl Django, python manage.py loaddata plik.jsonl)
+- csv: katalog z plikiem <app_label>.<model>.csv dla każdego modelu. Nagłówek to nazwy kolumn tabeli
+  (klucze obce jako <pole>_id), pusta wartość to NULL_MARKER, więc plik można wczytać do Postgres przez
+  COPY tabela (kolumny) FROM STDIN WITH (FORMAT csv, HEADER true, NULL '\\N')"""
+from django.apps import apps
+
+import csv
+import json
+from collections import Counter
+from pathlib import Path
+
+FORMATS = ('jsonl', 'csv')
+NULL_MARKER = '\\N'
+
+
+class FixtureWriter:
+    """Zapisuje rekordy do pliku (jsonl) albo katalogu (csv). Co progress_every rekordów modelu wywołuje
+    progress(model, liczba zapisanych rekordów modelu). Używany jako context manager"""
+
+    def __init__(self, output: str, format: str, progress=None, progress_every: int = 100_000):
+        if format not in FORMATS:
+            raise ValueError(f"Nieobsługiwany format fixtury: {format}")
+        self.output = Path(output)
+        self.format = format
+        self.progress = progress
+        self.progress_every = progress_every
+        self.counts = Counter()
+        self._files = {}
+        self._writers = {}
+        self._field_names = {}
+        if format == 'jsonl':
+            self._jsonl = open(self.output, 'w', encoding='utf-8')
+        else:
+            self.output.mkdir(parents=True, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, records) -> int:
+        """Zapisuje rekordy z dowolnego iterowalnego źródła (np. generatora), zwraca ich liczbę"""
+        written = 0
+        for record in records:
+            if self.format == 'jsonl':
+                self._jsonl.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+                self._jsonl.write('\n')
+            else:
+                self._write_csv(record)
+            written += 1
+            model = record['model']
+            self.counts[model] += 1
+            if self.progress is not None and self.counts[model] % self.progress_every == 0:
+                self.progress(model, self.counts[model])
+        return written
+
+    def _write_csv(self, record):
+        model = record['model']
+        writer = self._writers.get(model)
+        if writer is None:
+            writer = self._open_csv(model, record['fields'])
+        writer.writerow(
+            [record['pk']] + [self._csv_value(record['fields'][name]) for name in self._field_names[model]]
+        )
+
+    def _open_csv(self, model: str, fields: dict):
+        options = apps.get_model(model)._meta
+        self._field_names[model] = list(fields)
+        file = self._files[model] = open(self.output / f'{model.lower()}.csv', 'w', encoding='utf-8', newline='')
+        writer = self._writers[model] = csv.writer(file)
+        writer.writerow([options.pk.column] + [options.get_field(name).column for name in fields])
+        return writer
+
+    @staticmethod
+    def _csv_value(value):
+        if value is None:
+            return NULL_MARKER
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    def close(self):
+        if self.format == 'jsonl':
+            self._jsonl.close()
+        for file in self._files.values():
+            file.close()
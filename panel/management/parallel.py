@@ -0,0 +1,26 @@
+"""Równoległe generowanie części fixtur (komendy generate_dummy_fixture_*) z zachowaniem kolejności wyników"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+
+def map_in_order(function, items, jobs: int = 1):
+    """Odpowiednik map(function, items) wykonywany w jobs procesach. Wyniki są zwracane w kolejności items,
+    a zleconych naraz jest najwyżej jobs * 2 części. Kolejna część jest zlecana po odebraniu najstarszej,
+    więc gotowe wyniki czekające na wolniejszą wcześniejszą część nie gromadzą się w pamięci"""
+    if jobs <= 1:
+        yield from map(function, items)
+        return
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque(executor.submit(function, item) for item in islice(items, jobs * 2))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                for item in islice(items, 1):
+                    pending.append(executor.submit(function, item))
+                yield result
+        finally:
+            # Przerwany generator nie czeka na niepotrzebne już części
+            for future in pending:
+                future.cancel()
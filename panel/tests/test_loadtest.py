@@ -0,0 +1,17 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from io import StringIO
+
+
+class LoadtestArgumentsTest(SimpleTestCase):
+    """Nieprawidłowe argumenty komendy loadtest są odrzucane przed uruchomieniem testu"""
+
+    def test_users_must_be_positive(self):
+        with self.assertRaisesMessage(CommandError, '--users'):
+            call_command('loadtest', users=0, stdout=StringIO())
+
+    def test_concurrency_must_be_positive(self):
+        with self.assertRaisesMessage(CommandError, '--concurrency'):
+            call_command('loadtest', concurrency=0, stdout=StringIO())
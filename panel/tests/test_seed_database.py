@@ -0,0 +1,58 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Sum
+from django.test import TestCase, SimpleTestCase
+
+from io import StringIO
+from freezegun import freeze_time
+
+from panel.management.parallel import map_in_order
+from office_auth.models import AzureUser
+from samorzad.models import Voting, Ballot, Vote, VoteTally, VotingResultSnapshot
+from oscary.models import Vote as OscarVote
+
+
+class SeedDatabaseTest(TestCase):
+    """Testy komendy seed_database (zapis danych z generatorów fixtur przez COPY)"""
+
+    def test_seed_samorzad_with_results(self):
+        call_command('seed_database', 'samorzad', users=5, seed=1, now='2025-06-01T12:00:00+00:00', results=True, stdout=StringIO())
+        self.assertEqual(AzureUser.objects.filter(pk__gte=10).count(), 5)
+        self.assertEqual(Voting.objects.count(), 20)
+        # Głosują wszyscy użytkownicy we wszystkich rozpoczętych głosowaniach (15 zakończonych i obecne)
+        self.assertEqual(Ballot.objects.count(), 16 * 5)
+        self.assertEqual(VoteTally.objects.aggregate(votes=Sum('count'))['votes'], Vote.objects.count())
+        self.assertEqual(VotingResultSnapshot.objects.count(), 15)
+        current = Voting.objects.get(pk=20)
+        self.assertEqual(current.voters_count, 5)
+        self.assertEqual(current.votes_count, Vote.objects.filter(candidate_registration__voting=current).count())
+        # Sekwencje są ustawione za wygenerowanymi kluczami
+        future = Voting.objects.get(pk=16)
+        with freeze_time('2025-06-01 12:00:00'):
+            created = Voting.objects.create(planned_start=future.planned_start, planned_end=future.planned_end, votes_per_user=3)
+        self.assertEqual(created.pk, 21)
+
+    def test_seed_samorzad_refreshes_counters(self):
+        call_command('seed_database', 'samorzad', users=5, seed=1, now='2025-06-01T12:00:00+00:00', stdout=StringIO())
+        current = Voting.objects.get(pk=20)
+        self.assertEqual(current.voters_count, 5)
+        self.assertEqual(current.eligible_registrations_count, current.candidate_registrations.filter(is_eligible=True).count())
+        self.assertGreater(current.eligible_registrations_count, 0)
+
+    def test_seed_oscary(self):
+        call_command('seed_database', 'oscary', users=5, teachers=10, seed=1, jobs=2, stdout=StringIO())
+        self.assertTrue(OscarVote.objects.exists())
+
+    def test_seed_requires_empty_tables(self):
+        call_command('seed_database', 'samorzad', users=2, seed=1, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('seed_database', 'samorzad', users=2, seed=1, stdout=StringIO())
+
+
+class MapInOrderTest(SimpleTestCase):
+
+    def test_results_in_order(self):
+        # Więcej części niż okno zleconych naraz (jobs * 2)
+        results = map_in_order(str, range(20), jobs=2)
+        self.assertEqual(list(results), [str(i) for i in range(20)])
+        self.assertEqual(list(map_in_order(str, range(3))), ['0', '1', '2'])
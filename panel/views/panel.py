@@ -22,7 +22,7 @@ from .utils import build_filter_kwargs, build_sort_list, build_redirect_urls
 @require_http_methods(["GET", 'POST'])
 def panel_login(request:HttpRequest):
     microsoft_user_id = request.session.get('microsoft_user_id')
-    if microsoft_user_id is not None and is_opiekun(request.user):
+    if microsoft_user_id is not None and is_opiekun(request.user, request.session):
         return redirect(reverse('panel:index'))
     if request.method == 'GET':
         form = PanelLoginForm()
@@ -58,7 +58,7 @@ def panel_index(request:HttpRequest):
 @opiekun_required()
 def actions_list_main(request: HttpRequest):
     app_labels = ['samorzad']
-    banned_models = ['vote']
+    banned_models = ['vote', 'ballot']
     models = ContentType.objects.filter(app_label__in=app_labels).exclude(model__in=banned_models)
     return render(request, 'panel/actions_list.html', context={
         'action_list': ActionLog.ActionType,
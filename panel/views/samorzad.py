@@ -12,7 +12,7 @@ from django.contrib.postgres.search import SearchRank, SearchQuery, SearchVector
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
-from django.db.models import Case, When, Value, CharField
+from django.db.models import Case, When, Value, CharField, Count
 from django.template.loader import render_to_string
 from django.contrib.messages.constants import ERROR, SUCCESS, WARNING, INFO
 
@@ -238,8 +238,10 @@ def partial_read_voting_list(request:HttpRequest):
     except ValueError:
         page_number = 1
     now = timezone.now()
-    votings = Voting.objects.prefetch_related('candidate_registrations').order_by(*sort_data['sort_fields'])
+    votings = Voting.objects.order_by(*sort_data['sort_fields'])
     votings = votings.annotate(
+        # Dopuszczone kandydatury są w Voting.eligible_registrations_count, wszystkie zliczane są w tym samym zapytaniu
+        registrations_count=Count('candidate_registrations'),
         status=Case(
             When(planned_start__lte=now, planned_end__gte=now, then=Value('Aktywne')),
             When(planned_start__gt=now, then=Value('Zaplanowane')),
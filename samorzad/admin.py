@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Voting, Vote, Candidate, ElectoralProgram, CandidateRegistration
+from .models import Voting, Vote, Ballot, Candidate, ElectoralProgram, CandidateRegistration, VotingResultSnapshot
 from django.utils import timezone
 import pytz
 # Register your models here.
@@ -51,8 +51,29 @@ import pytz
 # class VotingAdmin(TimeZoneConvertAdmin):
 #     list_display = ['pk', 'planned_start', 'planned_end']
 
+class VoteAdmin(admin.ModelAdmin):
+    """Głosów nie można zmieniać ani usuwać: usunięcie nie aktualizuje agregatów
+    wyników (VoteTally, VoteTimeBucket) ani liczników głosowania. Dodanie głosu przechodzi przez Vote.save,
+    które je aktualizuje"""
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class BallotAdmin(VoteAdmin):
+    """Karty tylko do odczytu, z tych samych powodów co głosy. Kartę tworzy zapis głosu"""
+
+    def has_add_permission(self, request):
+        return False
+
+
 admin.site.register(Voting)
-admin.site.register(Vote)
+admin.site.register(Vote, VoteAdmin)
+admin.site.register(Ballot, BallotAdmin)
+admin.site.register(VotingResultSnapshot)
 admin.site.register(Candidate)
 admin.site.register(ElectoralProgram)
 admin.site.register(CandidateRegistration)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class SamorzadConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'samorzad'
+
+    def ready(self):
+        # Rejestracja sygnałów aktualizujących liczniki głosowań (samorzad.models.Voting)
+        from . import signals
@@ -0,0 +1,72 @@
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from django.core.exceptions import ValidationError
+
+from office_auth.models import AzureUser
+from .models import Voting, Vote, Ballot, CandidateRegistration, constraint_validation_error
+from .results import bump_results_version_on_commit
+
+
+class BallotSnapshot:
+    """Jednorazowo wczytany stan głosowania, na podstawie którego walidowana jest cała karta do głosowania.
+    Zastępuje zapytania wykonywane osobno dla każdego głosu w Vote.clean, pola:
+
+    - voting: Głosowanie, którego dotyczy karta
+    - user: Użytkownik oddający głosy
+    - registrations: Słownik {id kandydatury: is_eligible} wszystkich kandydatur głosowania
+    - has_voted: Czy użytkownik ma już kartę w tym głosowaniu (wyszukiwanie po unikalnym indeksie samorzad.models.Ballot)
+    """
+
+    def __init__(self, voting: Voting, user: AzureUser):
+        self.voting = voting
+        self.user = user
+        self.registrations = dict(
+            CandidateRegistration.objects.filter(voting=voting).values_list('id', 'is_eligible')
+        )
+        self.has_voted = Ballot.objects.filter(voting=voting, microsoft_user=user).exists()
+
+    def validate(self, registration_ids: list[int]):
+        """Sprawdza całą kartę według tych samych reguł co samorzad.models.Vote.clean (te same kody błędów)"""
+        now = timezone.now()
+        if now < self.voting.planned_start:
+            raise ValidationError("Nie można głosować przed rozpoczęciem głosowania", code='voting_not_started')
+        if now > self.voting.planned_end:
+            raise ValidationError("Nie można głosować po zakończeniu głosowania", code='voting_gone')
+        for registration_id in registration_ids:
+            if registration_id not in self.registrations:
+                raise ValidationError(f"Kandydatura o id: {registration_id} nie należy do obecnego głosowania", code='candidature_not_in_voting')
+            if not self.registrations[registration_id]:
+                raise ValidationError("Nie można oddać głosu na kandydata, który nie został dopuszczony do wyborów.", code='illegal_candidature')
+        if self.has_voted:
+            raise ValidationError("Użytkownik oddał już maksymalną ilość głosów w głosowaniu", code='vote_limit_reached')
+        if len(set(registration_ids)) != len(registration_ids):
+            raise ValidationError("Już zagłosowałeś na tego kandydata.", code='vote_dupliaction')
+        if len(registration_ids) > self.voting.votes_per_user:
+            raise ValidationError("Użytkownik oddał już maksymalną ilość głosów w głosowaniu", code='vote_limit_reached')
+
+
+def cast_ballot(snapshot: BallotSnapshot, registration_ids: list[int]) -> list[Vote]:
+    """Waliduje kartę na podstawie snapshotu i zapisuje kartę oraz wszystkie głosy w jednej transakcji.
+    bulk_create pomija Vote.save/full_clean, dlatego cała walidacja odbywa się w BallotSnapshot.validate.
+    Równoległe przesłanie karty przez tego samego użytkownika (np. z dwóch kart przeglądarki) odrzuca
+    ograniczenie unique_ballot_per_voting, a głos na kandydaturę, na którą użytkownik już zagłosował poza kartą
+    (np. głos z panelu admina) - ograniczenie unique_vote_per_registration. Po zatwierdzeniu transakcji podbijana
+    jest wersja zcache'owanych wyników głosowania"""
+    snapshot.validate(registration_ids)
+    try:
+        with transaction.atomic():
+            ballot = Ballot.objects.create(voting=snapshot.voting, microsoft_user=snapshot.user)
+            votes = [
+                Vote(candidate_registration_id=registration_id, microsoft_user=snapshot.user, ballot=ballot)
+                for registration_id in registration_ids
+            ]
+            Vote.objects.bulk_create(votes)
+            Vote.update_aggregates(snapshot.voting.id, votes, voters=1)
+            bump_results_version_on_commit(snapshot.voting.id)
+    except IntegrityError as error:
+        constraint = constraint_validation_error(Vote, error) or constraint_validation_error(Ballot, error)
+        if constraint is None:
+            raise
+        raise constraint
+    snapshot.has_voted = True
+    return votes
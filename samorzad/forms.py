@@ -10,29 +10,38 @@ from .models import Voting, CandidateRegistration
 class VoteForm(forms.Form):
     candidate_registration_id = forms.IntegerField()
 
-    def __init__(self, *args, voting, **kwargs):
+    def __init__(self, *args, voting, registrations=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.expected_voting = voting
+        # Opcjonalny słownik {id kandydatury: is_eligible} kandydatur głosowania (samorzad.ballot.BallotSnapshot.registrations)
+        self.registrations = registrations
 
     def clean(self):
         cleaned_data = super().clean()
         candidate_registration_id = cleaned_data.get('candidate_registration_id')
-        try:
-            registration_obj  = CandidateRegistration.objects.get(id=candidate_registration_id)
-        except CandidateRegistration.DoesNotExist:
+        # Kandydatura należy do wczytanego wcześniej głosowania, nie trzeba odpytywać bazy
+        if self.registrations is not None and candidate_registration_id in self.registrations:
+            return cleaned_data
+        # Samo voting_id jednym zapytaniem, bez wczytywania kandydatury i jej głosowania
+        voting_id = CandidateRegistration.objects.filter(id=candidate_registration_id).values_list('voting_id', flat=True).first()
+        if voting_id is None:
             raise ValidationError(f"Kandydatura o id: {candidate_registration_id} nie istnieje", code='candidature_does_not_exist')
-        voting_id = registration_obj.voting.id
         if self.expected_voting.id != voting_id:
             raise ValidationError(f"Kandydatura o id: {candidate_registration_id} nie należy do obecnego głosowania", code='candidature_not_in_voting')
 
 
 class BaseVoteFormSet(BaseFormSet):
-    def __init__(self, *args, voting=None, **kwargs):
+    def __init__(self, *args, voting=None, registrations=None, **kwargs):
         self.voting = voting
+        # Bez słownika z migawki kandydatury głosowania są wczytywane raz dla całego formsetu, a nie w każdym formularzu
+        if registrations is None and voting is not None:
+            registrations = dict(CandidateRegistration.objects.filter(voting=voting).values_list('id', 'is_eligible'))
+        self.registrations = registrations
         super().__init__(*args, **kwargs)
 
     def _construct_form(self, i, **kwargs):
         kwargs['voting'] = self.voting
+        kwargs['registrations'] = self.registrations
         return super()._construct_form(i, **kwargs)
 
     def clean(self):
@@ -0,0 +1,310 @@
+"""Buforowany zapis kart do głosowania (tryb SAMORZAD_VOTE_INGESTION = 'buffered').
+
+Zwalidowana karta jest dopisywana do lokalnego dziennika (pliki segmentów zapisywane z fsync) i od razu
+potwierdzana użytkownikowi. Komenda flush_vote_log przenosi karty z dziennika do bazy danych dużymi
+partiami przez COPY (psycopg 3), więc czas odpowiedzi nie zależy od przepustowości zapisu do Postgresa.
+
+Gwarancje reguł głosowania:
+
+- reguły karty (czas głosowania, kandydatury, duplikaty, limit głosów) sprawdza BallotSnapshot.validate
+  przed zapisem do dziennika
+- jedną kartę na użytkownika w głosowaniu zapewnia rezerwacja w cache (cache.add) przed potwierdzeniem,
+  a ostatecznie ograniczenie unique_ballot_per_voting przy przenoszeniu do bazy (ON CONFLICT DO NOTHING)
+- przenoszenie jest idempotentne: ponowne przetworzenie segmentu (np. po awarii) nie dodaje żadnych głosów,
+  bo karta użytkownika już istnieje, a liczniki wyników są zwiększane tylko o faktycznie wstawione głosy
+
+Rezerwacje muszą być widoczne dla wszystkich procesów serwera, więc tryb buforowany wymaga współdzielonego
+cache (REDIS_URL). Dziennik musi leżeć na lokalnym, trwałym dysku (SAMORZAD_INGEST_DIR).
+
+Segmenty: proces serwera dopisuje do własnego segmentu *.open, trzymając na nim blokadę flock przez cały czas
+zapisu. Po przekroczeniu rozmiaru lub wieku segment jest zamykany (*.sealed). Segment *.open bez blokady
+należał do procesu, który przestał działać, i jest przetwarzany jak zamknięty.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone, dateparse
+
+from collections import Counter, defaultdict
+from pathlib import Path
+import fcntl
+import json
+import os
+import threading
+import time
+
+from ekonomvote.db.copy import copy_rows
+from office_auth.models import AzureUser
+from .ballot import BallotSnapshot
+from .models import Voting, Vote, Ballot, CandidateRegistration, VoteTally, VoteTimeBucket
+from .results import bump_results_version_on_commit
+
+RESERVATION_KEY = 'samorzad:ballot_reserved:{voting_id}:{user_id}'
+
+
+def is_buffered() -> bool:
+    return settings.SAMORZAD_VOTE_INGESTION == 'buffered'
+
+
+# Rezerwacje kart
+
+def reserve_ballot(voting: Voting, user: AzureUser) -> bool:
+    """Rezerwuje kartę użytkownika w głosowaniu, False jeśli użytkownik ma już kartę w buforze.
+    Rezerwacja trwa godzinę dłużej niż głosowanie, żeby przetrwała do przeniesienia karty do bazy"""
+    timeout = max((voting.planned_end - timezone.now()).total_seconds(), 0) + 3600
+    return cache.add(RESERVATION_KEY.format(voting_id=voting.id, user_id=user.pk), True, timeout=timeout)
+
+
+def release_ballot(voting: Voting, user: AzureUser):
+    cache.delete(RESERVATION_KEY.format(voting_id=voting.id, user_id=user.pk))
+
+
+def is_reserved(voting: Voting, user: AzureUser) -> bool:
+    """Czy użytkownik ma kartę w buforze, która mogła jeszcze nie trafić do bazy danych"""
+    return cache.get(RESERVATION_KEY.format(voting_id=voting.id, user_id=user.pk)) is not None
+
+
+# Dziennik
+
+def _fsync_dir(path: Path):
+    """Utrwala zmiany nazw plików w katalogu (utworzenie, zmiana nazwy segmentu)"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class VoteLog:
+    """Dziennik kart do głosowania jednego procesu, pola:
+
+    - path: Katalog segmentów
+    - segment_bytes: Rozmiar, po którym segment jest zamykany
+    - segment_seconds: Wiek, po którym segment jest zamykany
+    """
+
+    def __init__(self, path, segment_bytes: int, segment_seconds: float):
+        self.path = Path(path)
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self._lock = threading.Lock()
+        self._file = None
+        self._opened_at = 0.0
+        self._sequence = 0
+
+    def _open_segment(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._sequence += 1
+        name = f'{time.time_ns():020d}-{os.getpid()}-{self._sequence}'
+        # Plik jest blokowany przed nadaniem nazwy *.open, żeby przetwarzanie dziennika nie uznało go za porzucony
+        temporary = self.path / f'{name}.tmp'
+        self._file = open(temporary, 'ab')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        os.rename(temporary, self.path / f'{name}.open')
+        _fsync_dir(self.path)
+        self._segment = self.path / f'{name}.open'
+        self._opened_at = time.monotonic()
+
+    def _seal_segment(self):
+        try:
+            # Zmiana nazwy przed zamknięciem, czyli jeszcze pod blokadą. Po zwolnieniu blokady przetwarzanie
+            # dziennika mogłoby uznać segment *.open za porzucony, przenieść go i usunąć przed zmianą nazwy
+            os.rename(self._segment, self._segment.with_suffix('.sealed'))
+            _fsync_dir(self.path)
+        finally:
+            # Kolejny zapis otwiera nowy segment także po błędzie
+            self._file.close()
+            self._file = None
+
+    def append(self, record: dict):
+        """Dopisuje rekord i wraca dopiero po utrwaleniu go na dysku (fsync)"""
+        line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+        with self._lock:
+            if self._file is not None and (
+                    self._file.tell() >= self.segment_bytes or
+                    time.monotonic() - self._opened_at >= self.segment_seconds):
+                self._seal_segment()
+            if self._file is None:
+                self._open_segment()
+            position = self._file.tell()
+            try:
+                self._file.write(line)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except BaseException:
+                # Niepełna linia skleiłaby się z następnym rekordem
+                self._file.truncate(position)
+                raise
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._seal_segment()
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_log() -> VoteLog:
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = VoteLog(
+                settings.SAMORZAD_INGEST_DIR,
+                settings.SAMORZAD_INGEST_SEGMENT_BYTES,
+                settings.SAMORZAD_INGEST_SEGMENT_SECONDS
+            )
+        return _log
+
+
+def enqueue_ballot(snapshot: BallotSnapshot, registration_ids: list[int]):
+    """Odpowiednik samorzad.ballot.cast_ballot dla trybu buforowanego: waliduje kartę, rezerwuje ją
+    i zapisuje w dzienniku. Karta trafia do bazy danych przy następnym przetworzeniu dziennika"""
+    snapshot.validate(registration_ids)
+    if not reserve_ballot(snapshot.voting, snapshot.user):
+        raise ValidationError("Użytkownik oddał już maksymalną ilość głosów w głosowaniu", code='vote_limit_reached')
+    try:
+        get_log().append({
+            'voting_id': snapshot.voting.id,
+            'user_id': snapshot.user.pk,
+            'registration_ids': registration_ids,
+            'created_at': timezone.now().isoformat(),
+        })
+    except BaseException:
+        release_ballot(snapshot.voting, snapshot.user)
+        raise
+    snapshot.has_voted = True
+
+
+# Przenoszenie do bazy danych
+
+def _read_records(file, offset: int = 0) -> tuple[list[dict], int]:
+    """Czyta pełne rekordy segmentu od podanego miejsca. Niepełna ostatnia linia (przerwany zapis) nie została
+    potwierdzona użytkownikowi i jest pomijana. Zwraca rekordy i miejsce za ostatnim pełnym rekordem"""
+    file.seek(offset)
+    data = file.read()
+    end = data.rfind(b'\n') + 1
+    records = [json.loads(line) for line in data[:end].splitlines() if line]
+    return records, offset + end
+
+
+def flush_records(records: list[dict]) -> int:
+    """Przenosi karty do bazy danych w jednej transakcji przez COPY do tabel tymczasowych.
+    Zwraca liczbę wstawionych głosów (karty, które już są w bazie, są pomijane)"""
+    if not records:
+        return 0
+    quote_name = connection.ops.quote_name
+    ballot_table = quote_name(Ballot._meta.db_table)
+    vote_table = quote_name(Vote._meta.db_table)
+    registration_table = quote_name(CandidateRegistration._meta.db_table)
+    user_table = quote_name(AzureUser._meta.db_table)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE samorzad_ingest_ballot '
+                '(ballot_key integer, voting_id bigint, user_id bigint, created_at timestamptz) ON COMMIT DROP'
+            )
+            cursor.execute(
+                'CREATE TEMPORARY TABLE samorzad_ingest_vote '
+                '(ballot_key integer, registration_id bigint) ON COMMIT DROP'
+            )
+            copy_rows(cursor, 'COPY samorzad_ingest_ballot (ballot_key, voting_id, user_id, created_at) FROM STDIN', (
+                (ballot_key, record['voting_id'], record['user_id'], dateparse.parse_datetime(record['created_at']))
+                for ballot_key, record in enumerate(records)
+            ))
+            copy_rows(cursor, 'COPY samorzad_ingest_vote (ballot_key, registration_id) FROM STDIN', (
+                (ballot_key, registration_id)
+                for ballot_key, record in enumerate(records)
+                for registration_id in record['registration_ids']
+            ))
+            cursor.execute(f'''
+                WITH chosen AS (
+                    SELECT DISTINCT ON (b.voting_id, b.user_id) b.ballot_key, b.voting_id, b.user_id, b.created_at
+                    FROM samorzad_ingest_ballot b
+                    JOIN {user_table} u ON u.id = b.user_id
+                    ORDER BY b.voting_id, b.user_id, b.created_at
+                ),
+                inserted_ballots AS (
+                    INSERT INTO {ballot_table} (voting_id, microsoft_user_id, created_at)
+                    SELECT voting_id, user_id, created_at FROM chosen
+                    ON CONFLICT (microsoft_user_id, voting_id) DO NOTHING
+                    RETURNING id, voting_id, microsoft_user_id
+                ),
+                inserted_votes AS (
+                    INSERT INTO {vote_table} (candidate_registration_id, microsoft_user_id, ballot_id, created_at)
+                    SELECT v.registration_id, ib.microsoft_user_id, ib.id, c.created_at
+                    FROM inserted_ballots ib
+                    JOIN chosen c ON c.voting_id = ib.voting_id AND c.user_id = ib.microsoft_user_id
+                    JOIN samorzad_ingest_vote v ON v.ballot_key = c.ballot_key
+                    JOIN {registration_table} r ON r.id = v.registration_id AND r.voting_id = c.voting_id
+                    ON CONFLICT (candidate_registration_id, microsoft_user_id) DO NOTHING
+                    RETURNING candidate_registration_id, created_at
+                )
+                SELECT r.voting_id, iv.candidate_registration_id, iv.created_at
+                FROM inserted_votes iv
+                JOIN {registration_table} r ON r.id = iv.candidate_registration_id
+                UNION ALL
+                -- Wstawione karty (bez kandydatury) dla liczników głosujących
+                SELECT voting_id, NULL, NULL FROM inserted_ballots
+            ''')
+            inserted = cursor.fetchall()
+            # Jawne usunięcie na wypadek wywołania wewnątrz zewnętrznej transakcji (ON COMMIT DROP zadziała dopiero na jej końcu)
+            cursor.execute('DROP TABLE samorzad_ingest_ballot, samorzad_ingest_vote')
+        tally_counts = Counter()
+        bucket_counts = defaultdict(Counter)
+        vote_counts = Counter()
+        voter_counts = Counter()
+        for voting_id, registration_id, created_at in inserted:
+            if registration_id is None:
+                voter_counts[voting_id] += 1
+                continue
+            tally_counts[registration_id] += 1
+            bucket_counts[voting_id][(registration_id, VoteTimeBucket.bucket_for(created_at))] += 1
+            vote_counts[voting_id] += 1
+        VoteTally.increment(tally_counts)
+        for voting_id, counts in bucket_counts.items():
+            VoteTimeBucket.increment(voting_id, counts)
+            bump_results_version_on_commit(voting_id)
+        # Sortowanie jak w _increment_counters, żeby równoległe transakcje blokowały głosowania w tej samej kolejności
+        for voting_id in sorted(voter_counts.keys() | vote_counts.keys()):
+            Voting.increment_counters(voting_id, vote_counts[voting_id], voter_counts[voting_id])
+    return sum(vote_counts.values())
+
+
+def flush_log(path=None, offsets: dict | None = None) -> tuple[int, int]:
+    """Przetwarza wszystkie segmenty dziennika. Zamknięte i porzucone segmenty są usuwane po zatwierdzeniu
+    transakcji. Segmenty aktywnych procesów są tylko czytane od miejsca zapisanego w offsets (słownik
+    przechowywany między wywołaniami przez komendę flush_vote_log).
+    Zwraca liczbę przetworzonych kart i wstawionych głosów"""
+    path = Path(path or settings.SAMORZAD_INGEST_DIR)
+    offsets = {} if offsets is None else offsets
+    if not path.exists():
+        return 0, 0
+    ballots = votes = 0
+    for segment in sorted(path.iterdir()):
+        if segment.suffix not in ('.sealed', '.open'):
+            continue
+        try:
+            file = open(segment, 'rb')
+        except FileNotFoundError:
+            # Segment zamknięty lub usunięty w międzyczasie, zostanie przetworzony pod nową nazwą
+            continue
+        with file:
+            if segment.suffix == '.open':
+                try:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    records, offsets[segment.name] = _read_records(file, offsets.get(segment.name, 0))
+                    ballots += len(records)
+                    votes += flush_records(records)
+                    continue
+            records, end = _read_records(file)
+            ballots += len(records)
+            votes += flush_records(records)
+            segment.unlink(missing_ok=True)
+            offsets.pop(segment.name, None)
+            offsets.pop(segment.with_suffix('.open').name, None)
+    _fsync_dir(path)
+    return ballots, votes
@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+
+import asyncio
+import json
+import logging
+
+from .models import Voting
+from .results import get_results_version, get_cached_chart_data
+
+logger = logging.getLogger(__name__)
+
+# Zdarzenie końca głosowania, po którym klienci nie łączą się ponownie
+VOTING_END = object()
+
+
+class ResultsBroadcaster:
+    """Rozsyła wyniki trwającego głosowania do wszystkich podłączonych klientów SSE w procesie, pola:
+
+    - voting: Obserwowane głosowanie
+    - subscribers: Kolejki podłączonych klientów
+    - last_event: Ostatnio rozesłane zdarzenie (wysyłane od razu nowym klientom)
+
+    Jedno zadanie asyncio na głosowanie sprawdza co SAMORZAD_LIVE_RESULTS_INTERVAL sekund wersję wyników
+    (samorzad.results.get_results_version, jeden odczyt z cache). Tylko po zmianie wersji pobiera wyniki
+    z cache wersjonowanego, więc N obserwujących kosztuje jedną agregację na aktualizację, a nie N
+    """
+
+    def __init__(self, voting: Voting):
+        self.voting = voting
+        self.subscribers: set[asyncio.Queue] = set()
+        self.last_event: dict | None = None
+        self.loop = asyncio.get_running_loop()
+        self.task = self.loop.create_task(self._run())
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        if self.last_event is not None:
+            queue.put_nowait(self.last_event)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers:
+            self.task.cancel()
+            if _broadcasters.get(self.voting.id) is self:
+                del _broadcasters[self.voting.id]
+
+    def _publish(self, event: dict | object | None):
+        for queue in self.subscribers:
+            # Zdarzenie zawiera pełne liczby głosów, więc wolnemu klientowi wystarczy najnowsze
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def _run(self):
+        version = None
+        tallies = {}
+        try:
+            while True:
+                current_version = await sync_to_async(get_results_version)(self.voting.id)
+                if current_version != version:
+                    chart_data = await sync_to_async(get_cached_chart_data)(self.voting)
+                    current_tallies = {item['registration_id']: item['votes_count'] for item in chart_data}
+                    # Przyrosty względem poprzedniego zdarzenia, pierwsze zdarzenie nie ma przyrostów
+                    delta = {}
+                    if version is not None:
+                        delta = {
+                            registration_id: count - tallies.get(registration_id, 0)
+                            for registration_id, count in current_tallies.items()
+                            if count != tallies.get(registration_id, 0)
+                        }
+                    self.last_event = {
+                        'version': current_version,
+                        'votes_count': sum(current_tallies.values()),
+                        'tallies': current_tallies,
+                        'delta': delta,
+                    }
+                    self._publish(self.last_event)
+                    version, tallies = current_version, current_tallies
+                if self.voting.planned_end < timezone.now():
+                    # Koniec głosowania, klienci przechodzą na wyniki ze snapshotu
+                    self._publish(VOTING_END)
+                    return
+                await asyncio.sleep(settings.SAMORZAD_LIVE_RESULTS_INTERVAL)
+        except Exception:
+            logger.exception('Rozsyłanie wyników głosowania %s przerwane błędem', self.voting.id)
+            # Zamknięcie strumieni bez zdarzenia end, EventSource połączy się ponownie
+            self._publish(None)
+
+
+_broadcasters: dict[int, ResultsBroadcaster] = {}
+
+
+def get_broadcaster(voting: Voting) -> ResultsBroadcaster:
+    """Zwraca broadcaster głosowania w bieżącej pętli zdarzeń, tworząc go dla pierwszego klienta"""
+    broadcaster = _broadcasters.get(voting.id)
+    if broadcaster is None or broadcaster.loop is not asyncio.get_running_loop() or broadcaster.task.done():
+        broadcaster = ResultsBroadcaster(voting)
+        _broadcasters[voting.id] = broadcaster
+    return broadcaster
+
+
+async def event_stream(voting: Voting):
+    """Strumień Server-Sent Events z wynikami głosowania. Zdarzenie results zawiera pełne liczby głosów
+    kandydatur i przyrosty, end oznacza koniec głosowania. Po błędzie strumień jest zamykany bez end,
+    więc przeglądarka połączy się ponownie. Przy braku zdarzeń wysyłany jest komentarz,
+    żeby serwer proxy nie zamknął bezczynnego połączenia"""
+    broadcaster = get_broadcaster(voting)
+    queue = broadcaster.subscribe()
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=settings.SAMORZAD_LIVE_RESULTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is VOTING_END:
+                yield 'event: end\ndata: {}\n\n'
+                return
+            if event is None:
+                return
+            yield f'id: {event["version"]}\nevent: results\ndata: {json.dumps(event)}\n\n'
+    finally:
+        broadcaster.unsubscribe(queue)
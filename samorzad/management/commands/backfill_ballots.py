@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction, connection
+
+from samorzad.models import Voting, Vote, Ballot, CandidateRegistration
+from samorzad.results import bump_results_version
+
+
+class Command(BaseCommand):
+    help = ("Tworzy karty do głosowania (samorzad.Ballot) dla głosów oddanych przed wprowadzeniem kart (Vote.ballot = NULL): "
+            "jedną kartę na użytkownika w głosowaniu, do której przypinane są jego głosy. Sprawdzenie czy użytkownik "
+            "już zagłosował i liczba głosujących korzystają tylko z kart, dlatego komendę należy uruchomić po wdrożeniu. "
+            "Ponowne uruchomienie niczego nie zmienia")
+
+    def handle(self, *args, **options):
+        quote_name = connection.ops.quote_name
+        vote_table = quote_name(Vote._meta.db_table)
+        ballot_table = quote_name(Ballot._meta.db_table)
+        registration_table = quote_name(CandidateRegistration._meta.db_table)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Blokuje zapis nowych głosów do końca transakcji, żeby żaden głos bez karty nie został pominięty
+                cursor.execute(f'LOCK TABLE {vote_table} IN SHARE MODE')
+                # Czas karty to czas pierwszego głosu użytkownika w głosowaniu
+                cursor.execute(f'''
+                    INSERT INTO {ballot_table} (voting_id, microsoft_user_id, created_at)
+                    SELECT r.voting_id, v.microsoft_user_id, MIN(v.created_at)
+                    FROM {vote_table} v
+                    JOIN {registration_table} r ON r.id = v.candidate_registration_id
+                    WHERE v.ballot_id IS NULL
+                    GROUP BY r.voting_id, v.microsoft_user_id
+                    ON CONFLICT (microsoft_user_id, voting_id) DO NOTHING
+                ''')
+                created = cursor.rowcount
+                cursor.execute(f'''
+                    UPDATE {vote_table} v SET ballot_id = b.id
+                    FROM {registration_table} r, {ballot_table} b
+                    WHERE v.ballot_id IS NULL
+                        AND r.id = v.candidate_registration_id
+                        AND b.voting_id = r.voting_id
+                        AND b.microsoft_user_id = v.microsoft_user_id
+                    RETURNING r.voting_id
+                ''')
+                voting_ids = {voting_id for voting_id, in cursor.fetchall()}
+            Voting.refresh_counters(voting_ids, fields=('voters_count',))
+        for voting_id in voting_ids:
+            bump_results_version(voting_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Utworzono karty do głosowania: {created}, głosowania: {len(voting_ids)}'
+        ))
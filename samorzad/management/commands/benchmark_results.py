@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ekonomvote.latency import format_percentiles
+from office_auth.models import AzureUser
+from samorzad.models import Voting
+
+
+class Command(BaseCommand):
+    help = ("Mierzy przepustowość (żądania/s) i opóźnienia publicznych widoków wyników samorządu na uruchomionym "
+            "serwerze. Służy do porównania trybu WSGI (gunicorn ekonomvote.wsgi) z trybem ASGI (ekonomvote.asgi)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='Adres uruchomionego serwera')
+        parser.add_argument('--voting', type=int, required=True, help='ID głosowania, którego wyniki są pobierane')
+        parser.add_argument('--user', type=int, default=None, help='ID użytkownika, w imieniu którego wysyłane są żądania (domyślnie pierwszy)')
+        parser.add_argument('--requests', type=int, default=1000, help='Liczba żądań na widok')
+        parser.add_argument('--concurrency', type=int, default=50, help='Liczba równoległych klientów')
+
+    def handle(self, *args, **options):
+        if not Voting.objects.filter(pk=options['voting']).exists():
+            raise CommandError(f"Głosowanie o ID {options['voting']} nie istnieje")
+        user = AzureUser.objects.get(pk=options['user']) if options['user'] else AzureUser.objects.order_by('pk').first()
+        if user is None:
+            raise CommandError("Brak użytkowników w bazie danych")
+        # Prawdziwa sesja w bazie danych, serwer uwierzytelnia żądania tak jak przeglądarkę
+        client = Client()
+        client.force_login(user)
+        session_cookie = client.cookies[settings.SESSION_COOKIE_NAME].value
+        paths = {
+            'index': reverse('samorzad:index'),
+            'old_votings': reverse('samorzad:partial_list_old_votings'),
+            'chart': reverse('samorzad:get_chart_data', kwargs={'voting_id': options['voting']}),
+            'timeline': reverse('samorzad:get_timeline_data', kwargs={'voting_id': options['voting']}),
+        }
+        for name, path in paths.items():
+            self._benchmark(name, options['url'].rstrip('/') + path, session_cookie, options['requests'], options['concurrency'])
+
+    def _benchmark(self, name, url, session_cookie, total, concurrency):
+        local = threading.local()
+
+        def fetch(_):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.cookies.set(settings.SESSION_COOKIE_NAME, session_cookie)
+            started = time.perf_counter()
+            response = local.session.get(url, allow_redirects=False, timeout=30)
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(fetch, range(total)))
+        elapsed = time.perf_counter() - started
+        latencies = [latency * 1000 for latency, status in samples]
+        errors = sum(1 for latency, status in samples if status != 200)
+        self.stdout.write(f'{name}: {total / elapsed:.1f} req/s, {format_percentiles(latencies)}, błędy {errors}/{total}')
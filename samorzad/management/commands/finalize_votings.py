@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from samorzad.models import Voting
+from samorzad.results import finalize_voting
+
+
+class Command(BaseCommand):
+    help = "Zapisuje ostateczne wyniki (samorzad.VotingResultSnapshot) zakończonych głosowań, które ich jeszcze nie mają. Do uruchamiania cyklicznie (np. cron), do czasu zapisania snapshotu widoki czytają wyniki z cache. W trybie buforowanym (SAMORZAD_VOTE_INGESTION) uruchamiać po przeniesieniu kart komendą flush_vote_log"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voting', type=int, nargs='*', default=None, help='ID głosowań, których wyniki mają zostać zapisane')
+
+    def handle(self, *args, **options):
+        voting_ids = options['voting']
+        votings = Voting.objects.filter(planned_end__lt=timezone.now(), result_snapshot__isnull=True)
+        if voting_ids:
+            missing = set(voting_ids) - set(Voting.objects.filter(id__in=voting_ids).values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Głosowania o ID {sorted(missing)} nie istnieją")
+            votings = votings.filter(id__in=voting_ids)
+        finalized = 0
+        for voting in votings.order_by('planned_end'):
+            snapshot = finalize_voting(voting)
+            finalized += 1
+            self.stdout.write(f'Głosowanie {voting.id}: {snapshot.votes_count} głosów, {snapshot.voters_count} głosujących')
+        self.stdout.write(self.style.SUCCESS(f'Zapisano wyniki głosowań: {finalized}'))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import time
+
+from samorzad.ingest import flush_log
+
+
+class Command(BaseCommand):
+    help = ("Przenosi karty do głosowania z dziennika trybu buforowanego (SAMORZAD_INGEST_DIR) do bazy danych. "
+            "Uruchomiona bez --loop przetwarza dziennik raz, np. po awarii serwera przed jego ponownym startem")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str, default=None, help='Katalog dziennika (domyślnie SAMORZAD_INGEST_DIR)')
+        parser.add_argument('--loop', action='store_true', help='Przetwarza dziennik w pętli aż do przerwania')
+        parser.add_argument('--interval', type=float, default=1.0, help='Odstęp między przebiegami w trybie --loop (sekundy)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.SAMORZAD_INGEST_DIR
+        # Miejsca przeczytane w segmentach aktywnych procesów, żeby nie przetwarzać ich od początku w każdym przebiegu
+        offsets = {}
+        while True:
+            ballots, votes = flush_log(path, offsets)
+            if ballots or not options['loop']:
+                self.stdout.write(f'Przetworzone karty: {ballots}, wstawione głosy: {votes}')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Dziennik kart przetworzony'))
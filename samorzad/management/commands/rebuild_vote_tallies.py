@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, connection
+from django.db.models import Count
+
+from samorzad.models import Voting, Vote, VoteTally, CandidateRegistration
+from samorzad.results import bump_results_version
+
+
+class Command(BaseCommand):
+    help = "Odbudowuje liczniki głosów (samorzad.VoteTally) na podstawie tabeli głosów oraz liczniki głosowań (samorzad.Voting). Bez parametru --voting odbudowuje liczniki wszystkich głosowań"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voting', type=int, nargs='*', default=None, help='ID głosowań, których liczniki mają zostać odbudowane')
+
+    def handle(self, *args, **options):
+        voting_ids = options['voting']
+        registrations = CandidateRegistration.objects.all()
+        if voting_ids:
+            missing = set(voting_ids) - set(Voting.objects.filter(id__in=voting_ids).values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Głosowania o ID {sorted(missing)} nie istnieją")
+            registrations = registrations.filter(voting_id__in=voting_ids)
+        with transaction.atomic():
+            # Blokuje zapis nowych głosów do końca transakcji, żeby żaden przyrost licznika nie został nadpisany
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {connection.ops.quote_name(Vote._meta.db_table)} IN SHARE MODE')
+            counts = dict(
+                Vote.objects.filter(
+                    candidate_registration__in=registrations
+                ).values('candidate_registration').annotate(
+                    votes=Count('id')
+                ).values_list('candidate_registration', 'votes')
+            )
+            VoteTally.objects.filter(registration__in=registrations).delete()
+            tallies = VoteTally.objects.bulk_create(
+                [VoteTally(registration_id=registration_id, count=counts.get(registration_id, 0))
+                 for registration_id in registrations.values_list('id', flat=True)],
+                batch_size=1000
+            )
+            Voting.refresh_counters(voting_ids or Voting.objects.values_list('id', flat=True))
+        for voting_id in set(registrations.values_list('voting_id', flat=True)):
+            bump_results_version(voting_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Odbudowano {len(tallies)} liczników, łączna liczba głosów: {sum(counts.values())}'
+        ))
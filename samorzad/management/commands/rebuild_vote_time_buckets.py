@@ -0,0 +1,48 @@
+from datetime import timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, connection
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+
+from samorzad.models import Voting, Vote, VoteTimeBucket
+from samorzad.results import bump_results_version
+
+
+class Command(BaseCommand):
+    help = "Uzupełnia godzinowe liczniki głosów (samorzad.VoteTimeBucket) na podstawie tabeli głosów. Bez parametru --voting przelicza wszystkie głosowania"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voting', type=int, nargs='*', default=None, help='ID głosowań, których kubełki mają zostać przeliczone')
+
+    def handle(self, *args, **options):
+        voting_ids = options['voting']
+        votings = Voting.objects.all()
+        if voting_ids:
+            votings = votings.filter(id__in=voting_ids)
+            missing = set(voting_ids) - set(votings.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Głosowania o ID {sorted(missing)} nie istnieją")
+        total_buckets = 0
+        for voting_id in votings.order_by('id').values_list('id', flat=True):
+            # Każde głosowanie w osobnej transakcji, żeby nie blokować zapisu głosów na czas całej operacji
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LOCK TABLE {connection.ops.quote_name(Vote._meta.db_table)} IN SHARE MODE')
+                rows = Vote.objects.filter(
+                    candidate_registration__voting_id=voting_id
+                ).annotate(
+                    bucket_start=TruncHour('created_at', tzinfo=dt_timezone.utc)
+                ).values('candidate_registration', 'bucket_start').annotate(
+                    votes=Count('id')
+                ).values_list('candidate_registration', 'bucket_start', 'votes')
+                VoteTimeBucket.objects.filter(voting_id=voting_id).delete()
+                buckets = VoteTimeBucket.objects.bulk_create(
+                    [VoteTimeBucket(voting_id=voting_id, registration_id=registration_id, bucket_start=bucket_start, count=votes)
+                     for registration_id, bucket_start, votes in rows],
+                    batch_size=1000
+                )
+            bump_results_version(voting_id)
+            total_buckets += len(buckets)
+            self.stdout.write(f'Głosowanie {voting_id}: {len(buckets)} kubełków')
+        self.stdout.write(self.style.SUCCESS(f'Przeliczono kubełki głosowań, łącznie: {total_buckets}'))
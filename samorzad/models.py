@@ -1,13 +1,25 @@
-from django.db import models
+from django.db import models, transaction, connection, IntegrityError
 from django.utils import timezone, dateparse
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, NON_FIELD_ERRORS
+from django.contrib.postgres.indexes import BrinIndex
 from office_auth.models import AzureUser
 
 from auditlog.registry import auditlog
+from collections import Counter
 import pytz
 
+def constraint_validation_error(model: type[models.Model], error: IntegrityError) -> ValidationError | None:
+    """Zamienia naruszenie ograniczenia modelu (UniqueConstraint z Meta.constraints) zgłoszone przez bazę danych
+    na ValidationError z komunikatem i kodem tego ograniczenia. Zwraca None dla innych błędów"""
+    constraint_name = getattr(getattr(error.__cause__, 'diag', None), 'constraint_name', None)
+    for constraint in model._meta.constraints:
+        if constraint.name == constraint_name:
+            return ValidationError(constraint.get_violation_error_message(), code=constraint.violation_error_code)
+    return None
+
+
 class Voting(models.Model):
     """
     Model reprezentujący głosowanie, pola:
@@ -17,7 +29,17 @@ class Voting(models.Model):
     - planned_start: Czas rozpoczęcia głosowania (UTC)
     - planned_end: Czas zakończenia głosowania (UTC)
     - votes_per_user: Dodatnia liczba, która reprezentuje liczbę głosów które można oddać na poszczególnych kandydatów
+    - votes_count: Liczba oddanych głosów
+    - voters_count: Liczba użytkowników, którzy oddali kartę
+    - eligible_registrations_count: Liczba dopuszczonych kandydatur
+
+    Liczniki są zdenormalizowane na potrzeby list głosowań i zmieniane w tej samej transakcji co zapis głosów
+    (Vote.update_aggregates) i kandydatur (CandidateRegistration.save, samorzad.signals), więc listy nie liczą
+    głosów ani kandydatur. Voting.save ich nie nadpisuje. W razie rozjazdu liczniki odbudowuje komenda:
+    python manage.py rebuild_vote_tallies
     """
+    COUNTER_FIELDS = ('votes_count', 'voters_count', 'eligible_registrations_count')
+
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='data utworzenia')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='data aktualizacji')
     planned_start = models.DateTimeField(null=False, verbose_name='data startu')
@@ -27,8 +49,17 @@ class Voting(models.Model):
         validators=[MinValueValidator(1, 'Ilość głosów musi być większa od 0')],
         verbose_name='głosów na użytkownika'
     )
+    votes_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='liczba głosów')
+    voters_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='liczba głosujących')
+    eligible_registrations_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='liczba kandydatów')
 
     class Meta:
+        indexes = [
+            # Zakończone głosowania (planned_end < teraz, od najnowszych, kursor listy po (planned_end, id))
+            # i trwające głosowanie
+            models.Index(fields=['planned_end', 'id'], name='samorzad_voting_end_idx'),
+            models.Index(fields=['planned_start', 'planned_end'], name='samorzad_voting_period_idx'),
+        ]
         verbose_name="Głosowanie"
         verbose_name_plural = 'Głosowania'
 
@@ -54,8 +85,44 @@ class Voting(models.Model):
 
     def save(self, *args, **kwargs):
         self.full_clean()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Liczniki wczytane z formularzem mogą być nieaktualne, zmieniają je tylko increment_counters i refresh_counters
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def increment_counters(voting_id: int, votes: int, voters: int = 0):
+        """Zwiększa liczniki głosów i głosujących. Musi być wywołana w tej samej transakcji co zapis głosów"""
+        if votes or voters:
+            Voting.objects.filter(pk=voting_id).update(
+                votes_count=models.F('votes_count') + votes,
+                voters_count=models.F('voters_count') + voters
+            )
+
+    @staticmethod
+    def refresh_counters(voting_ids, fields: tuple[str, ...] = COUNTER_FIELDS):
+        """Przelicza podane liczniki głosowań jednym zapytaniem UPDATE. Liczba głosów pochodzi z liczników
+        kandydatur (VoteTally), liczba głosujących z kart do głosowania (Ballot)"""
+        voting_ids = sorted(set(voting_ids))
+        if not voting_ids:
+            return
+        quote_name = connection.ops.quote_name
+        voting_table = quote_name(Voting._meta.db_table)
+        registration_table = quote_name(CandidateRegistration._meta.db_table)
+        queries = {
+            'votes_count': f'SELECT COALESCE(SUM(t.count), 0) FROM {quote_name(VoteTally._meta.db_table)} t '
+                           f'JOIN {registration_table} r ON r.id = t.registration_id WHERE r.voting_id = v.id',
+            'voters_count': f'SELECT COUNT(*) FROM {quote_name(Ballot._meta.db_table)} b WHERE b.voting_id = v.id',
+            'eligible_registrations_count': f'SELECT COUNT(*) FROM {registration_table} r '
+                                            f'WHERE r.voting_id = v.id AND r.is_eligible',
+        }
+        assignments = ', '.join(f'{quote_name(field)} = ({queries[field]})' for field in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {voting_table} v SET {assignments} WHERE v.id = ANY(%s)', [voting_ids])
+
     def __str__(self):
         return f'Voting(start={self.parse_planned_start()}, end={self.parse_planned_end()})'
 
@@ -135,7 +202,8 @@ class CandidateRegistration(models.Model):
     - created_at: Czas utworzenia obiektu (strefa UTC)
     """
     candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='registrations', verbose_name='kandydat')
-    voting = models.ForeignKey(Voting, on_delete=models.CASCADE, related_name='candidate_registrations', verbose_name='głosowanie')
+    # Bez osobnego indeksu, kandydatury głosowania obsługuje indeks samorzad_reg_voting_elig_idx
+    voting = models.ForeignKey(Voting, on_delete=models.CASCADE, related_name='candidate_registrations', db_index=False, verbose_name='głosowanie')
     is_eligible = models.BooleanField(default=False, verbose_name='dopuszczony do wyborów')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='data utworzenia')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='data aktualizacji')
@@ -152,6 +220,10 @@ class CandidateRegistration(models.Model):
             models.UniqueConstraint(fields=['candidate', 'voting'], name='unique_candidate_per_voting',
             violation_error_message="Kandydatura dla tego kandydata już istnieje w tym głosowaniu")
         ]
+        indexes = [
+            # Dopuszczone kandydatury głosowania (karta do głosowania, liczba kandydatów)
+            models.Index(fields=['voting', 'is_eligible'], name='samorzad_reg_voting_elig_idx'),
+        ]
         verbose_name="Kandydatura"
         verbose_name_plural = 'Kandydatury'
 
@@ -171,26 +243,97 @@ class CandidateRegistration(models.Model):
         if now >= voting.planned_start:
             raise ValidationError("Nie można dodawać nowych kandydatur do głosowania które już się zaczęło.", code="voting_is_live")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Głosowanie sprzed edycji, jego licznik kandydatur też trzeba przeliczyć przy przeniesieniu kandydatury
+        instance._loaded_voting_id = instance.__dict__.get('voting_id')
+        instance._loaded_is_eligible = instance.__dict__.get('is_eligible')
+        return instance
+
     def save(self, *args, **kwargs):
         self.full_clean()
-        super().save(*args, **kwargs)
+        loaded_voting_id = getattr(self, '_loaded_voting_id', None)
+        # Liczniki głosowania zależą tylko od głosowania i dopuszczenia kandydatury
+        counters_changed = (
+            loaded_voting_id != self.voting_id or getattr(self, '_loaded_is_eligible', None) != self.is_eligible
+        )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if counters_changed:
+                Voting.refresh_counters(
+                    {self.voting_id, loaded_voting_id} - {None},
+                    fields=('votes_count', 'eligible_registrations_count')
+                )
+        self._loaded_voting_id = self.voting_id
+        self._loaded_is_eligible = self.is_eligible
 
 auditlog.register(CandidateRegistration)
 
+class Ballot(models.Model):
+    """Model reprezentujący kartę do głosowania oddaną przez użytkownika w głosowaniu, pola:
+
+    - voting: Klucz obcy głosowania
+    - microsoft_user: Klucz obcy poświadczonego użytkownika aplikacji
+    - created_at: Czas utworzenia obiektu (strefa UTC)
+
+    Użytkownik może mieć tylko jedną kartę w głosowaniu (class Meta), więc sprawdzenie czy użytkownik już zagłosował
+    to pojedyncze wyszukiwanie po unikalnym indeksie, a duplikaty kart odrzuca baza danych.
+    UWAGA: Nie da się edytować obiektów
+    """
+    voting = models.ForeignKey(Voting, on_delete=models.CASCADE, related_name='ballots', verbose_name='głosowanie')
+    microsoft_user = models.ForeignKey(AzureUser, on_delete=models.CASCADE, related_name='samorzad_ballots', verbose_name='użytkownik')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='data utworzenia')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['microsoft_user', 'voting'], name='unique_ballot_per_voting',
+            violation_error_message="Użytkownik oddał już maksymalną ilość głosów w głosowaniu",
+            violation_error_code='vote_limit_reached')
+        ]
+        verbose_name = "Karta do głosowania"
+        verbose_name_plural = 'Karty do głosowania'
+
+    def parse_created_at(self):
+        return self.created_at.astimezone(tz=pytz.timezone('Europe/Warsaw')).strftime('%Y.%m.%d %H:%M:%S')
+
+    def __str__(self):
+        return f'Ballot(user={self.microsoft_user_id}, voting={self.voting_id})'
+
+
 class Vote(models.Model):
     """Model reprezentujący oddany głos w głosowaniu na samorząd, pola
 
     - candidate_registration: klucz obcy zarejestrowanego kandydata
     - microsoft_user: klucz obcy poświadczonego użytkownika aplikacji
+    - ballot: klucz obcy karty do głosowania, do której należy głos (null tylko dla głosów sprzed wprowadzenia kart,
+      karty dla nich tworzy komenda: python manage.py backfill_ballots)
     - created_at: Czas utworzenia obiektu (strefa UTC)
 
     UWAGA: Nie da się edytować obiektów
     """
     candidate_registration = models.ForeignKey(CandidateRegistration, on_delete=models.CASCADE, related_name='votes', verbose_name='kandydatura')
-    microsoft_user = models.ForeignKey(AzureUser, on_delete=models.CASCADE, related_name='samorzad_votes', verbose_name='użytkownik')
+    # Bez osobnego indeksu, głosy użytkownika obsługuje indeks ograniczenia unique_vote_per_registration
+    microsoft_user = models.ForeignKey(AzureUser, on_delete=models.CASCADE, related_name='samorzad_votes', db_index=False, verbose_name='użytkownik')
+    ballot = models.ForeignKey(Ballot, on_delete=models.CASCADE, related_name='votes', null=True, blank=True, verbose_name='karta do głosowania')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='data utworzenia')
 
     class Meta:
+        constraints = [
+            # Ograniczenie: użytkownik może zagłosować na kandydaturę tylko raz, sprawdzane przez bazę danych przy zapisie.
+            # Indeks ograniczenia zaczyna się od użytkownika, więc obsługuje też głosy użytkownika w głosowaniu
+            # (przez candidate_registration__voting), głosy kandydatury korzystają z indeksu klucza obcego
+            models.UniqueConstraint(
+                fields=['microsoft_user', 'candidate_registration'],
+                name='unique_vote_per_registration',
+                violation_error_message="Już zagłosowałeś na tego kandydata.",
+                violation_error_code='vote_dupliaction'
+            )
+        ]
+        indexes = [
+            # Głosy są dopisywane chronologicznie, BRIN na created_at zajmuje kilka stron zamiast pełnego B-drzewa
+            BrinIndex(fields=['created_at'], name='samorzad_vote_created_brin'),
+        ]
         verbose_name="Głos"
         verbose_name_plural = 'Głosy'
 
@@ -207,9 +350,8 @@ class Vote(models.Model):
         # Walidacja kandydatury
         if not self.candidate_registration.is_eligible:
             raise ValidationError("Nie można oddać głosu na kandydata, który nie został dopuszczony do wyborów.", code='illegal_candidature')
-        # Walidacja ilości głosów/głosowanie i ilości głosów/kandydatura
-        if Vote.objects.filter(candidate_registration=self.candidate_registration, microsoft_user=self.microsoft_user).exists():
-            raise ValidationError("Już zagłosowałeś na tego kandydata.", code='vote_dupliaction')
+        # Walidacja ilości głosów/głosowanie. Ponowny głos na tę samą kandydaturę odrzuca ograniczenie
+        # unique_vote_per_registration przy zapisie (Vote.save)
         voting = self.candidate_registration.voting
         if Vote.objects.filter(
                 candidate_registration__voting=voting,
@@ -219,6 +361,178 @@ class Vote(models.Model):
         if self.pk:
             raise ValidationError("Edytowanie modelu Vote jest zabronione!", code='vote_action_forbidden')
 
+    @staticmethod
+    def update_aggregates(voting_id: int, votes, voters: int = 0):
+        """Uwzględnia nowo zapisane głosy głosowania w tabelach agregatów wyników i licznikach głosowania,
+        voters to liczba nowych kart do głosowania. Musi być wywołana w tej samej transakcji co zapis głosów"""
+        VoteTally.increment(Counter(vote.candidate_registration_id for vote in votes))
+        VoteTimeBucket.increment(voting_id, Counter(
+            (vote.candidate_registration_id, VoteTimeBucket.bucket_for(vote.created_at)) for vote in votes
+        ))
+        Voting.increment_counters(voting_id, len(votes), voters)
+
+    def save(self, *args, **kwargs):
+        # Bez validate_constraints: unikalność głosu sprawdza baza danych przy zapisie, bez dodatkowego zapytania
+        self.full_clean(validate_constraints=False)
+        try:
+            with transaction.atomic():
+                # Pojedyncze głosy (np. z panelu admina) również trafiają na kartę użytkownika w danym głosowaniu
+                created = False
+                if self.ballot_id is None:
+                    self.ballot, created = Ballot.objects.get_or_create(
+                        voting_id=self.candidate_registration.voting_id,
+                        microsoft_user=self.microsoft_user
+                    )
+                super().save(*args, **kwargs)
+                Vote.update_aggregates(self.candidate_registration.voting_id, [self], voters=int(created))
+                # Import lokalny, samorzad.results importuje modele z tego modułu
+                from .results import bump_results_version_on_commit
+                bump_results_version_on_commit(self.candidate_registration.voting_id)
+        except IntegrityError as error:
+            constraint = constraint_validation_error(Vote, error)
+            if constraint is None:
+                raise
+            raise ValidationError({NON_FIELD_ERRORS: [constraint]})
+
+
+def _increment_counters(model, key_fields: list[str], counts: dict, conflict_fields: list[str] | None = None):
+    """Zwiększa kolumnę count modelu jednym zapytaniem INSERT ... ON CONFLICT DO UPDATE.
+    Klucze słownika counts to krotki wartości pól key_fields, wartości to przyrosty. conflict_fields to pola
+    ograniczenia unikalności (domyślnie key_fields).
+    Wiersze są sortowane, żeby równoległe transakcje blokowały je w tej samej kolejności"""
+    if not counts:
+        return
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = [quote_name(model._meta.get_field(field).column) for field in key_fields]
+    conflict_columns = [quote_name(model._meta.get_field(field).column) for field in conflict_fields or key_fields]
+    row_placeholder = '(' + ', '.join(['%s'] * (len(columns) + 1)) + ')'
+    params = []
+    for key, amount in sorted(counts.items()):
+        params.extend(key)
+        params.append(amount)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({", ".join(columns)}, count) '
+            f'VALUES {", ".join([row_placeholder] * len(counts))} '
+            f'ON CONFLICT ({", ".join(conflict_columns)}) DO UPDATE SET count = {table}.count + EXCLUDED.count',
+            params
+        )
+
+
+class VoteTally(models.Model):
+    """Model przechowujący bieżącą liczbę głosów oddanych na kandydaturę, pola:
+
+    - registration: Klucz obcy (i klucz główny) kandydatury
+    - count: Liczba głosów oddanych na kandydaturę
+
+    Licznik jest zwiększany w tej samej transakcji co zapis głosów (Vote.update_aggregates), dzięki czemu
+    wyniki czytają O(kandydatów) wierszy zamiast liczyć wszystkie głosy. W razie rozjazdu z tabelą głosów
+    liczniki odbudowuje komenda: python manage.py rebuild_vote_tallies
+    """
+    registration = models.OneToOneField(CandidateRegistration, on_delete=models.CASCADE, primary_key=True, related_name='tally', verbose_name='kandydatura')
+    count = models.PositiveIntegerField(default=0, verbose_name='liczba głosów')
+
+    class Meta:
+        verbose_name = "Licznik głosów"
+        verbose_name_plural = 'Liczniki głosów'
+
+    @staticmethod
+    def increment(counts: dict):
+        """Zwiększa liczniki kandydatur, counts: {id kandydatury: przyrost}"""
+        _increment_counters(VoteTally, ['registration'], {(registration_id,): amount for registration_id, amount in counts.items()})
+
+    def __str__(self):
+        return f'VoteTally(registration={self.registration_id}, count={self.count})'
+
+
+class VoteTimeBucket(models.Model):
+    """Model przechowujący liczbę głosów oddanych na kandydaturę w danej godzinie, pola:
+
+    - voting: Klucz obcy głosowania (zdenormalizowany z kandydatury, żeby oś czasu czytać jednym filtrem)
+    - registration: Klucz obcy kandydatury
+    - bucket_start: Początek godziny (UTC), w której oddano głosy
+    - count: Liczba głosów oddanych w tej godzinie
+
+    Kubełki są zwiększane w tej samej transakcji co zapis głosów (Vote.update_aggregates), więc oś czasu
+    czyta O(godzin x kandydatów) wierszy zamiast wszystkich głosów. Historyczne głosowania uzupełnia
+    komenda: python manage.py rebuild_vote_time_buckets
+    """
+    voting = models.ForeignKey(Voting, on_delete=models.CASCADE, related_name='vote_time_buckets', verbose_name='głosowanie')
+    registration = models.ForeignKey(CandidateRegistration, on_delete=models.CASCADE, related_name='vote_time_buckets', verbose_name='kandydatura')
+    bucket_start = models.DateTimeField(verbose_name='początek godziny')
+    count = models.PositiveIntegerField(default=0, verbose_name='liczba głosów')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['registration', 'bucket_start'], name='unique_bucket_per_registration')
+        ]
+        indexes = [
+            models.Index(fields=['voting', 'bucket_start'], name='samorzad_bucket_voting_idx')
+        ]
+        verbose_name = "Godzinowy licznik głosów"
+        verbose_name_plural = 'Godzinowe liczniki głosów'
+
+    @staticmethod
+    def bucket_for(dt):
+        """Zwraca początek godziny, do której należy podany czas. Polska strefa czasowa ma przesunięcie
+        o pełne godziny, więc kubełki w UTC pokrywają się z kubełkami w czasie lokalnym"""
+        return dt.astimezone(pytz.utc).replace(minute=0, second=0, microsecond=0)
+
+    @staticmethod
+    def increment(voting_id: int, counts: dict):
+        """Zwiększa kubełki głosowania, counts: {(id kandydatury, początek godziny): przyrost}"""
+        _increment_counters(
+            VoteTimeBucket,
+            ['voting', 'registration', 'bucket_start'],
+            {(voting_id, registration_id, bucket_start): amount for (registration_id, bucket_start), amount in counts.items()},
+            conflict_fields=['registration', 'bucket_start']
+        )
+
+    def __str__(self):
+        return f'VoteTimeBucket(registration={self.registration_id}, bucket_start={self.bucket_start}, count={self.count})'
+
+
+class VotingResultSnapshot(models.Model):
+    """Model przechowujący ostateczne wyniki zakończonego głosowania, zapisywane raz po planned_end, pola:
+
+    - voting: Klucz obcy głosowania (klucz główny)
+    - chart: Wyniki kandydatów w formacie samorzad.results.get_chart_data
+    - timeline: Pełna oś czasu w formacie samorzad.results.get_timeline_data
+    - ranking: ID kandydatur posortowane malejąco po liczbie głosów (pierwsza kandydatura wygrała)
+    - votes_count: Liczba oddanych głosów
+    - voters_count: Liczba użytkowników, którzy oddali kartę (frekwencja)
+    - candidates_count: Liczba dopuszczonych kandydatur
+    - created_at: Czas utworzenia obiektu (strefa UTC)
+
+    Po zakończeniu głosowania wyniki nie mogą się zmienić, więc wszystkie ścieżki odczytu zakończonego
+    głosowania czytają tylko ten wiersz. Tworzy go samorzad.results.finalize_voting (komenda finalize_votings),
+    do tego czasu wyniki zakończonego głosowania są czytane z cache
+
+    UWAGA: Nie da się edytować obiektów
+    """
+    voting = models.OneToOneField(Voting, on_delete=models.CASCADE, primary_key=True, related_name='result_snapshot', verbose_name='głosowanie')
+    chart = models.JSONField(blank=True, verbose_name='wyniki kandydatów')
+    timeline = models.JSONField(blank=True, verbose_name='oś czasu')
+    ranking = models.JSONField(blank=True, verbose_name='kolejność kandydatur')
+    votes_count = models.PositiveIntegerField(verbose_name='liczba głosów')
+    voters_count = models.PositiveIntegerField(verbose_name='liczba głosujących')
+    candidates_count = models.PositiveIntegerField(verbose_name='liczba kandydatów')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='data utworzenia')
+
+    class Meta:
+        verbose_name = "Wyniki głosowania"
+        verbose_name_plural = 'Wyniki głosowań'
+
+    def clean(self):
+        if not self._state.adding:
+            raise ValidationError("Edytowanie modelu VotingResultSnapshot jest zabronione!", code='snapshot_action_forbidden')
+        if self.voting.planned_end > timezone.now():
+            raise ValidationError("Nie można zapisać wyników przed zakończeniem głosowania", code='voting_not_finished')
+
     def save(self, *args, **kwargs):
         self.full_clean()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f'VotingResultSnapshot(voting={self.voting_id}, votes={self.votes_count})'
@@ -0,0 +1,296 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, IntegrityError
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.timezone import timedelta
+
+from asgiref.sync import sync_to_async
+
+from ekonomvote.cache_versions import get_version, aget_version, bump_version
+from .models import Voting, Vote, Ballot, Candidate, CandidateRegistration, VoteTimeBucket, VotingResultSnapshot
+
+WARSAW_TZ_NAME = 'Europe/Warsaw'
+
+
+RESULTS_VERSION_KEY = 'samorzad:results_version:{voting_id}'
+RESULTS_KEY = 'samorzad:results:{kind}:{voting_id}:{version}'
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def get_timeline_range(voting: Voting):
+    """Zwraca pierwszą i ostatnią godzinę osi czasu głosowania (UTC). Dla trwającego głosowania oś kończy się
+    na bieżącej pełnej godzinie, dla zakończonego na godzinie po planned_end"""
+    start = VoteTimeBucket.bucket_for(voting.planned_start)
+    now = timezone.now()
+    if voting.planned_end <= now:
+        end = VoteTimeBucket.bucket_for(voting.planned_end) + timedelta(hours=1)
+    else:
+        end = VoteTimeBucket.bucket_for(now)
+    return start, end
+
+
+def _timeline_sql(from_votes: bool):
+    """Buduje zapytanie zwracające gęstą macierz osi czasu: godziny z generate_series, liczby głosów
+    pogrupowane po kandydaturze i godzinie oraz sumy skumulowane liczone funkcją okna.
+    Głosy z danej godziny są widoczne na osi czasu od końca tej godziny"""
+    if from_votes:
+        counts = f'''
+            SELECT v.candidate_registration_id AS registration_id,
+                   (date_trunc('hour', v.created_at AT TIME ZONE '{WARSAW_TZ_NAME}') AT TIME ZONE '{WARSAW_TZ_NAME}') + interval '1 hour' AS hour,
+                   count(*) AS count
+            FROM {_table(Vote)} v
+            JOIN {_table(CandidateRegistration)} r ON r.id = v.candidate_registration_id
+            WHERE r.voting_id = %(voting_id)s
+            GROUP BY 1, 2
+        '''
+    else:
+        counts = f'''
+            SELECT b.registration_id, b.bucket_start + interval '1 hour' AS hour, b.count
+            FROM {_table(VoteTimeBucket)} b
+            WHERE b.voting_id = %(voting_id)s
+        '''
+    return f'''
+        WITH hours AS (
+            SELECT generate_series(%(start)s::timestamptz, %(end)s::timestamptz, interval '1 hour') AS hour
+        ),
+        registrations AS (
+            SELECT r.id AS registration_id, c.id AS candidate_id, c.first_name, c.last_name
+            FROM {_table(CandidateRegistration)} r
+            JOIN {_table(Candidate)} c ON c.id = r.candidate_id
+            WHERE r.voting_id = %(voting_id)s AND r.is_eligible
+        ),
+        counts AS ({counts}),
+        cumulative AS (
+            SELECT reg.registration_id, reg.candidate_id, reg.first_name, reg.last_name, h.hour,
+                   SUM(COALESCE(cnt.count, 0)) OVER (PARTITION BY reg.registration_id ORDER BY h.hour)::integer AS votes
+            FROM registrations reg
+            CROSS JOIN hours h
+            LEFT JOIN counts cnt ON cnt.registration_id = reg.registration_id AND cnt.hour = h.hour
+        ),
+        matrix AS (
+            SELECT candidate_id, first_name, last_name, array_agg(votes ORDER BY hour) AS votes
+            FROM cumulative
+            GROUP BY registration_id, candidate_id, first_name, last_name
+        )
+        SELECT (SELECT array_agg(to_char(hour AT TIME ZONE '{WARSAW_TZ_NAME}', 'YYYY-MM-DD HH24:MI') ORDER BY hour) FROM hours) AS timeline,
+               m.candidate_id, m.first_name, m.last_name, m.votes
+        FROM (SELECT 1) AS one
+        LEFT JOIN matrix m ON TRUE
+        ORDER BY m.first_name, m.last_name
+    '''
+
+
+def get_timeline_data(voting: Voting, from_votes: bool = False) -> dict:
+    """Zwraca gotowe do serializacji dane osi czasu w formacie oczekiwanym przez szablon
+    samorzad/experimental_timeline_template.html. Całe kubełkowanie i sumy skumulowane liczy Postgres,
+    więc pamięć i czas nie zależą od liczby głosów.
+
+    - from_votes: False - dane z godzinowych kubełków (VoteTimeBucket), True - bezpośrednio z tabeli głosów
+    """
+    start, end = get_timeline_range(voting)
+    with connection.cursor() as cursor:
+        cursor.execute(_timeline_sql(from_votes), {'voting_id': voting.id, 'start': start, 'end': end})
+        rows = cursor.fetchall()
+    # Kandydaci jako lista posortowana po imieniu i nazwisku, bo JSONField (jsonb) snapshotu nie zachowuje kolejności kluczy
+    timeline_data = {
+        "timeline": rows[0][0] or [],
+        "candidates": []
+    }
+    for timeline, candidate_id, first_name, last_name, votes in rows:
+        if candidate_id is None:
+            continue
+        timeline_data["candidates"].append({
+            "id": candidate_id,
+            "name": f"{first_name} {last_name}",
+            "series": votes,
+        })
+    return timeline_data
+
+
+def get_chart_data(voting: Voting) -> list[dict]:
+    """Zwraca gotowe do serializacji dane wykresu wyników w formacie oczekiwanym przez szablon
+    samorzad/experimental_chart_template.html, posortowane malejąco po liczbie głosów.
+    Liczby głosów pochodzą z liczników samorzad.models.VoteTally, bez liczenia wierszy tabeli głosów"""
+    registrations = list(CandidateRegistration.objects.filter(
+        voting=voting,
+        is_eligible=True
+    ).select_related('candidate').annotate(
+        votes_count=Coalesce('tally__count', 0)
+    ).order_by('candidate__first_name', 'candidate__last_name'))
+    total_votes = sum(reg.votes_count for reg in registrations)
+    chart_data = []
+    for reg in registrations:
+        percentage = (reg.votes_count / total_votes * 100) if total_votes > 0 else 0
+        chart_data.append({
+            "registration_id": reg.id,
+            "candidate": {
+                'first_name': reg.candidate.first_name,
+                'second_name': reg.candidate.second_name,
+                'last_name': reg.candidate.last_name,
+                'school_class': reg.candidate.school_class
+            },
+            "votes_count": reg.votes_count,
+            "percentage": round(percentage, 2),
+        })
+    chart_data.sort(key=lambda d: d['votes_count'], reverse=True)
+    return chart_data
+
+
+# Cache wyników
+# Klucz wyników zawiera wersję wyników głosowania, podbijaną po zatwierdzeniu każdej karty do głosowania.
+# Dzięki temu wyniki są liczone raz na wersję, a stare wpisy nie wymagają usuwania (wygasają po TTL)
+
+def get_results_version(voting_id: int) -> int:
+    """Zwraca bieżącą wersję wyników głosowania (ekonomvote.cache_versions)"""
+    return get_version(RESULTS_VERSION_KEY.format(voting_id=voting_id))
+
+
+def bump_results_version(voting_id: int):
+    """Unieważnia zcache'owane wyniki głosowania przez podbicie jego wersji"""
+    bump_version(RESULTS_VERSION_KEY.format(voting_id=voting_id))
+
+
+def bump_results_version_on_commit(voting_id: int):
+    """Podbija wersję wyników dopiero po zatwierdzeniu transakcji, żeby równoległe żądanie nie zapisało
+    w cache pod nową wersją wyników sprzed zapisu głosów"""
+    transaction.on_commit(lambda: bump_results_version(voting_id))
+
+
+def _cache_timeout(voting: Voting) -> int:
+    """Wyniki zakończonego głosowania bez snapshotu już się nie zmieniają, więc są przechowywane dłużej"""
+    if is_finished(voting):
+        return settings.SAMORZAD_RESULTS_CACHE_TTL_FINISHED
+    return settings.SAMORZAD_RESULTS_CACHE_TTL_LIVE
+
+
+def _get_cached(voting: Voting, kind: str, compute):
+    key = RESULTS_KEY.format(kind=kind, voting_id=voting.id, version=get_results_version(voting.id))
+    data = cache.get(key)
+    if data is None:
+        data = compute(voting)
+        cache.set(key, data, timeout=_cache_timeout(voting))
+    return data
+
+
+def get_cached_chart_data(voting: Voting) -> list[dict]:
+    """get_chart_data liczone raz na wersję wyników głosowania"""
+    return _get_cached(voting, 'chart', get_chart_data)
+
+
+def get_cached_timeline_data(voting: Voting) -> dict:
+    """get_timeline_data liczone raz na wersję wyników głosowania. Oś czasu trwającego głosowania wydłuża się
+    co godzinę także bez nowych głosów, dlatego klucz zawiera również koniec osi czasu"""
+    start, end = get_timeline_range(voting)
+    return _get_cached(voting, f'timeline:{int(end.timestamp())}', get_timeline_data)
+
+
+# Wyniki zakończonych głosowań
+
+def is_finished(voting: Voting) -> bool:
+    """Czy głosowanie się zakończyło (głos można oddać jeszcze dokładnie w chwili planned_end)"""
+    return voting.planned_end < timezone.now()
+
+
+def finalize_voting(voting: Voting) -> VotingResultSnapshot:
+    """Zapisuje ostateczne wyniki zakończonego głosowania w samorzad.models.VotingResultSnapshot.
+    Operacja jest idempotentna, przy równoległym wywołaniu zwracany jest wcześniej zapisany snapshot"""
+    if not is_finished(voting):
+        raise ValidationError("Nie można zapisać wyników przed zakończeniem głosowania", code='voting_not_finished')
+    existing = VotingResultSnapshot.objects.filter(voting=voting).first()
+    if existing is not None:
+        return existing
+    chart_data = get_chart_data(voting)
+    ranking = list(CandidateRegistration.objects.filter(
+        voting=voting,
+        is_eligible=True
+    ).annotate(
+        votes_count=Coalesce('tally__count', 0)
+    ).order_by('-votes_count', 'candidate__first_name', 'candidate__last_name').values_list('id', flat=True))
+    snapshot = VotingResultSnapshot(
+        voting=voting,
+        chart=chart_data,
+        timeline=get_timeline_data(voting),
+        ranking=ranking,
+        votes_count=sum(item['votes_count'] for item in chart_data),
+        voters_count=Ballot.objects.filter(voting=voting).count(),
+        candidates_count=len(chart_data),
+    )
+    try:
+        with transaction.atomic():
+            snapshot.save()
+    except (IntegrityError, ValidationError):
+        # Snapshot zapisało w międzyczasie inne żądanie
+        return VotingResultSnapshot.objects.get(voting=voting)
+    return snapshot
+
+
+def get_result_snapshot(voting: Voting) -> VotingResultSnapshot | None:
+    """Zwraca zapisane wyniki zakończonego głosowania albo None, jeśli nie zostały jeszcze zapisane
+    (komenda finalize_votings). Ścieżka odczytu nie zapisuje niczego do bazy danych. Przy wcześniejszym
+    select_related('result_snapshot') nie wykonuje żadnego zapytania"""
+    try:
+        return voting.result_snapshot
+    except VotingResultSnapshot.DoesNotExist:
+        return None
+
+
+def get_chart_results(voting: Voting) -> list[dict]:
+    """Dane wykresu wyników: ze snapshotu dla zakończonego głosowania, z cache dla trwającego
+    i zakończonego bez zapisanego snapshotu"""
+    snapshot = get_result_snapshot(voting) if is_finished(voting) else None
+    if snapshot is not None:
+        return snapshot.chart
+    return get_cached_chart_data(voting)
+
+
+def get_timeline_results(voting: Voting) -> dict:
+    """Dane osi czasu: ze snapshotu dla zakończonego głosowania, z cache dla trwającego
+    i zakończonego bez zapisanego snapshotu"""
+    snapshot = get_result_snapshot(voting) if is_finished(voting) else None
+    if snapshot is not None:
+        return snapshot.timeline
+    return get_cached_timeline_data(voting)
+
+
+# Odpowiedniki asynchroniczne (widoki ASGI). Cache jest czytany przez asynchroniczne API cache Django,
+# liczenie wyników pozostaje synchroniczne i wykonuje się w wątku
+
+async def aget_results_version(voting_id: int) -> int:
+    """Asynchroniczna wersja get_results_version"""
+    return await aget_version(RESULTS_VERSION_KEY.format(voting_id=voting_id))
+
+
+async def _aget_cached(voting: Voting, kind: str, compute):
+    key = RESULTS_KEY.format(kind=kind, voting_id=voting.id, version=await aget_results_version(voting.id))
+    data = await cache.aget(key)
+    if data is None:
+        data = await sync_to_async(compute)(voting)
+        await cache.aset(key, data, timeout=_cache_timeout(voting))
+    return data
+
+
+async def aget_result_snapshot(voting: Voting) -> VotingResultSnapshot | None:
+    """Asynchroniczna wersja get_result_snapshot, jedno wyszukiwanie po kluczu głównym"""
+    return await VotingResultSnapshot.objects.filter(voting_id=voting.id).afirst()
+
+
+async def aget_chart_results(voting: Voting) -> list[dict]:
+    """Asynchroniczna wersja get_chart_results"""
+    snapshot = await aget_result_snapshot(voting) if is_finished(voting) else None
+    if snapshot is not None:
+        return snapshot.chart
+    return await _aget_cached(voting, 'chart', get_chart_data)
+
+
+async def aget_timeline_results(voting: Voting) -> dict:
+    """Asynchroniczna wersja get_timeline_results"""
+    snapshot = await aget_result_snapshot(voting) if is_finished(voting) else None
+    if snapshot is not None:
+        return snapshot.timeline
+    start, end = get_timeline_range(voting)
+    return await _aget_cached(voting, f'timeline:{int(end.timestamp())}', get_timeline_data)
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Voting, CandidateRegistration
+
+
+@receiver(post_delete, sender=CandidateRegistration)
+def refresh_counters_on_registration_delete(sender, instance, **kwargs):
+    """Kandydatury są usuwane również kaskadowo (usunięcie kandydata), z pominięciem CandidateRegistration.delete.
+    Razem z kandydaturą znikają jej głosy i licznik VoteTally, więc przeliczana jest też liczba głosów"""
+    Voting.refresh_counters([instance.voting_id], fields=('votes_count', 'eligible_registrations_count'))
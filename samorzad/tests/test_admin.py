@@ -0,0 +1,47 @@
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+import pytz
+from freezegun import freeze_time
+
+from samorzad.models import Voting, Candidate, CandidateRegistration, Vote, Ballot, VoteTally
+from office_auth.models import AzureUser
+
+
+class VoteAdminTest(TestCase):
+    """Głosy i karty w panelu admina są tylko do odczytu, żeby nie rozjechać agregatów wyników"""
+
+    def setUp(self):
+        self.admin = AzureUser.objects.create(username='admin', is_superuser=True, is_staff=True)
+        self.voter = AzureUser.objects.create(username='wyborca')
+        with freeze_time('2025-06-01 12:00:00'):
+            voting = Voting.objects.create(
+                planned_start=timezone.datetime(2025, 6, 2, 8, 0, 0, tzinfo=pytz.utc),
+                planned_end=timezone.datetime(2025, 6, 2, 14, 0, 0, tzinfo=pytz.utc),
+                votes_per_user=1
+            )
+            candidate = Candidate.objects.create(first_name='Jan', last_name='Nowak', school_class='1 TI')
+            self.registration = CandidateRegistration.objects.create(candidate=candidate, voting=voting, is_eligible=True)
+        with freeze_time('2025-06-02 10:00:00'):
+            self.vote = Vote.objects.create(candidate_registration=self.registration, microsoft_user=self.voter)
+        self.client.force_login(self.admin)
+
+    def _url(self, model, view, *args):
+        return reverse(f'admin:samorzad_{model}_{view}', args=args)
+
+    def test_vote_cannot_be_deleted(self):
+        response = self.client.post(self._url('vote', 'delete', self.vote.pk), {'post': 'yes'})
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Vote.objects.filter(pk=self.vote.pk).exists())
+        self.assertEqual(VoteTally.objects.get(registration=self.registration).count, 1)
+
+    def test_ballot_cannot_be_deleted_or_added(self):
+        ballot = Ballot.objects.get()
+        self.assertEqual(self.client.post(self._url('ballot', 'delete', ballot.pk), {'post': 'yes'}).status_code, 403)
+        self.assertEqual(self.client.get(self._url('ballot', 'add')).status_code, 403)
+        self.assertTrue(Ballot.objects.filter(pk=ballot.pk).exists())
+
+    def test_vote_can_be_viewed_and_added(self):
+        self.assertEqual(self.client.get(self._url('vote', 'change', self.vote.pk)).status_code, 200)
+        self.assertEqual(self.client.get(self._url('vote', 'add')).status_code, 200)
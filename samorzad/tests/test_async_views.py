@@ -0,0 +1,111 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory, AsyncRequestFactory
+from django.utils import timezone
+from django.utils.timezone import timedelta
+
+from asgiref.sync import sync_to_async
+from freezegun import freeze_time
+from urllib.parse import urlencode
+
+from samorzad.models import Voting, Candidate, CandidateRegistration, ElectoralProgram
+from samorzad.ballot import BallotSnapshot, cast_ballot
+from samorzad import views, results
+from office_auth.models import AzureUser
+
+
+class AsyncViewsTest(TestCase):
+    fixtures = ['azure_users_fixture.json']
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        voting = Voting.objects.create(
+            planned_start=now + timedelta(hours=1),
+            planned_end=now + timedelta(days=1),
+            votes_per_user=2
+        )
+        for i in range(3):
+            candidate = Candidate.objects.create(
+                first_name=f"Jan{i}",
+                last_name=f"Nowak{i}",
+                school_class="1 TI"
+            )
+            registration = CandidateRegistration.objects.create(
+                candidate=candidate,
+                voting=voting,
+                is_eligible=True
+            )
+            ElectoralProgram.objects.create(
+                candidature=registration,
+                info="Testowy program wyborczy"
+            )
+        # Głosowanie trwające. Voting.clean nie pozwala utworzyć głosowania z przeszłą datą startu,
+        # a CandidateRegistration.clean dodać kandydatury do trwającego głosowania
+        Voting.objects.filter(pk=voting.pk).update(planned_start=now - timedelta(hours=2))
+        self.base_voting = Voting.objects.get(pk=voting.pk)
+        registration_ids = list(
+            CandidateRegistration.objects.filter(voting=self.base_voting).order_by('id').values_list('id', flat=True)
+        )
+        self.user = AzureUser.objects.first()
+        cast_ballot(BallotSnapshot(self.base_voting, self.user), registration_ids[:2])
+        self.factory = RequestFactory()
+        self.async_factory = AsyncRequestFactory()
+
+    def _sync_response(self, view, path, **kwargs):
+        request = self.factory.get(path)
+        request.user = self.user
+        return view(request, **kwargs)
+
+    async def _async_response(self, view, path, user=None, **kwargs):
+        request = self.async_factory.get(path)
+        request.user = user or self.user
+        return await view(request, **kwargs)
+
+    async def _assert_same_response(self, sync_view, async_view, path, **kwargs):
+        sync_response = await sync_to_async(self._sync_response)(sync_view, path, **kwargs)
+        async_response = await self._async_response(async_view, path, **kwargs)
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.content, sync_response.content)
+
+    async def test_chart_data_live(self):
+        await self._assert_same_response(views.get_chart_data, views.get_chart_data_async, '/', voting_id=self.base_voting.id)
+
+    async def test_timeline_data_live(self):
+        await self._assert_same_response(views.get_timeline_data, views.get_timeline_data_async, '/', voting_id=self.base_voting.id)
+
+    async def test_chart_data_finished(self):
+        await Voting.objects.filter(pk=self.base_voting.pk).aupdate(planned_end=timezone.now() - timedelta(minutes=1))
+        # Oba widoki czytają zapisany snapshot (JSONB nie zachowuje kolejności kluczy wyników wyliczonych w pamięci)
+        await sync_to_async(results.finalize_voting)(await Voting.objects.aget(pk=self.base_voting.pk))
+        await self._assert_same_response(views.get_chart_data, views.get_chart_data_async, '/', voting_id=self.base_voting.id)
+
+    async def test_partial_list_old_votings(self):
+        await Voting.objects.filter(pk=self.base_voting.pk).aupdate(planned_end=timezone.now() - timedelta(minutes=1))
+        await self._assert_same_response(views.partial_list_old_votings, views.partial_list_old_votings_async, '/')
+        voting = await Voting.objects.aget(pk=self.base_voting.pk)
+        cursor = views._old_votings_paginator().encode_cursor(voting)
+        response = await self._async_response(views.partial_list_old_votings_async, '/?' + urlencode({'cursor': cursor}))
+        self.assertNotIn(b'card', response.content)
+
+    def test_old_votings_include_voting_ending_now(self):
+        # Głosowanie kończące się dokładnie teraz nie jest już na liście trwających (planned_end__gt)
+        now = timezone.now()
+        Voting.objects.filter(pk=self.base_voting.pk).update(planned_end=now)
+        with freeze_time(now):
+            page = views._old_votings_paginator().get_page(None)
+        self.assertEqual([voting.pk for voting in page], [self.base_voting.pk])
+
+    async def test_list_votings(self):
+        response = await self._async_response(views.list_votings_async, '/')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_login_required(self):
+        response = await self._async_response(views.get_chart_data_async, '/', user=AnonymousUser(), voting_id=self.base_voting.id)
+        self.assertEqual(response.status_code, 302)
+
+    async def test_method_not_allowed(self):
+        request = self.async_factory.post('/')
+        request.user = self.user
+        response = await views.get_chart_data_async(request, voting_id=self.base_voting.id)
+        self.assertEqual(response.status_code, 405)
@@ -0,0 +1,230 @@
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+import pytz
+from io import StringIO
+from freezegun import freeze_time
+
+from samorzad.models import Voting, Vote, Ballot, VoteTally, VoteTimeBucket, Candidate, CandidateRegistration, ElectoralProgram
+from samorzad.ballot import BallotSnapshot, cast_ballot
+from office_auth.models import AzureUser
+
+
+class CastBallotTest(TestCase):
+    fixtures = ['azure_users_fixture.json']
+
+    @freeze_time('2025-06-01 12:00:00')
+    def setUp(self):
+        self.base_voting = Voting.objects.create(
+            planned_start=timezone.datetime(2025, 6, 2, 8, 30, 0, tzinfo=pytz.utc),
+            planned_end=timezone.datetime(2025, 6, 15, 19, 30, 0, tzinfo=pytz.utc),
+            votes_per_user=3
+        )
+        for i in range(8):
+            candidate = Candidate.objects.create(
+                first_name=f"Jan{i}",
+                last_name=f"Nowak{i}",
+                school_class="1 TI"
+            )
+            registration = CandidateRegistration.objects.create(
+                candidate=candidate,
+                voting=self.base_voting,
+                is_eligible=True
+            )
+            ElectoralProgram.objects.create(
+                candidature=registration,
+                info="Testowy program wyborczy"
+            )
+        candidate = Candidate.objects.create(
+            first_name="Jan_nielegal",
+            last_name="Nowak_nielegal",
+            school_class="1 TI"
+        )
+        self.illegal_registration = CandidateRegistration.objects.create(
+            candidate=candidate,
+            voting=self.base_voting,
+            is_eligible=False
+        )
+        self.registration_ids = list(
+            CandidateRegistration.objects.filter(voting=self.base_voting, is_eligible=True).values_list('id', flat=True)
+        )
+        self.azure_user = AzureUser.objects.first()
+
+    def _cast(self, registration_ids):
+        return self._cast_as(self.azure_user, registration_ids)
+
+    def _cast_as(self, user, registration_ids):
+        snapshot = BallotSnapshot(self.base_voting, user)
+        return cast_ballot(snapshot, registration_ids)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_valid_ballot(self):
+        self._cast(self.registration_ids[:3])
+        ballot = Ballot.objects.get(voting=self.base_voting, microsoft_user=self.azure_user)
+        self.assertEqual(ballot.votes.count(), 3)
+
+    @freeze_time('2025-06-02 08:29:59')
+    def test_ballot_before_start(self):
+        with self.assertRaises(ValidationError) as context:
+            self._cast(self.registration_ids[:3])
+        self.assertEqual(context.exception.code, 'voting_not_started')
+        self.assertEqual(Vote.objects.count(), 0)
+
+    @freeze_time('2025-06-15 19:30:01')
+    def test_ballot_after_end(self):
+        with self.assertRaises(ValidationError) as context:
+            self._cast(self.registration_ids[:3])
+        self.assertEqual(context.exception.code, 'voting_gone')
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_ballot_with_not_eligible_candidature(self):
+        with self.assertRaises(ValidationError) as context:
+            self._cast([self.registration_ids[0], self.registration_ids[1], self.illegal_registration.id])
+        self.assertEqual(context.exception.code, 'illegal_candidature')
+        # Cała karta jest odrzucana, nie tylko pojedynczy głos
+        self.assertEqual(Vote.objects.count(), 0)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_ballot_duplicated_candidature(self):
+        with self.assertRaises(ValidationError) as context:
+            self._cast([self.registration_ids[0], self.registration_ids[0], self.registration_ids[1]])
+        self.assertEqual(context.exception.code, 'vote_dupliaction')
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_ballot_vote_already_cast(self):
+        Vote.objects.create(
+            candidate_registration_id=self.registration_ids[0],
+            microsoft_user=self.azure_user
+        )
+        with self.assertRaises(ValidationError) as context:
+            self._cast(self.registration_ids[1:3])
+        self.assertEqual(context.exception.code, 'vote_limit_reached')
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_backfill_ballots(self):
+        # Głosy sprzed wprowadzenia kart, bez karty i bez liczników
+        Vote.objects.bulk_create([
+            Vote(candidate_registration_id=registration_id, microsoft_user=self.azure_user)
+            for registration_id in self.registration_ids[:2]
+        ])
+        call_command('backfill_ballots', stdout=StringIO())
+        ballot = Ballot.objects.get(voting=self.base_voting, microsoft_user=self.azure_user)
+        self.assertEqual(ballot.votes.count(), 2)
+        self.assertEqual(Voting.objects.get(pk=self.base_voting.pk).voters_count, 1)
+        with self.assertRaises(ValidationError) as context:
+            self._cast(self.registration_ids[2:3])
+        self.assertEqual(context.exception.code, 'vote_limit_reached')
+        call_command('backfill_ballots', stdout=StringIO())
+        self.assertEqual(Ballot.objects.count(), 1)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_ballot_vote_limit(self):
+        with self.assertRaises(ValidationError) as context:
+            self._cast(self.registration_ids[:4])
+        self.assertEqual(context.exception.code, 'vote_limit_reached')
+        self._cast(self.registration_ids[:3])
+        with self.assertRaises(ValidationError) as context:
+            self._cast(self.registration_ids[3:4])
+        self.assertEqual(context.exception.code, 'vote_limit_reached')
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_ballot_rejected_by_database(self):
+        # Dwa snapshoty wczytane przed zapisem, jak przy równoległym przesłaniu formularza z dwóch kart przeglądarki
+        first_snapshot = BallotSnapshot(self.base_voting, self.azure_user)
+        second_snapshot = BallotSnapshot(self.base_voting, self.azure_user)
+        cast_ballot(first_snapshot, self.registration_ids[:3])
+        with self.assertRaises(ValidationError) as context:
+            cast_ballot(second_snapshot, self.registration_ids[3:6])
+        self.assertEqual(context.exception.code, 'vote_limit_reached')
+        self.assertEqual(Ballot.objects.filter(microsoft_user=self.azure_user).count(), 1)
+        self.assertEqual(Vote.objects.filter(microsoft_user=self.azure_user).count(), 3)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_ballot_updates_tallies(self):
+        self._cast(self.registration_ids[:3])
+        self._cast_as(AzureUser.objects.last(), self.registration_ids[1:4])
+        tallies = dict(VoteTally.objects.values_list('registration_id', 'count'))
+        self.assertEqual(tallies[self.registration_ids[0]], 1)
+        self.assertEqual(tallies[self.registration_ids[1]], 2)
+        self.assertEqual(tallies[self.registration_ids[2]], 2)
+        self.assertEqual(tallies[self.registration_ids[3]], 1)
+        # Odrzucona karta nie zmienia liczników
+        with self.assertRaises(ValidationError):
+            self._cast(self.registration_ids[4:7])
+        self.assertEqual(sum(VoteTally.objects.values_list('count', flat=True)), 6)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_ballot_updates_voting_counters(self):
+        self.assertEqual(Voting.objects.get(pk=self.base_voting.pk).eligible_registrations_count, 8)
+        self._cast(self.registration_ids[:3])
+        self._cast_as(AzureUser.objects.last(), self.registration_ids[1:3])
+        # Pojedynczy głos poza kartą tworzy kartę użytkownika
+        Vote.objects.create(candidate_registration_id=self.registration_ids[0], microsoft_user=AzureUser.objects.all()[1])
+        with self.assertRaises(ValidationError):
+            self._cast(self.registration_ids[4:7])
+        voting = Voting.objects.get(pk=self.base_voting.pk)
+        self.assertEqual(voting.votes_count, 6)
+        self.assertEqual(voting.voters_count, 3)
+
+    @freeze_time('2025-06-01 12:00:00')
+    def test_registration_changes_update_voting_counters(self):
+        self.illegal_registration.is_eligible = True
+        self.illegal_registration.save()
+        self.assertEqual(Voting.objects.get(pk=self.base_voting.pk).eligible_registrations_count, 9)
+        # Zapis bez zmiany głosowania i dopuszczenia nie przelicza liczników
+        registration = CandidateRegistration.objects.get(pk=self.registration_ids[1])
+        with CaptureQueriesContext(connection) as queries:
+            registration.save()
+        voting_table = connection.ops.quote_name(Voting._meta.db_table)
+        self.assertFalse([query for query in queries if f'UPDATE {voting_table}' in query['sql']])
+        # Zapis głosowania (np. z formularza panelu) nie nadpisuje liczników wczytanych przed zmianą kandydatur
+        self.base_voting.votes_per_user = 4
+        self.base_voting.save()
+        self.assertEqual(Voting.objects.get(pk=self.base_voting.pk).eligible_registrations_count, 9)
+        # Kaskadowe usunięcie kandydatury razem z kandydatem
+        Candidate.objects.get(registrations=self.registration_ids[0]).delete()
+        self.assertEqual(Voting.objects.get(pk=self.base_voting.pk).eligible_registrations_count, 8)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_rebuild_vote_tallies(self):
+        self._cast(self.registration_ids[:3])
+        VoteTally.objects.update(count=100)
+        Voting.objects.update(votes_count=100, voters_count=100, eligible_registrations_count=100)
+        call_command('rebuild_vote_tallies', stdout=StringIO())
+        tallies = dict(VoteTally.objects.values_list('registration_id', 'count'))
+        self.assertEqual(sum(tallies.values()), 3)
+        self.assertEqual(tallies[self.illegal_registration.id], 0)
+        voting = Voting.objects.get(pk=self.base_voting.pk)
+        self.assertEqual((voting.votes_count, voting.voters_count, voting.eligible_registrations_count), (3, 1, 8))
+
+    def test_ballot_updates_time_buckets(self):
+        with freeze_time('2025-06-02 08:31:00'):
+            self._cast(self.registration_ids[:3])
+        with freeze_time('2025-06-02 08:59:59'):
+            self._cast_as(AzureUser.objects.last(), self.registration_ids[:3])
+        with freeze_time('2025-06-02 10:00:00'):
+            self._cast_as(AzureUser.objects.all()[1], self.registration_ids[:1])
+        buckets = dict(
+            ((registration_id, bucket_start.hour), count)
+            for registration_id, bucket_start, count in VoteTimeBucket.objects.filter(
+                voting=self.base_voting
+            ).values_list('registration_id', 'bucket_start', 'count')
+        )
+        self.assertEqual(buckets[(self.registration_ids[0], 8)], 2)
+        self.assertEqual(buckets[(self.registration_ids[2], 8)], 2)
+        self.assertEqual(buckets[(self.registration_ids[0], 10)], 1)
+        self.assertEqual(len(buckets), 4)
+
+    def test_rebuild_vote_time_buckets(self):
+        with freeze_time('2025-06-02 08:31:00'):
+            self._cast(self.registration_ids[:3])
+        with freeze_time('2025-06-02 09:15:00'):
+            self._cast_as(AzureUser.objects.last(), self.registration_ids[:3])
+        expected = sorted(VoteTimeBucket.objects.values_list('registration_id', 'bucket_start', 'count'))
+        VoteTimeBucket.objects.all().delete()
+        call_command('rebuild_vote_time_buckets', voting=[self.base_voting.id], stdout=StringIO())
+        self.assertEqual(sorted(VoteTimeBucket.objects.values_list('registration_id', 'bucket_start', 'count')), expected)
@@ -77,8 +77,10 @@ class VoteFormTest(TestCase):
         self.assertEqual(code, 'required')
 
     def test_registration_exists(self):
+        # Sekwencje kluczy nie są cofane między testami, więc stałe ID mogłoby należeć do kandydatury z setUp
+        missing_id = CandidateRegistration.objects.order_by('-id').values_list('id', flat=True).first() + 1
         data = {
-            'candidate_registration_id':'123',
+            'candidate_registration_id': str(missing_id),
         }
         form = VoteForm(data=data, voting=self.base_voting)
         self.assertFalse(form.is_valid())
@@ -164,4 +166,16 @@ class BaseVoteFormSetTest(TestCase):
         formset = self.formset(data=data, voting=self.base_voting)
         self.assertFalse(formset.is_valid())
         code = formset.non_form_errors().get_json_data()[0].get('code')
-        self.assertEqual(code, 'invalid_form_count')
\ No newline at end of file
+        self.assertEqual(code, 'invalid_form_count')
+    def test_formset_loads_registrations_once(self):
+        data = {
+            'form-TOTAL_FORMS':self.base_voting.votes_per_user,
+            'form-INITIAL_FORMS':0,
+            'form-0-candidate_registration_id':self.candidatures[0].id,
+            'form-1-candidate_registration_id': self.candidatures[1].id,
+            'form-2-candidate_registration_id': self.candidatures[2].id,
+        }
+        # Jedno zapytanie o kandydatury głosowania niezależnie od liczby formularzy
+        with self.assertNumQueries(1):
+            formset = self.formset(data=data, voting=self.base_voting)
+            self.assertTrue(formset.is_valid())
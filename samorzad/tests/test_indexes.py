@@ -0,0 +1,152 @@
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.timezone import timedelta
+
+import json
+
+from samorzad.models import Voting, Candidate, CandidateRegistration, Vote
+from samorzad.ballot import BallotSnapshot, cast_ballot
+from office_auth.models import AzureUser
+from oscary.models import Vote as OscarVote
+
+
+class ExplainMixin:
+    """Sprawdza plany zapytań z wyłączonym enable_seqscan. Planista wybiera wtedy Seq Scan tylko jeśli
+    żaden indeks nie obsługuje zapytania, więc wynik nie zależy od liczby wierszy w tabelach testowych.
+    Statystyki tabel są odświeżane (ANALYZE), więc wybór spośród kilku indeksów nie zależy od wcześniejszych testów"""
+
+    def setUp(self):
+        super().setUp()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute('SET enable_seqscan = off')
+        self.addCleanup(self._reset_seqscan)
+
+    def _reset_seqscan(self):
+        with connection.cursor() as cursor:
+            cursor.execute('RESET enable_seqscan')
+
+    def _plan_nodes(self, node):
+        yield node
+        for child in node.get('Plans', []):
+            yield from self._plan_nodes(child)
+
+    def _index_name(self, model, columns):
+        """Nazwa indeksu na podanych kolumnach, np. indeksu klucza obcego, którego nazwę generuje Django"""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        return next(name for name, info in constraints.items() if info['index'] and info['columns'] == columns)
+
+    def assertUsesIndexes(self, queryset, tables, indexes):
+        """Sprawdza, że zapytanie nie skanuje sekwencyjnie podanych tabel i korzysta z podanych indeksów"""
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        nodes = list(self._plan_nodes(plan))
+        seq_scans = [
+            node['Relation Name'] for node in nodes
+            if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in tables
+        ]
+        self.assertEqual(seq_scans, [], f'Seq Scan w planie zapytania:\n{queryset.explain()}')
+        used_indexes = {node['Index Name'] for node in nodes if 'Index Name' in node}
+        self.assertLessEqual(set(indexes), used_indexes, f'Plan zapytania:\n{queryset.explain()}')
+
+
+class SamorzadIndexesTest(ExplainMixin, TestCase):
+    fixtures = ['azure_users_fixture.json']
+    vote_tables = [Vote._meta.db_table, CandidateRegistration._meta.db_table]
+
+    def setUp(self):
+        now = timezone.now()
+        voting = Voting.objects.create(
+            planned_start=now + timedelta(hours=1),
+            planned_end=now + timedelta(days=1),
+            votes_per_user=2
+        )
+        registrations = [
+            CandidateRegistration.objects.create(
+                candidate=Candidate.objects.create(first_name=f'Jan{i}', last_name=f'Nowak{i}', school_class='1 TI'),
+                voting=voting,
+                is_eligible=True
+            )
+            for i in range(4)
+        ]
+        # Kandydatury niedopuszczone, karta do głosowania pomija je warunkiem z indeksu samorzad_reg_voting_elig_idx
+        for i in range(4, 12):
+            CandidateRegistration.objects.create(
+                candidate=Candidate.objects.create(first_name=f'Jan{i}', last_name=f'Nowak{i}', school_class='1 TI'),
+                voting=voting
+            )
+        Voting.objects.filter(pk=voting.pk).update(planned_start=now - timedelta(hours=2))
+        self.voting = Voting.objects.get(pk=voting.pk)
+        self.users = list(AzureUser.objects.order_by('pk')[:20])
+        for i, user in enumerate(self.users):
+            cast_ballot(BallotSnapshot(self.voting, user), [registrations[i % 4].id, registrations[(i + 1) % 4].id])
+        self.user = self.users[0]
+        super().setUp()
+
+    def test_has_voted_per_registration(self):
+        # samorzad.views.get_voting_details
+        self.assertUsesIndexes(
+            CandidateRegistration.objects.filter(voting=self.voting, is_eligible=True).annotate(
+                has_voted=Exists(Vote.objects.filter(candidate_registration=OuterRef('pk'), microsoft_user=self.user))
+            ),
+            self.vote_tables,
+            ['samorzad_reg_voting_elig_idx', 'unique_vote_per_registration']
+        )
+
+    def test_user_votes_in_voting(self):
+        self.assertUsesIndexes(
+            Vote.objects.filter(candidate_registration__voting=self.voting, microsoft_user=self.user),
+            self.vote_tables,
+            ['unique_vote_per_registration']
+        )
+
+    def test_votes_in_voting(self):
+        self.assertUsesIndexes(
+            Vote.objects.filter(candidate_registration__voting=self.voting).values('pk'),
+            self.vote_tables,
+            [self._index_name(Vote, ['candidate_registration_id'])]
+        )
+
+    def test_votes_by_created_at(self):
+        now = timezone.now()
+        self.assertUsesIndexes(
+            Vote.objects.filter(created_at__gte=now - timedelta(hours=1), created_at__lt=now),
+            self.vote_tables,
+            ['samorzad_vote_created_brin']
+        )
+
+    def test_voting_periods(self):
+        now = timezone.now()
+        # samorzad.views.list_votings i partial_list_old_votings
+        self.assertUsesIndexes(
+            Voting.objects.filter(planned_start__lte=now, planned_end__gt=now).order_by('planned_start'),
+            [Voting._meta.db_table],
+            ['samorzad_voting_period_idx']
+        )
+        self.assertUsesIndexes(
+            Voting.objects.filter(planned_end__lte=now).order_by('-planned_end', '-id'),
+            [Voting._meta.db_table],
+            ['samorzad_voting_end_idx']
+        )
+
+
+class OscaryIndexesTest(ExplainMixin, TestCase):
+    vote_tables = [OscarVote._meta.db_table]
+
+    def test_user_votes(self):
+        # Głosy użytkownika, oscary.models.Vote.clean zawęża je dodatkowo do kandydatury
+        self.assertUsesIndexes(
+            OscarVote.objects.filter(microsoft_user_id=1),
+            self.vote_tables,
+            ['unique_vote_per_candidature']
+        )
+
+    def test_votes_by_created_at(self):
+        now = timezone.now()
+        self.assertUsesIndexes(
+            OscarVote.objects.filter(created_at__gte=now - timedelta(hours=1), created_at__lt=now),
+            self.vote_tables,
+            ['oscary_vote_created_brin']
+        )
@@ -0,0 +1,164 @@
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+import json
+import pytz
+import tempfile
+from io import StringIO
+from pathlib import Path
+from freezegun import freeze_time
+
+from samorzad.models import Voting, Vote, Ballot, VoteTally, Candidate, CandidateRegistration, ElectoralProgram
+from samorzad.ballot import BallotSnapshot, cast_ballot
+from samorzad import ingest
+from office_auth.models import AzureUser
+
+
+class VoteIngestionTest(TestCase):
+    fixtures = ['azure_users_fixture.json']
+
+    @freeze_time('2025-06-01 12:00:00')
+    def setUp(self):
+        cache.clear()
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            SAMORZAD_VOTE_INGESTION='buffered',
+            SAMORZAD_INGEST_DIR=self.log_dir.name
+        )
+        self.settings_override.enable()
+        ingest._log = None
+        self.base_voting = Voting.objects.create(
+            planned_start=timezone.datetime(2025, 6, 2, 8, 30, 0, tzinfo=pytz.utc),
+            planned_end=timezone.datetime(2025, 6, 15, 19, 30, 0, tzinfo=pytz.utc),
+            votes_per_user=2
+        )
+        for i in range(4):
+            candidate = Candidate.objects.create(
+                first_name=f"Jan{i}",
+                last_name=f"Nowak{i}",
+                school_class="1 TI"
+            )
+            registration = CandidateRegistration.objects.create(
+                candidate=candidate,
+                voting=self.base_voting,
+                is_eligible=True
+            )
+            ElectoralProgram.objects.create(
+                candidature=registration,
+                info="Testowy program wyborczy"
+            )
+        self.registration_ids = list(
+            CandidateRegistration.objects.filter(voting=self.base_voting).order_by('id').values_list('id', flat=True)
+        )
+        self.users = list(AzureUser.objects.all()[:3])
+
+    def tearDown(self):
+        if ingest._log is not None:
+            ingest._log.close()
+        ingest._log = None
+        self.settings_override.disable()
+        self.log_dir.cleanup()
+
+    def _enqueue(self, user, registration_ids):
+        ingest.enqueue_ballot(BallotSnapshot(self.base_voting, user), registration_ids)
+
+    def _segments(self, suffix):
+        return sorted(Path(self.log_dir.name).glob(f'*{suffix}'))
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_enqueue_and_flush(self):
+        self._enqueue(self.users[0], self.registration_ids[:2])
+        self._enqueue(self.users[1], self.registration_ids[1:3])
+        # Karta jest potwierdzona, ale jeszcze nie ma jej w bazie danych
+        self.assertEqual(Ballot.objects.count(), 0)
+        self.assertTrue(ingest.is_reserved(self.base_voting, self.users[0]))
+        ingest.get_log().close()
+        ballots, votes = ingest.flush_log()
+        self.assertEqual((ballots, votes), (2, 4))
+        self.assertEqual(Ballot.objects.filter(voting=self.base_voting).count(), 2)
+        self.assertEqual(Vote.objects.filter(ballot__microsoft_user=self.users[0]).count(), 2)
+        tallies = dict(VoteTally.objects.values_list('registration_id', 'count'))
+        self.assertEqual(tallies[self.registration_ids[1]], 2)
+        self.assertEqual(self._segments('.sealed'), [])
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_second_ballot_rejected(self):
+        self._enqueue(self.users[0], self.registration_ids[:2])
+        with self.assertRaises(ValidationError) as context:
+            self._enqueue(self.users[0], self.registration_ids[2:4])
+        self.assertEqual(context.exception.code, 'vote_limit_reached')
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_invalid_ballot_not_logged(self):
+        with self.assertRaises(ValidationError) as context:
+            self._enqueue(self.users[0], self.registration_ids[:3])
+        self.assertEqual(context.exception.code, 'vote_limit_reached')
+        self.assertFalse(ingest.is_reserved(self.base_voting, self.users[0]))
+        self.assertEqual(self._segments('.open'), [])
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_replay_is_idempotent(self):
+        self._enqueue(self.users[0], self.registration_ids[:2])
+        ingest.get_log().close()
+        segment = self._segments('.sealed')[0]
+        content = segment.read_bytes()
+        ingest.flush_log()
+        # Ten sam segment przetworzony ponownie, np. awaria między zatwierdzeniem transakcji a usunięciem pliku
+        segment.write_bytes(content)
+        self.assertEqual(ingest.flush_log(), (1, 0))
+        self.assertEqual(Vote.objects.count(), 2)
+        self.assertEqual(sum(VoteTally.objects.values_list('count', flat=True)), 2)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_ballot_already_in_database(self):
+        cast_ballot(BallotSnapshot(self.base_voting, self.users[0]), self.registration_ids[:1])
+        record = {
+            'voting_id': self.base_voting.id,
+            'user_id': self.users[0].pk,
+            'registration_ids': self.registration_ids[2:4],
+            'created_at': timezone.now().isoformat(),
+        }
+        self.assertEqual(ingest.flush_records([record]), 0)
+        self.assertEqual(Vote.objects.filter(microsoft_user=self.users[0]).count(), 1)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_recover_abandoned_segment(self):
+        record = {
+            'voting_id': self.base_voting.id,
+            'user_id': self.users[2].pk,
+            'registration_ids': self.registration_ids[:2],
+            'created_at': timezone.now().isoformat(),
+        }
+        # Segment procesu, który przestał działać: brak blokady i niepełny ostatni zapis
+        segment = Path(self.log_dir.name) / '00000000000000000001-1-1.open'
+        segment.write_bytes(json.dumps(record).encode() + b'\n' + b'{"voting_id": ')
+        out = StringIO()
+        call_command('flush_vote_log', stdout=out)
+        self.assertIn('wstawione głosy: 2', out.getvalue())
+        self.assertFalse(segment.exists())
+        self.assertEqual(Ballot.objects.filter(microsoft_user=self.users[2]).count(), 1)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_active_segment_is_kept(self):
+        self._enqueue(self.users[0], self.registration_ids[:2])
+        offsets = {}
+        self.assertEqual(ingest.flush_log(offsets=offsets), (1, 2))
+        # Segment aktywnego procesu zostaje, kolejny przebieg czyta tylko nowe rekordy
+        self.assertEqual(len(self._segments('.open')), 1)
+        self._enqueue(self.users[1], self.registration_ids[2:4])
+        self.assertEqual(ingest.flush_log(offsets=offsets), (1, 2))
+        self.assertEqual(Vote.objects.count(), 4)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_log_usable_after_failed_seal(self):
+        self._enqueue(self.users[0], self.registration_ids[:2])
+        # Segment zniknął przed zamknięciem, np. usunięty ręcznie
+        self._segments('.open')[0].unlink()
+        with self.assertRaises(FileNotFoundError):
+            ingest.get_log().close()
+        # Kolejna karta trafia do nowego segmentu zamiast zamkniętego pliku
+        self._enqueue(self.users[1], self.registration_ids[2:4])
+        self.assertEqual(len(self._segments('.open')), 1)
@@ -0,0 +1,132 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.timezone import timedelta
+
+import asyncio
+from unittest import mock
+from asgiref.sync import sync_to_async
+
+from samorzad.models import Voting, Candidate, CandidateRegistration, ElectoralProgram
+from samorzad.ballot import BallotSnapshot, cast_ballot
+from samorzad import live, results
+from office_auth.models import AzureUser
+
+
+@override_settings(SAMORZAD_LIVE_RESULTS_INTERVAL=0.01, SAMORZAD_ASYNC_VIEWS=True)
+class LiveResultsTest(TestCase):
+    fixtures = ['azure_users_fixture.json']
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        voting = Voting.objects.create(
+            planned_start=now + timedelta(hours=1),
+            planned_end=now + timedelta(days=1),
+            votes_per_user=2
+        )
+        for i in range(3):
+            candidate = Candidate.objects.create(
+                first_name=f"Jan{i}",
+                last_name=f"Nowak{i}",
+                school_class="1 TI"
+            )
+            registration = CandidateRegistration.objects.create(
+                candidate=candidate,
+                voting=voting,
+                is_eligible=True
+            )
+            ElectoralProgram.objects.create(
+                candidature=registration,
+                info="Testowy program wyborczy"
+            )
+        # Głosowanie trwające. Voting.clean nie pozwala utworzyć głosowania z przeszłą datą startu,
+        # a CandidateRegistration.clean dodać kandydatury do trwającego głosowania
+        Voting.objects.filter(pk=voting.pk).update(planned_start=now - timedelta(hours=1))
+        self.base_voting = Voting.objects.get(pk=voting.pk)
+        self.registration_ids = list(
+            CandidateRegistration.objects.filter(voting=self.base_voting).order_by('id').values_list('id', flat=True)
+        )
+        self.users = list(AzureUser.objects.all()[:3])
+        self._cast(self.users[0], self.registration_ids[:2])
+
+    def _cast(self, user, registration_ids):
+        cast_ballot(BallotSnapshot(self.base_voting, user), registration_ids)
+        # TestCase nie zatwierdza transakcji, więc wersja wyników jest podbijana ręcznie
+        results.bump_results_version(self.base_voting.id)
+
+    async def test_broadcaster_shares_one_event(self):
+        broadcaster = live.get_broadcaster(self.base_voting)
+        first_queue = broadcaster.subscribe()
+        second_queue = broadcaster.subscribe()
+        try:
+            first_event = await asyncio.wait_for(first_queue.get(), timeout=5)
+            second_event = await asyncio.wait_for(second_queue.get(), timeout=5)
+            self.assertIs(first_event, second_event)
+            self.assertIs(live.get_broadcaster(self.base_voting), broadcaster)
+            self.assertEqual(first_event['votes_count'], 2)
+            self.assertEqual(first_event['tallies'][self.registration_ids[0]], 1)
+            self.assertEqual(first_event['delta'], {})
+        finally:
+            broadcaster.unsubscribe(first_queue)
+            broadcaster.unsubscribe(second_queue)
+        self.assertNotIn(self.base_voting.id, live._broadcasters)
+
+    async def test_broadcaster_pushes_delta(self):
+        broadcaster = live.get_broadcaster(self.base_voting)
+        queue = broadcaster.subscribe()
+        try:
+            await asyncio.wait_for(queue.get(), timeout=5)
+            await sync_to_async(self._cast)(self.users[1], self.registration_ids[1:3])
+            event = await asyncio.wait_for(queue.get(), timeout=5)
+            self.assertEqual(event['votes_count'], 4)
+            self.assertEqual(event['delta'], {self.registration_ids[1]: 1, self.registration_ids[2]: 1})
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    async def test_stream_ends_after_voting(self):
+        self.base_voting.planned_end = timezone.now() - timedelta(seconds=1)
+        chunks = [chunk async for chunk in live.event_stream(self.base_voting)]
+        self.assertEqual(chunks[-1], 'event: end\ndata: {}\n\n')
+
+    async def test_stream_closed_without_end_on_error(self):
+        with mock.patch.object(live, 'get_cached_chart_data', side_effect=RuntimeError), \
+                self.assertLogs('samorzad.live', level='ERROR'):
+            chunks = [chunk async for chunk in live.event_stream(self.base_voting)]
+        # Bez zdarzenia end EventSource połączy się ponownie
+        self.assertEqual(chunks, [])
+
+    async def test_stream_results(self):
+        await sync_to_async(self.async_client.force_login)(self.users[0])
+        response = await self.async_client.get(
+            reverse('samorzad:stream_results', kwargs={'voting_id': self.base_voting.id})
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        try:
+            chunk = await asyncio.wait_for(anext(stream), timeout=5)
+            self.assertTrue(chunk.startswith(b'id: '))
+            self.assertIn(b'event: results', chunk)
+        finally:
+            await stream.aclose()
+
+    def test_stream_requires_ballot(self):
+        self.client.force_login(self.users[2])
+        response = self.client.get(reverse('samorzad:stream_results', kwargs={'voting_id': self.base_voting.id}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_stream_finished_voting(self):
+        Voting.objects.filter(pk=self.base_voting.pk).update(planned_end=timezone.now() - timedelta(minutes=1))
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse('samorzad:stream_results', kwargs={'voting_id': self.base_voting.id}))
+        self.assertEqual(response.status_code, 204)
+
+    @override_settings(SAMORZAD_ASYNC_VIEWS=False)
+    def test_stream_disabled_without_asgi(self):
+        # Pod WSGI strumień blokowałby workera do końca głosowania
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse('samorzad:stream_results', kwargs={'voting_id': self.base_voting.id}))
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get(reverse('samorzad:get_voting_details', kwargs={'voting_id': self.base_voting.id}))
+        self.assertNotContains(response, 'EventSource')
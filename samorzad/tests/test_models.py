@@ -394,6 +394,18 @@ class VoteModelTest(TransactionTestCase):
             for error in error_list:
                 codes.append(error.code)
         self.assertEqual(codes[0], 'vote_dupliaction')
+        self.assertEqual(Vote.objects.filter(candidate_registration=candidature).count(), 1)
+
+    @freeze_time('2025-06-02 08:31:00')
+    def test_vote_duplicate_rejected_by_database(self):
+        # bulk_create pomija Vote.save/full_clean, duplikat odrzuca ograniczenie unique_vote_per_registration
+        candidature = CandidateRegistration.objects.filter(voting=self.base_voting, is_eligible=True).first()
+        Vote.objects.create(
+            candidate_registration=candidature,
+            microsoft_user=self.azure_user
+        )
+        with self.assertRaises(IntegrityError):
+            Vote.objects.bulk_create([Vote(candidate_registration=candidature, microsoft_user=self.azure_user)])
 
     @freeze_time('2025-06-02 08:31:00')
     def test_vote_amount_per_voter(self):
@@ -0,0 +1,187 @@
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+import pytz
+from unittest import mock
+from io import StringIO
+from freezegun import freeze_time
+
+from samorzad.models import Voting, Candidate, CandidateRegistration, ElectoralProgram, VotingResultSnapshot
+from samorzad.ballot import BallotSnapshot, cast_ballot
+from samorzad import results
+from office_auth.models import AzureUser
+
+
+class ResultsTestMixin:
+    fixtures = ['azure_users_fixture.json']
+
+    @freeze_time('2025-06-01 12:00:00')
+    def setUp(self):
+        cache.clear()
+        self.base_voting = Voting.objects.create(
+            planned_start=timezone.datetime(2025, 6, 2, 8, 30, 0, tzinfo=pytz.utc),
+            planned_end=timezone.datetime(2025, 6, 2, 14, 30, 0, tzinfo=pytz.utc),
+            votes_per_user=2
+        )
+        for i in range(4):
+            candidate = Candidate.objects.create(
+                first_name=f"Jan{i}",
+                last_name=f"Nowak{i}",
+                school_class="1 TI"
+            )
+            registration = CandidateRegistration.objects.create(
+                candidate=candidate,
+                voting=self.base_voting,
+                is_eligible=True
+            )
+            ElectoralProgram.objects.create(
+                candidature=registration,
+                info="Testowy program wyborczy"
+            )
+        self.registrations = list(
+            CandidateRegistration.objects.filter(voting=self.base_voting).select_related('candidate').order_by('id')
+        )
+        self.users = list(AzureUser.objects.all()[:3])
+        with freeze_time('2025-06-02 08:45:00'):
+            self._cast(self.users[0], [self.registrations[0].id, self.registrations[1].id])
+        with freeze_time('2025-06-02 10:05:00'):
+            self._cast(self.users[1], [self.registrations[0].id, self.registrations[2].id])
+        with freeze_time('2025-06-02 10:59:59'):
+            self._cast(self.users[2], [self.registrations[0].id])
+
+    def _cast(self, user, registration_ids):
+        return cast_ballot(BallotSnapshot(self.base_voting, user), registration_ids)
+
+    def _series(self, timeline_data, registration):
+        return next(item['series'] for item in timeline_data['candidates'] if item['id'] == registration.candidate_id)
+
+
+class TimelineDataTest(ResultsTestMixin, TestCase):
+
+    @freeze_time('2025-06-03 12:00:00')
+    def test_finished_voting_timeline(self):
+        data = results.get_timeline_data(self.base_voting)
+        # 10:30 czasu polskiego (08:30 UTC) do godziny po zakończeniu głosowania
+        self.assertEqual(data['timeline'][0], '2025-06-02 10:00')
+        self.assertEqual(data['timeline'][-1], '2025-06-02 17:00')
+        first = self._series(data, self.registrations[0])
+        self.assertEqual(len(first), len(data['timeline']))
+        self.assertEqual(first, [0, 1, 1, 3, 3, 3, 3, 3])
+        third = self._series(data, self.registrations[2])
+        self.assertEqual(third, [0, 0, 0, 1, 1, 1, 1, 1])
+
+    @freeze_time('2025-06-02 11:20:00')
+    def test_live_voting_timeline(self):
+        data = results.get_timeline_data(self.base_voting)
+        self.assertEqual(data['timeline'][-1], '2025-06-02 13:00')
+        self.assertEqual(self._series(data, self.registrations[0]), [0, 1, 1, 3])
+
+    @freeze_time('2025-06-03 12:00:00')
+    def test_buckets_match_raw_votes(self):
+        self.assertEqual(
+            results.get_timeline_data(self.base_voting),
+            results.get_timeline_data(self.base_voting, from_votes=True)
+        )
+
+
+class ResultsCacheTest(ResultsTestMixin, TestCase):
+
+    def _votes(self, chart_data):
+        return [item['votes_count'] for item in chart_data]
+
+    @freeze_time('2025-06-02 12:00:00')
+    def test_chart_data_cached_per_version(self):
+        self.assertEqual(self._votes(results.get_cached_chart_data(self.base_voting)), [3, 1, 1, 0])
+        with self.assertNumQueries(0):
+            results.get_cached_chart_data(self.base_voting)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._cast(AzureUser.objects.all()[3], [self.registrations[3].id])
+        self.assertEqual(self._votes(results.get_cached_chart_data(self.base_voting)), [3, 1, 1, 1])
+
+    @freeze_time('2025-06-02 12:00:00')
+    def test_timeline_data_cached_per_version(self):
+        self.assertEqual(self._series(results.get_cached_timeline_data(self.base_voting), self.registrations[0])[-1], 3)
+        with self.assertNumQueries(0):
+            results.get_cached_timeline_data(self.base_voting)
+        with freeze_time('2025-06-02 11:10:00'), self.captureOnCommitCallbacks(execute=True):
+            self._cast(AzureUser.objects.all()[3], [self.registrations[0].id])
+        self.assertEqual(self._series(results.get_cached_timeline_data(self.base_voting), self.registrations[0])[-1], 4)
+
+    @freeze_time('2025-06-02 12:00:00')
+    def test_rejected_ballot_keeps_version(self):
+        version = results.get_results_version(self.base_voting.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValidationError):
+                self._cast(self.users[0], [self.registrations[3].id])
+        self.assertEqual(results.get_results_version(self.base_voting.id), version)
+
+    @override_settings(SAMORZAD_RESULTS_CACHE_TTL_LIVE=60, SAMORZAD_RESULTS_CACHE_TTL_FINISHED=3600)
+    def test_finished_voting_cached_longer(self):
+        with mock.patch.object(results.cache, 'set', wraps=results.cache.set) as cache_set:
+            with freeze_time('2025-06-02 12:00:00'):
+                results.get_cached_chart_data(self.base_voting)
+            with freeze_time('2025-06-03 12:00:00'):
+                results.get_chart_results(self.base_voting)
+        self.assertEqual([call.kwargs['timeout'] for call in cache_set.call_args_list], [60, 3600])
+
+
+class ResultSnapshotTest(ResultsTestMixin, TestCase):
+
+    @freeze_time('2025-06-02 12:00:00')
+    def test_finalize_before_end(self):
+        with self.assertRaises(ValidationError) as context:
+            results.finalize_voting(self.base_voting)
+        self.assertEqual(context.exception.code, 'voting_not_finished')
+        self.assertFalse(VotingResultSnapshot.objects.exists())
+
+    @freeze_time('2025-06-03 12:00:00')
+    def test_finalize_voting(self):
+        snapshot = results.finalize_voting(self.base_voting)
+        self.assertEqual(snapshot.votes_count, 5)
+        self.assertEqual(snapshot.voters_count, 3)
+        self.assertEqual(snapshot.candidates_count, 4)
+        self.assertEqual(snapshot.ranking[0], self.registrations[0].id)
+        self.assertEqual(snapshot.ranking[-1], self.registrations[3].id)
+        self.assertEqual(snapshot.chart, results.get_chart_data(self.base_voting))
+        # Ponowne wywołanie zwraca zapisany snapshot
+        self.assertEqual(results.finalize_voting(self.base_voting).pk, snapshot.pk)
+        self.assertEqual(VotingResultSnapshot.objects.count(), 1)
+
+    @freeze_time('2025-06-03 12:00:00')
+    def test_finished_voting_reads_only_snapshot(self):
+        results.finalize_voting(self.base_voting)
+        voting = Voting.objects.select_related('result_snapshot').get(pk=self.base_voting.pk)
+        with self.assertNumQueries(0):
+            chart_data = results.get_chart_results(voting)
+            timeline_data = results.get_timeline_results(voting)
+        self.assertEqual([item['votes_count'] for item in chart_data], [3, 1, 1, 0])
+        self.assertEqual(self._series(timeline_data, self.registrations[0])[-1], 3)
+        # Kolejność kandydatów ze snapshotu jest taka sama jak wyników na żywo (po imieniu i nazwisku)
+        self.assertEqual(timeline_data['candidates'], results.get_timeline_data(voting)['candidates'])
+
+    @freeze_time('2025-06-03 12:00:00')
+    def test_finished_voting_without_snapshot_does_not_write(self):
+        voting = Voting.objects.get(pk=self.base_voting.pk)
+        self.assertEqual([item['votes_count'] for item in results.get_chart_results(voting)], [3, 1, 1, 0])
+        self.assertEqual(self._series(results.get_timeline_results(voting), self.registrations[0])[-1], 3)
+        self.assertFalse(VotingResultSnapshot.objects.exists())
+
+    @freeze_time('2025-06-03 12:00:00')
+    def test_snapshot_is_immutable(self):
+        snapshot = results.finalize_voting(self.base_voting)
+        snapshot.votes_count = 100
+        with self.assertRaises(ValidationError) as context:
+            snapshot.save()
+        codes = []
+        for field, error_list in context.exception.error_dict.items():
+            for error in error_list:
+                codes.append(error.code)
+        self.assertIn('snapshot_action_forbidden', codes)
+
+    @freeze_time('2025-06-03 12:00:00')
+    def test_finalize_votings_command(self):
+        call_command('finalize_votings', stdout=StringIO())
+        self.assertEqual(VotingResultSnapshot.objects.get(voting=self.base_voting).votes_count, 5)
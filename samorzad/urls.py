@@ -1,14 +1,28 @@
 from django.urls import path
+from django.conf import settings
 from . import views
 
 app_name="samorzad"
 
+# W trybie ASGI (ekonomvote/asgi.py) publiczne widoki odczytu są obsługiwane przez wersje asynchroniczne
+if settings.SAMORZAD_ASYNC_VIEWS:
+    list_votings = views.list_votings_async
+    partial_list_old_votings = views.partial_list_old_votings_async
+    get_timeline_data = views.get_timeline_data_async
+    get_chart_data = views.get_chart_data_async
+else:
+    list_votings = views.list_votings
+    partial_list_old_votings = views.partial_list_old_votings
+    get_timeline_data = views.get_timeline_data
+    get_chart_data = views.get_chart_data
+
 urlpatterns = [
-    path('', views.list_votings, name="index"),
+    path('', list_votings, name="index"),
     # API urls
-    path('glosowania/timeline/<int:voting_id>', views.get_timeline_data, name="get_timeline_data"),
-    path('glosowania/chart/<int:voting_id>', views.get_chart_data, name="get_chart_data"),
+    path('glosowania/timeline/<int:voting_id>', get_timeline_data, name="get_timeline_data"),
+    path('glosowania/chart/<int:voting_id>', get_chart_data, name="get_chart_data"),
+    path('glosowania/live/<int:voting_id>', views.stream_results, name="stream_results"),
     path('glosowania/<int:voting_id>', views.get_voting_details, name='get_voting_details'),
     # PARTIALS
-    path('glosowania/partial/zaladuj-glosowania', views.partial_list_old_votings, name="partial_list_old_votings")
-]
\ No newline at end of file
+    path('glosowania/partial/zaladuj-glosowania', partial_list_old_votings, name="partial_list_old_votings")
+]
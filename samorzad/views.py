@@ -1,24 +1,25 @@
 from django.shortcuts import render, redirect, reverse, get_object_or_404
-from django.http import HttpRequest, HttpResponseNotAllowed, HttpResponse,  HttpResponseForbidden
+from django.http import HttpRequest, HttpResponseNotAllowed, HttpResponse,  HttpResponseForbidden, StreamingHttpResponse, Http404
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.utils import timezone, dateparse
 from django.contrib import messages
-from django.db.models import Count
 from django.core.exceptions import ValidationError
-from django.db.models import F, Exists, OuterRef, Q
+from django.db.models import F, Exists, OuterRef
 from django.views.decorators.http import require_http_methods
-from django.core.paginator import Paginator
 from django.forms import formset_factory
-from django.utils.timezone import datetime, timedelta
+from asgiref.sync import sync_to_async
 
-from collections import defaultdict
-import pytz
 import json
 
 from office_auth.models import AzureUser
 from office_auth.auth_utils import is_opiekun
-from .models import Voting, Candidate, Vote, ElectoralProgram, CandidateRegistration
+from ekonomvote.decorators import async_login_required, async_require_http_methods
+from ekonomvote.pagination import KeysetPaginator
+from .models import Voting, Candidate, Vote, Ballot, ElectoralProgram, CandidateRegistration
 from .forms import VoteForm, BaseVoteFormSet
+from .ballot import BallotSnapshot, cast_ballot
+from . import results, live, ingest
 
 
 @require_http_methods(['GET'])
@@ -28,121 +29,41 @@ def list_votings(request: HttpRequest):
     fresh_voting = Voting.objects.filter(
         planned_start__lte=now,
         planned_end__gt=now
-    ).annotate(
-        votes_count=Count('candidate_registrations__votes', distinct=True)
-    ).annotate(
-        registrations_count=Count('candidate_registrations', filter=Q(candidate_registrations__is_eligible=True), distinct=True)
     ).order_by('planned_start').first()
     return render(request, 'samorzad/samorzad_index.html', {
         'fresh_voting': fresh_voting,
     })
 
+def _old_votings_paginator():
+    """Zakończone głosowania od najnowszych, stronicowane kursorem po (planned_end, id) bez zapytania COUNT.
+    Granica planned_end <= teraz uzupełnia listę trwających (planned_end > teraz, list_votings). Kursor
+    wskazuje ostatnie głosowanie strony, a głosowania kończące się między kolejnymi stronami mają późniejsze
+    planned_end, więc trafiają przed kursor i strony się nie powtarzają"""
+    old_votings = Voting.objects.filter(planned_end__lte=timezone.now())
+    return KeysetPaginator(old_votings, ordering=('-planned_end', '-id'), per_page=9)
+
+
 @login_required(login_url='office_auth:microsoft_login')
 @require_http_methods(['GET'])
 def partial_list_old_votings(request:HttpRequest):
-    try:
-        page_num = int(request.GET.get('page', 1))
-    except ValueError:
-        page_num = 1
-    now = timezone.now()
-    old_votings = Voting.objects.filter(
-        planned_end__lte=now
-    ).annotate(
-        candidates_count=Count('candidate_registrations', filter=Q(candidate_registrations__is_eligible=True), distinct=True),
-        votes_count=Count('candidate_registrations__votes', distinct=True)
-    ).order_by('-planned_end')
-    paginator = Paginator(old_votings, 9)
-    page_obj = paginator.get_page(page_num)
+    # Liczby kandydatów i głosów pochodzą z liczników głosowania (samorzad.models.Voting)
+    page_obj = _old_votings_paginator().get_page(request.GET.get('cursor'))
     return render(request, 'samorzad/partials/old_votings_list.html', context={
-        'page_num':page_num,
         'page_obj':page_obj,
-        "has_next": page_obj.has_next()
+        'has_next':page_obj.has_next,
+        'next_cursor':page_obj.next_cursor,
     })
 
 
 
 # PARTIAL views
-# Widok powinno się cachować
+# Wyniki zakończonych głosowań pochodzą ze snapshotu, trwających z cache wersjonowanego po zapisie karty (samorzad.results)
 @require_http_methods(['GET'])
 @login_required(login_url='office_auth:microsoft_login')
 def get_timeline_data(request, voting_id):
     voting = get_object_or_404(Voting, pk=voting_id)
-    warsaw_tz = pytz.timezone('Europe/Warsaw')
-
-    # Określenie pełnego zakresu czasowego
-    start_time = voting.planned_start.astimezone(warsaw_tz).replace(minute=0, second=0, microsecond=0)
-    if voting.planned_end <= timezone.now():
-        current_time = voting.planned_end.astimezone(warsaw_tz).replace(minute=0, second=0, microsecond=0) + timedelta(
-            hours=1)
-    else:
-        current_time = datetime.now(warsaw_tz).replace(minute=0, second=0, microsecond=0)
-
-
-    # Generowanie wszystkich godzin w zakresie (kluczowe dla Chart.js!)
-    all_hours = []
-    current_hour = start_time
-    while current_hour <= current_time:
-        all_hours.append(current_hour)
-        current_hour += timedelta(hours=1)
-
-    votes = Vote.objects.filter(
-        candidate_registration__voting=voting.id
-    ).select_related(
-        'candidate_registration__candidate'
-    ).only(
-        'created_at',
-        'candidate_registration__id',
-        'candidate_registration__candidate__id',
-        'candidate_registration__candidate__first_name',
-        'candidate_registration__candidate__last_name'
-    ).order_by('created_at')
-
-    # Struktura danych dla Chart.js
-    timeline_data = {
-        "timeline": [],
-        "candidates": {}
-    }
-
-    # Inicjalizacja wszystkich kandydatów
-    registrations = CandidateRegistration.objects.filter(
-        voting=voting,
-        is_eligible=True
-    ).select_related('candidate').order_by('candidate__first_name', 'candidate__last_name')
-
-    for reg in registrations:
-        timeline_data["candidates"][reg.candidate.id] = {
-            "name": f"{reg.candidate.first_name} {reg.candidate.last_name}",
-            "votes": []  # Będzie miał dokładnie len(all_hours) elementów
-        }
-
-    # Grupowanie głosów do godzinowych kubełków
-    vote_buckets = defaultdict(lambda: defaultdict(int))
-    for vote in votes:
-        timestamp = vote.created_at.astimezone(warsaw_tz).replace(
-            minute=0, second=0, microsecond=0
-        ) + timedelta(hours=1)
-        candidate_id = vote.candidate_registration.candidate.id
-        vote_buckets[timestamp][candidate_id] += 1
-
-    # KLUCZOWE: Budowanie timeline dla WSZYSTKICH godzin
-    vote_counts = defaultdict(int)  # Skumulowane liczniki
-
-    for timestamp in all_hours:
-        # Dodaj godzinę do timeline
-        timeline_data["timeline"].append(timestamp.strftime("%Y-%m-%d %H:%M"))
-
-        # Dla każdego kandydata dodaj głosy z tej godziny i zaktualizuj skumulowaną wartość
-        for cand_id in timeline_data["candidates"]:
-            # Dodaj głosy z tej konkretnej godziny (0 jeśli brak)
-            vote_counts[cand_id] += vote_buckets[timestamp].get(cand_id, 0)
-            # Dodaj skumulowaną wartość do tablicy (zawsze!)
-            timeline_data["candidates"][cand_id]["votes"].append(vote_counts[cand_id])
-
-    # Weryfikacja: wszystkie tablice muszą mieć tę samą długość
-    timeline_length = len(timeline_data["timeline"])
-    for cand_id, cand_data in timeline_data["candidates"].items():
-        assert len(cand_data["votes"]) == timeline_length, f"Kandydat {cand_id} ma nieprawidłową długość danych"
-
+    # Kubełkowanie i sumy skumulowane są liczone w bazie danych (samorzad.results.get_timeline_data)
+    timeline_data = results.get_timeline_results(voting)
     return render(request, 'samorzad/experimental_timeline_template.html', context={
         'timeline_data': json.dumps(timeline_data, ensure_ascii=False),
     })
@@ -151,47 +72,55 @@ def get_timeline_data(request, voting_id):
 @login_required(login_url='office_auth:microsoft_login')
 def get_chart_data(request:HttpRequest, voting_id:int):
     voting = get_object_or_404(Voting, pk=voting_id)
-    registrations = CandidateRegistration.objects.filter(
-        voting=voting,
-        is_eligible=True
-    ).prefetch_related(
-        'votes'
-    ).select_related('candidate').annotate(
-        votes_count=Count('votes')
-    ).order_by('candidate__first_name', 'candidate__last_name')
-    total_votes = Vote.objects.filter(
-        candidate_registration__voting=voting
-    ).count()
-    results = []
-    for reg in registrations.select_related('candidate'):
-        percentage = (reg.votes_count / total_votes * 100) if total_votes > 0 else 0
-        results.append({
-            "candidate": {
-                'first_name':reg.candidate.first_name,
-                'second_name':reg.candidate.second_name,
-                'last_name':reg.candidate.last_name,
-                'school_class':reg.candidate.school_class
-            },
-            "votes_count": reg.votes_count,
-            "percentage": round(percentage, 2),
-        })
-    results.sort(key=lambda d:d['votes_count'], reverse=True)
+    chart_data = results.get_chart_results(voting)
     return render(request, 'samorzad/experimental_chart_template.html', context={
-        'results':json.dumps(results, ensure_ascii=False),
+        'results':json.dumps(chart_data, ensure_ascii=False),
     })
 
+@async_require_http_methods(['GET'])
+@async_login_required(login_url='office_auth:microsoft_login')
+async def stream_results(request: HttpRequest, voting_id: int):
+    """Wyniki trwającego głosowania na żywo (Server-Sent Events). Wymaga serwowania przez ASGI
+    (SAMORZAD_ASYNC_VIEWS). Pod WSGI StreamingHttpResponse odczytuje cały strumień przed wysłaniem odpowiedzi,
+    więc blokowałby workera do końca głosowania. Wtedy zwracane jest 204, a wykres pokazuje wyniki z chwili
+    załadowania strony"""
+    if not settings.SAMORZAD_ASYNC_VIEWS:
+        # 204 zatrzymuje ponowne łączenie EventSource
+        return HttpResponse(status=204)
+    voting = await Voting.objects.filter(pk=voting_id).afirst()
+    if voting is None:
+        raise Http404()
+    # Tak jak w get_voting_details wyniki widzą tylko głosujący, którzy oddali kartę, oraz opiekunowie
+    user = request.user
+    can_see_results = await sync_to_async(
+        lambda: is_opiekun(user, request.session) or Ballot.objects.filter(voting=voting, microsoft_user=user).exists() or
+                (ingest.is_buffered() and ingest.is_reserved(voting, user))
+    )()
+    if not can_see_results:
+        return HttpResponseForbidden()
+    if results.is_finished(voting):
+        # 204 zatrzymuje ponowne łączenie EventSource, wyniki zakończonego głosowania są w snapshocie
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(live.event_stream(voting), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 # READ/CREATE views
 
 @login_required(login_url='office_auth:microsoft_login')
 @require_http_methods(["GET", "POST"])
 def get_voting_details(request:HttpRequest, voting_id:int):
     voting = get_object_or_404(Voting, id=voting_id)
-    can_vote = not is_opiekun(request.user)
+    can_vote = not is_opiekun(request.user, request.session)
     if request.method == 'GET':
-        user_has_voted = CandidateRegistration.objects.filter(voting=voting.id,
-                                                              votes__microsoft_user=request.user).exists() or is_opiekun(request.user)
-        votes_count = Vote.objects.select_related('candidate_registration').filter(
-            candidate_registration__voting=voting).count()
+        user_has_voted = (
+            not can_vote or
+            Ballot.objects.filter(voting=voting, microsoft_user=request.user).exists() or
+            (ingest.is_buffered() and ingest.is_reserved(voting, request.user))
+        )
+        snapshot = results.get_result_snapshot(voting) if results.is_finished(voting) else None
+        votes_count = snapshot.votes_count if snapshot is not None else voting.votes_count
         registrations = CandidateRegistration.objects.filter(
             voting=voting,
             is_eligible=True
@@ -215,6 +144,9 @@ def get_voting_details(request:HttpRequest, voting_id:int):
             'votes_count':votes_count,
             'user_has_voted':user_has_voted,
             'can_vote':can_vote,
+            'is_live':voting.planned_start <= timezone.now() and not results.is_finished(voting),
+            # Strumień wyników na żywo działa tylko w trybie ASGI (stream_results)
+            'live_results':settings.SAMORZAD_ASYNC_VIEWS,
             #'winner_id':winner_id,
         })
     if request.method == 'POST':
@@ -225,14 +157,20 @@ def get_voting_details(request:HttpRequest, voting_id:int):
             formset=BaseVoteFormSet,
             extra=voting.votes_per_user
         )
-        formset = VoteFormFactory(request.POST, voting=voting)
+        snapshot = BallotSnapshot(voting, request.user)
+        formset = VoteFormFactory(request.POST, voting=voting, registrations=snapshot.registrations)
         if formset.is_valid():
-            for form in formset:
-                vote_data = form.cleaned_data
-                Vote.objects.create(
-                    candidate_registration_id = vote_data['candidate_registration_id'],
-                    microsoft_user=request.user
-                )
+            registration_ids = [
+                form.cleaned_data['candidate_registration_id']
+                for form in formset if form.cleaned_data.get('candidate_registration_id')
+            ]
+            try:
+                if ingest.is_buffered():
+                    ingest.enqueue_ballot(snapshot, registration_ids)
+                else:
+                    cast_ballot(snapshot, registration_ids)
+            except ValidationError as Ex:
+                messages.error(request, Ex.message)
         else:
             for error in formset.non_form_errors():
                 messages.error(request, error)
@@ -248,3 +186,51 @@ def get_voting_details(request:HttpRequest, voting_id:int):
 # TODO: Prowadzący kandydat może być uwidoczniony tylko po zagłosowaniu
 
 
+# ASYNC views
+# Odpowiedniki widoków odczytu dla trybu ASGI (ekonomvote/asgi.py ustawia SAMORZAD_ASYNC_VIEWS, samorzad/urls.py
+# wybiera wtedy poniższe widoki). Zapytania korzystają z asynchronicznego ORM, renderowanie szablonu (procesory
+# kontekstu mogą czytać sesję) wykonuje się w wątku
+
+@async_require_http_methods(['GET'])
+@async_login_required(login_url='office_auth:microsoft_login')
+async def list_votings_async(request: HttpRequest):
+    now = timezone.now()
+    fresh_voting = await Voting.objects.filter(
+        planned_start__lte=now,
+        planned_end__gt=now
+    ).order_by('planned_start').afirst()
+    return await sync_to_async(render)(request, 'samorzad/samorzad_index.html', {
+        'fresh_voting': fresh_voting,
+    })
+
+@async_require_http_methods(['GET'])
+@async_login_required(login_url='office_auth:microsoft_login')
+async def partial_list_old_votings_async(request: HttpRequest):
+    page_obj = await _old_votings_paginator().aget_page(request.GET.get('cursor'))
+    return await sync_to_async(render)(request, 'samorzad/partials/old_votings_list.html', context={
+        'page_obj': page_obj,
+        'has_next': page_obj.has_next,
+        'next_cursor': page_obj.next_cursor,
+    })
+
+@async_require_http_methods(['GET'])
+@async_login_required(login_url='office_auth:microsoft_login')
+async def get_timeline_data_async(request: HttpRequest, voting_id: int):
+    voting = await Voting.objects.filter(pk=voting_id).afirst()
+    if voting is None:
+        raise Http404()
+    timeline_data = await results.aget_timeline_results(voting)
+    return await sync_to_async(render)(request, 'samorzad/experimental_timeline_template.html', context={
+        'timeline_data': json.dumps(timeline_data, ensure_ascii=False),
+    })
+
+@async_require_http_methods(['GET'])
+@async_login_required(login_url='office_auth:microsoft_login')
+async def get_chart_data_async(request: HttpRequest, voting_id: int):
+    voting = await Voting.objects.filter(pk=voting_id).afirst()
+    if voting is None:
+        raise Http404()
+    chart_data = await results.aget_chart_results(voting)
+    return await sync_to_async(render)(request, 'samorzad/experimental_chart_template.html', context={
+        'results': json.dumps(chart_data, ensure_ascii=False),
+    })